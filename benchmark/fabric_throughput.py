@@ -0,0 +1,188 @@
+"""
+Throughput and latency benchmark for threat event delivery through the in-memory fabric.
+
+Threat events are published to an :class:`dxlthreateventclient.testing.InMemoryFabric` and delivered through
+a :class:`dxlthreateventclient.client.CommonThreatEventClient` to a counting callback. Events are published
+either by a :class:`dxlthreateventclient.testing.LoadGenerator` at a constant rate, or as fast as possible by
+a :class:`dxlthreateventclient.publisher.ThreatEventPublisher` (sending synchronously from several threads,
+or in throughput mode). For each scenario, the achieved delivery rate and the 99th percentile latency (from
+publishing an event to the completion of its callback) are compared against their budgets, and every event
+must be delivered exactly once. The script exits with a non-zero status if any budget is exceeded or any
+event is lost, so it can be run as a gate in CI:
+
+    python benchmark/fabric_throughput.py
+
+No DXL broker is required. The behaviour of the individual callbacks is covered by the tests in ``tests``.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from dxlthreateventclient.callbacks import CommonThreatEventCallback
+from dxlthreateventclient.client import CommonThreatEventClient, EPO_THREAT_EVENT_RESPONSE_TOPIC
+from dxlthreateventclient.constants import ThreatEventProps, EventProps
+from dxlthreateventclient.testing import InMemoryFabric, FakeDxlClient, LoadGenerator, constant_profile, \
+    create_sample_threat_event
+
+# The rate (events per second) at which events are injected by the load generator
+RATE = 4000
+
+# The minimum delivery rate (events per second) of every scenario
+MIN_RATE = RATE * 0.9
+
+# The number of events published per scenario
+EVENT_COUNT = 12000
+
+# The number of fabric threads delivering events to callbacks
+THREAD_POOL_SIZE = 4
+
+# The number of threads publishing events in the publisher scenarios
+PUBLISHER_THREADS = 4
+
+# The maximum amount of time (in seconds) to wait for events to be delivered and drained
+TIMEOUT = 30.0
+
+
+class CountingCallback(CommonThreatEventCallback):
+    """
+    Counts the threat events it receives by event identifier.
+    """
+
+    def __init__(self):
+        super(CountingCallback, self).__init__()
+        self._lock = threading.Lock()
+        self.event_ids = Counter()
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        event_id = threat_event_dict[ThreatEventProps.EVENT][EventProps.EVENT_ID]
+        with self._lock:
+            self.event_ids[event_id] += 1
+
+
+def check_delivery(counting_callback, count):
+    """
+    Checks that each event was delivered exactly once.
+
+    :return: A ``list`` of failures
+    """
+    failures = []
+    delivered = sum(counting_callback.event_ids.values())
+    if delivered != count:
+        failures.append("{0} of {1} events delivered".format(delivered, count))
+    duplicates = sum(1 for occurrences in counting_callback.event_ids.values() if occurrences > 1)
+    if duplicates:
+        failures.append("{0} events delivered more than once".format(duplicates))
+    return failures
+
+
+def scenario_load_generator(fabric, threat_event_client, payloads):
+    counting_callback = CountingCallback()
+    threat_event_client.add_epo_threat_event_response_callback(counting_callback)
+    LoadGenerator(fabric, EPO_THREAT_EVENT_RESPONSE_TOPIC, constant_profile(RATE),
+                  payload_factory=payloads.__getitem__, payload_count=EVENT_COUNT).run(count=EVENT_COUNT)
+    fabric.wait_until_idle(TIMEOUT)
+    return check_delivery(counting_callback, EVENT_COUNT)
+
+
+def run_publisher(fabric, threat_event_client, payloads, **kwargs):
+    """
+    Publishes the payloads from several threads through a publisher created with the specified arguments.
+
+    :return: A ``list`` of failures
+    """
+    counting_callback = CountingCallback()
+    threat_event_client.add_epo_threat_event_response_callback(counting_callback)
+    publisher = threat_event_client.create_threat_event_publisher(EPO_THREAT_EVENT_RESPONSE_TOPIC, **kwargs)
+    per_thread = EVENT_COUNT // PUBLISHER_THREADS
+
+    def publish(first):
+        for index in range(first, first + per_thread):
+            publisher.publish(payloads[index])
+
+    threads = [threading.Thread(target=publish, args=(i * per_thread,)) for i in range(PUBLISHER_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    publisher.flush(TIMEOUT)
+    fabric.wait_until_idle(TIMEOUT)
+    failures = check_delivery(counting_callback, per_thread * PUBLISHER_THREADS)
+    stats = publisher.get_stats()
+    if stats["errors"] or stats["dropped"]:
+        failures.append("Publisher errors: {0}, dropped: {1}".format(stats["errors"], stats["dropped"]))
+    return failures
+
+
+def scenario_publisher(fabric, threat_event_client, payloads):
+    return run_publisher(fabric, threat_event_client, payloads)
+
+
+def scenario_publisher_throughput_mode(fabric, threat_event_client, payloads):
+    return run_publisher(fabric, threat_event_client, payloads, throughput_mode=True)
+
+
+# 99th percentile latency budgets (in milliseconds). The publisher scenarios publish as fast as possible
+# (rather than at RATE), so their events also wait in the fabric's incoming queue.
+BUDGETS = [
+    ("load-generator", scenario_load_generator, 50.0),
+    ("publisher", scenario_publisher, 500.0),
+    ("publisher-throughput-mode", scenario_publisher_throughput_mode, 500.0)
+]
+
+
+def measure(scenario, payloads):
+    """
+    Runs a scenario against a new fabric.
+
+    :param scenario: The scenario function
+    :param payloads: The encoded payloads of the events to publish
+    :return: A ``(stats, failures)`` tuple containing the fabric statistics (including the achieved delivery
+        ``rate``) and a ``list`` of failures
+    """
+    fabric = InMemoryFabric(thread_pool_size=THREAD_POOL_SIZE)
+    try:
+        with FakeDxlClient(fabric) as client:
+            threat_event_client = CommonThreatEventClient(client)
+            start = time.time()
+            failures = scenario(fabric, threat_event_client, payloads)
+            elapsed = time.time() - start
+            result = threat_event_client.close(TIMEOUT)
+    finally:
+        fabric.close(TIMEOUT)
+    stats = fabric.get_stats()
+    stats["rate"] = stats["delivered"] / elapsed
+    if result["lost"] or result["in_flight"]:
+        failures.append("Drain lost {0} events ({1} still in flight)".format(result["lost"], result["in_flight"]))
+    if stats["dropped"] or stats["errors"]:
+        failures.append("Fabric dropped {0} events, {1} callback errors".format(
+            stats["dropped"], stats["errors"]))
+    return stats, failures
+
+
+def main():
+    # Payloads are encoded up-front, so encoding is not measured
+    encoder = json.JSONEncoder(separators=(",", ":"))
+    payloads = [encoder.encode(create_sample_threat_event(index)).encode("utf-8") for index in range(EVENT_COUNT)]
+    failed = False
+    for name, scenario, budget in BUDGETS:
+        stats, failures = measure(scenario, payloads)
+        latency = stats["latency_p99"] * 1000.0
+        if stats["rate"] < MIN_RATE:
+            failures.append("Delivery rate below {0:.0f} events/s".format(MIN_RATE))
+        if latency > budget:
+            failures.append("OVER BUDGET (budget {0:.1f} ms)".format(budget))
+        status = "; ".join(failures) if failures else "ok (budget {0:.1f} ms)".format(budget)
+        failed = failed or bool(failures)
+        print("{0:<28} {1:8.0f} events/s  p99 {2:8.2f} ms  {3}".format(name, stats["rate"], latency, status))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
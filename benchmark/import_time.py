@@ -0,0 +1,80 @@
+"""
+Import-time benchmark for the dxlthreateventclient package.
+
+Each module is imported in a fresh interpreter several times and the median import time is compared
+against its budget. The script exits with a non-zero status if any budget is exceeded, so it can be run
+as a gate in CI:
+
+    python benchmark/import_time.py
+
+Modules without a budget are reported for information only. Importing them loads the DXL client
+libraries, which is expected.
+"""
+
+import os
+import subprocess
+import sys
+
+# Import-time budgets (in milliseconds). These must remain in sync with the "Import Time" section of
+# the SDK overview (doc/sdk/overview.rst).
+BUDGETS = [
+    ("dxlthreateventclient", 25.0),
+    ("dxlthreateventclient.constants", 25.0),
+    ("dxlthreateventclient.callbacks", None),
+    ("dxlthreateventclient.client", None),
+    ("dxlthreateventclient.statetracker", None),
+    ("dxlthreateventclient.rollup", None),
+    ("dxlthreateventclient.sampling", None),
+    ("dxlthreateventclient.routing", None),
+    ("dxlthreateventclient.pipeline", None),
+    ("dxlthreateventclient.sinks", None),
+    ("dxlthreateventclient.correlation", None),
+    ("dxlthreateventclient.dispatch", None),
+    ("dxlthreateventclient.publisher", None)
+]
+
+# The number of times each module is imported
+RUNS = 9
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_MEASURE = (
+    "import time\n"
+    "start = time.time()\n"
+    "import {0}\n"
+    "print((time.time() - start) * 1000.0)\n"
+)
+
+
+def measure(module_name):
+    """
+    Returns the median time (in milliseconds) taken to import the specified module in a fresh interpreter.
+
+    :param module_name: The name of the module
+    :return: The median import time (in milliseconds)
+    """
+    samples = []
+    for _ in range(RUNS):
+        output = subprocess.check_output([sys.executable, "-c", _MEASURE.format(module_name)], cwd=ROOT_DIR)
+        samples.append(float(output.strip()))
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def main():
+    failed = False
+    for module_name, budget in BUDGETS:
+        elapsed = measure(module_name)
+        if budget is None:
+            status = "info"
+        elif elapsed <= budget:
+            status = "ok (budget {0:.1f} ms)".format(budget)
+        else:
+            status = "OVER BUDGET (budget {0:.1f} ms)".format(budget)
+            failed = True
+        print("{0:<40} {1:8.2f} ms  {2}".format(module_name, elapsed, status))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
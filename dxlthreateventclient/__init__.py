@@ -1,7 +1,17 @@
 from __future__ import absolute_import
 
+import importlib
+import sys
+
 from ._version import __version__
-from .client import CommonThreatEventClient
+
+# Public names that are loaded from their modules on first use. This keeps ``import dxlthreateventclient``
+# (and the lightweight modules such as ``constants``) from loading the DXL client libraries, which
+# dominate import time. See the "Import Time" section of the SDK overview for the import-time budget.
+_LAZY_ATTRIBUTES = {
+    "CommonThreatEventClient": ".client",
+    "ClientClosedError": ".client"
+}
 
 
 def get_version():
@@ -11,3 +21,20 @@ def get_version():
     :return: The version of the package
     """
     return __version__
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        module_name = _LAZY_ATTRIBUTES.get(name)
+        if module_name is None:
+            raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+        value = getattr(importlib.import_module(module_name, __name__), name)
+        # Cache the value so that subsequent lookups do not go through __getattr__
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+else:
+    # Module-level __getattr__ is not supported, load eagerly
+    from .client import CommonThreatEventClient, ClientClosedError
@@ -0,0 +1,118 @@
+import time
+
+from .constants import ThreatEventProps, EventProps
+
+# The highest (most severe) threat severity value
+HIGHEST_SEVERITY = 1
+
+# The lowest (least severe) threat severity value. Events which do not carry a usable
+# ``threatSeverity`` value are treated as having this severity.
+LOWEST_SEVERITY = 7
+
+# Path to the severity of the threat event
+SEVERITY_PATH = (ThreatEventProps.EVENT, EventProps.THREAT_SEVERITY)
+
+
+def get_field(threat_event_dict, path, default=None):
+    """
+    Returns the value located at the specified path within a threat event ``dict`` (dictionary).
+
+    :param threat_event_dict: The threat event ``dict`` (dictionary)
+    :param path: A sequence of keys (typically constants such as
+        ``(ThreatEventProps.EVENT, EventProps.THREAT_NAME)``) leading to the value
+    :param default: The value to return if the path does not exist or the value is ``None``
+    :return: The value located at the specified path
+    """
+    value = threat_event_dict
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+    return default if value is None else value
+
+
+def get_severity(threat_event_dict):
+    """
+    Returns the severity of the threat event, clamped to the range
+    ``HIGHEST_SEVERITY`` to ``LOWEST_SEVERITY``.
+
+    :param threat_event_dict: The threat event ``dict`` (dictionary)
+    :return: The severity of the threat event
+    """
+    return normalize_severity(get_field(threat_event_dict, SEVERITY_PATH))
+
+
+def normalize_severity(severity):
+    """
+    Converts a raw severity value to an ``int`` within the range ``HIGHEST_SEVERITY`` to
+    ``LOWEST_SEVERITY``.
+
+    :param severity: The raw severity value (``int``, ``str`` or ``None``)
+    :return: The normalized severity
+    """
+    try:
+        severity = int(severity)
+    except (TypeError, ValueError):
+        return LOWEST_SEVERITY
+    return min(max(severity, HIGHEST_SEVERITY), LOWEST_SEVERITY)
+
+
+def get_constant_values(constants_class):
+    """
+    Returns the values of the constants defined in one of the constants classes
+    (:class:`dxlthreateventclient.constants.EventProps`, etc.), sorted by constant name.
+
+    :param constants_class: The constants class
+    :return: A ``list`` of the constant values
+    """
+    return [value for name, value in sorted(vars(constants_class).items())
+            if name.isupper() and not name.startswith("_")]
+
+
+def get_deadline(timeout):
+    """
+    Returns the deadline corresponding to a timeout.
+
+    :param timeout: The timeout (in seconds), or ``None`` for no timeout
+    :return: The deadline (``None`` for no deadline)
+    """
+    return None if timeout is None else time.time() + timeout
+
+
+def get_remaining(deadline):
+    """
+    Returns the amount of time remaining until a deadline.
+
+    :param deadline: The deadline (see :func:`get_deadline`)
+    :return: The remaining time (in seconds, never negative), or ``None`` for no deadline
+    """
+    return None if deadline is None else max(0.0, deadline - time.time())
+
+
+def merge_drain_results(*results):
+    """
+    Combines the results of draining several components.
+
+    :param results: The drain result ``dict`` (dictionary) objects
+    :return: A drain result ``dict`` (dictionary) with the ``flushed``, ``lost`` and ``in_flight`` totals
+    """
+    merged = {"flushed": 0, "lost": 0, "in_flight": 0}
+    for result in results:
+        for key in merged:
+            merged[key] += result.get(key, 0)
+    return merged
+
+
+def drain_component(component, deadline):
+    """
+    Drains a component (a callback, sink or publisher) if it supports draining.
+
+    :param component: The component to drain
+    :param deadline: The deadline (see :func:`get_deadline`)
+    :return: The drain result
+    """
+    drain = getattr(component, "drain", None)
+    if drain is None:
+        return merge_drain_results()
+    return drain(get_remaining(deadline))
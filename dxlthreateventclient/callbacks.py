@@ -1,11 +1,11 @@
 import json
 import logging
+import time
+from collections import deque
 
 from dxlclient.callbacks import EventCallback
-from dxlbootstrap.util import MessageUtils
 
-import dxlthreateventclient
-from constants import *
+from ._util import get_deadline, get_remaining, merge_drain_results
 
 # Configure local logger
 logger = logging.getLogger(__name__)
@@ -59,6 +59,17 @@ class CommonThreatEventCallback(EventCallback):
                     time.sleep(60)
     """
     
+    # The interval (in seconds) at which :func:`drain` checks for in-flight events
+    _DRAIN_POLL_INTERVAL = 0.01
+
+    def __new__(cls, *args, **kwargs):  # pylint: disable=unused-argument
+        instance = super(CommonThreatEventCallback, cls).__new__(cls)
+        # One entry per event currently being processed by on_event. Appending to and popping from a
+        # deque are atomic, so in-flight events are tracked without a lock. This is set up here rather
+        # than in __init__ so that derived classes are not required to invoke the base constructor.
+        instance._in_flight = deque()
+        return instance
+
     def on_event(self, event):
         """
         Invoked when a Threat Event has been received over DXL.
@@ -68,11 +79,28 @@ class CommonThreatEventCallback(EventCallback):
 
         :param event: The original DXL Threat Event message that was received
         """
-        # Decode the event payload
-        threat_event_dict = json.loads(MessageUtils.decode_payload(event))
+        self._in_flight.append(None)
+        try:
+            # Decode the event payload
+            threat_event_dict = self._decode_threat_event(event)
+
+            # Invoke the Threat Event method (unless the event was discarded while decoding)
+            if threat_event_dict is not None:
+                self.on_threat_event(threat_event_dict, event)
+        finally:
+            self._in_flight.pop()
+
+    def _decode_threat_event(self, event):
+        """
+        Decodes the payload of a DXL Threat Event message.
 
-        # Invoke the Threat Event method
-        self.on_threat_event(threat_event_dict, event)
+        Derived classes may override this method to inspect the raw payload before (or instead of)
+        decoding it in full.
+
+        :param event: The original DXL Threat Event message that was received
+        :return: The threat event ``dict`` (dictionary), or ``None`` to discard the event
+        """
+        return json.loads(event.payload.decode("utf-8"))
         
     
     def on_threat_event(self, threat_event_dict, original_event):
@@ -265,4 +293,26 @@ class CommonThreatEventCallback(EventCallback):
         :param original_event: The original DXL event message that was received
         """
         raise NotImplementedError("Must be implemented in a child class.")
+
+    def drain(self, timeout=None):
+        """
+        Waits for the events that are currently being processed by the callback to complete.
+
+        Callbacks that buffer events (queues, batches, reservoirs) override this method to stop accepting
+        events and flush their buffers, reporting the number of buffered events that were flushed or lost.
+        The callback should be unregistered from the client before it is drained (see
+        :func:`dxlthreateventclient.client.CommonThreatEventClient.drain`).
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: A ``dict`` (dictionary) containing the number of buffered events that were ``flushed``
+            and ``lost``, and the number of events still ``in_flight`` if the timeout expired
+        """
+        deadline = get_deadline(timeout)
+        while self._in_flight:
+            remaining = get_remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                break
+            time.sleep(self._DRAIN_POLL_INTERVAL if remaining is None else
+                       min(self._DRAIN_POLL_INTERVAL, remaining))
+        return merge_drain_results({"in_flight": len(self._in_flight)})
     
\ No newline at end of file
@@ -1,10 +1,20 @@
-from dxlclient.message import Request
+from dxlclient.message import Event
 from dxlbootstrap.util import MessageUtils
 from dxlbootstrap.client import Client
 
+from ._util import get_deadline, get_remaining, merge_drain_results, drain_component
+
 # Topic used to subscribe to ePO DXL Threat Events from Automatic Responses
 EPO_THREAT_EVENT_RESPONSE_TOPIC = "/mcafee/event/epo/threat/response"
 
+
+class ClientClosedError(Exception):
+    """
+    Raised when a callback is registered with, or a publisher is created by, a client that has been closed.
+    """
+    pass
+
+
 class CommonThreatEventClient(Client):
     """
     The "DXL Common Threat Event Client" client wrapper class.
@@ -17,6 +27,15 @@ class CommonThreatEventClient(Client):
         :param dxl_client: The DXL client to use for communication with the fabric
         """
         super(CommonThreatEventClient, self).__init__(dxl_client)
+        self._callbacks = []
+        self._publishers = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def add_epo_threat_event_response_callback(self, threat_event_callback):
         """
@@ -28,18 +47,156 @@ class CommonThreatEventClient(Client):
         :param: threat_event_topic: The topic to which to assign the 
             :class:`dxlthreateventclient.eventhandlers.CommonThreatEventCallback`.
         """
+        if self._closed:
+            raise ClientClosedError("The client has been closed")
         self._dxl_client.add_event_callback(EPO_THREAT_EVENT_RESPONSE_TOPIC, threat_event_callback)
+        self._callbacks.append(threat_event_callback)
 
         
-    def remove_epo_threat_event_response_callback(self, threat_event_callback):
+    def remove_epo_threat_event_response_callback(self, threat_event_callback, drain=False, timeout=None):
         """
         Unregisters a :class:`dxlthreateventclient.eventhandlers.CommonThreatEventCallback` from the client so 
         that it will no longer receive `threat events` from ePO.
         
         :param: threat_event_topic: The topic from which to remove the 
             :class:`dxlthreateventclient.eventhandlers.CommonThreatEventCallback`.
+        :param drain: Whether to drain the callback after unregistering it (see
+            :func:`dxlthreateventclient.callbacks.CommonThreatEventCallback.drain`)
+        :param timeout: The maximum amount of time (in seconds) to wait for the callback to drain (``None``
+            to wait indefinitely)
+        :return: The drain result if ``drain`` is ``True``, ``None`` otherwise
         """
         self._dxl_client.remove_event_callback(EPO_THREAT_EVENT_RESPONSE_TOPIC, threat_event_callback)
+        if threat_event_callback in self._callbacks:
+            self._callbacks.remove(threat_event_callback)
+        if drain:
+            return drain_component(threat_event_callback, get_deadline(timeout))
+        return None
+
+    def drain(self, timeout=None):
+        """
+        Stops intake of `threat events` and flushes all pending events, so that the process can be stopped
+        or restarted without losing events.
+
+        All callbacks registered via :func:`add_epo_threat_event_response_callback` are unregistered and
+        then drained (see :func:`dxlthreateventclient.callbacks.CommonThreatEventCallback.drain`), which
+        flushes the events buffered in their queues, batches and reservoirs. Publishers created via
+        :func:`create_threat_event_publisher` are then drained, sending their queued events.
+
+        NOTE: Events that the DXL client has already received, but that are still queued in its own incoming
+        message thread pool when the callbacks are unregistered, are dropped by the DXL client. They are not
+        delivered to the callbacks and are not included in the ``lost`` count.
+
+        **Example Usage**
+
+        .. code-block:: python
+
+            result = threat_event_client.drain(timeout=30)
+            print("Flushed: {0}, lost: {1}".format(result["flushed"], result["lost"]))
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: A ``dict`` (dictionary) containing the number of pending events that were ``flushed`` and
+            ``lost``, and the number of events still ``in_flight`` when the timeout expired
+        """
+        deadline = get_deadline(timeout)
+        callbacks = list(self._callbacks)
+        for threat_event_callback in callbacks:
+            self.remove_epo_threat_event_response_callback(threat_event_callback)
+        results = [drain_component(threat_event_callback, deadline) for threat_event_callback in callbacks]
+        results.extend(drain_component(publisher, deadline) for publisher in self._publishers)
+        return merge_drain_results(*results)
+
+    def close(self, timeout=None):
+        """
+        Drains the client (see :func:`drain`), stops the publishers created via
+        :func:`create_threat_event_publisher` and prevents further callbacks from being registered.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: The drain result (see :func:`drain`)
+        """
+        deadline = get_deadline(timeout)
+        self._closed = True
+        result = self.drain(timeout)
+        for publisher in self._publishers:
+            publisher.close(get_remaining(deadline))
+        del self._publishers[:]
+        return result
+
+
+    def publish_threat_event(self, threat_event_dict, topic):
+        """
+        Publishes a single `threat event` to the specified topic on the DXL fabric.
+
+        For publishing large numbers of threat events, a publisher created via
+        :func:`create_threat_event_publisher` should be used instead.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the threat event (see
+            :func:`dxlthreateventclient.publisher.create_threat_event`)
+        :param topic: The topic to publish the threat event to
+        """
+        event = Event(topic)
+        MessageUtils.dict_to_json_payload(event, threat_event_dict)
+        self._dxl_client.send_event(event)
+
+
+    def create_threat_event_publisher(self, topic, **kwargs):
+        """
+        Creates a :class:`dxlthreateventclient.publisher.ThreatEventPublisher` which batches and pipelines
+        `threat event` sends through the DXL client.
+
+        **Example Usage**
+
+        .. code-block:: python
+
+            with threat_event_client.create_threat_event_publisher(
+                    "/my/enriched/threat/events", throughput_mode=True) as publisher:
+                publisher.publish(threat_event_dict)
+
+        :param topic: The topic to publish threat events to
+        :param kwargs: Additional keyword arguments for the
+            :class:`dxlthreateventclient.publisher.ThreatEventPublisher` constructor
+        :return: The :class:`dxlthreateventclient.publisher.ThreatEventPublisher`
+        """
+        if self._closed:
+            raise ClientClosedError("The client has been closed")
+        from .publisher import ThreatEventPublisher
+        publisher = ThreatEventPublisher(self._dxl_client, topic, **kwargs)
+        self._publishers.append(publisher)
+        return publisher
+
+    def create_memory_accountant(self, budget=None, interval=None):
+        """
+        Creates a :class:`dxlthreateventclient.memory.MemoryAccountant` with the registered callbacks, the
+        callbacks they pass events to (via their ``threat_event_callback`` property) and the publishers created
+        via :func:`create_threat_event_publisher` that support memory accounting.
+
+        Components are named after their class and registration order (for example,
+        ``PriorityDispatchCallback-0``). Components registered later can be added to the accountant directly.
+
+        **Example Usage**
+
+        .. code-block:: python
+
+            accountant = threat_event_client.create_memory_accountant(budget=256 * 1024 * 1024, interval=30)
+            print(accountant.get_stats())
+
+        :param budget: The maximum number of bytes the components may hold (``None`` for no limit)
+        :param interval: The interval (in seconds) at which the budget is enforced from a background thread
+            (``None`` to only enforce it on demand)
+        :return: The :class:`dxlthreateventclient.memory.MemoryAccountant`
+        """
+        from .memory import MemoryAccountant
+        accountant = MemoryAccountant(budget)
+        components = []
+        for component in list(self._callbacks) + list(self._publishers):
+            while component is not None and not any(component is c for c in components):
+                components.append(component)
+                component = getattr(component, "threat_event_callback", None)
+        for index, component in enumerate(c for c in components if hasattr(c, "estimate_memory")):
+            accountant.register("{0}-{1}".format(component.__class__.__name__, index), component)
+        if interval is not None:
+            accountant.start(interval)
+        return accountant
 
         
     @staticmethod
@@ -0,0 +1,571 @@
+"""
+Compact binary encoding for threat events.
+
+Threat events are encoded as `MessagePack <https://msgpack.org>`_ records in which the property names
+listed in the constants classes (``analyzer``, ``detectionMethod``, ``threatSeverity``, etc.) are replaced
+by their index in a shared key dictionary. Dictionary keys are encoded as a MessagePack extension type
+(:const:`KEY_EXT_TYPE`), so they cannot be confused with integer keys in the threat event itself (such as
+those produced by :func:`dxlthreateventclient.client.CommonThreatEventClient.create_dict_from_aggregate_listOf`).
+Records are self-delimiting, so multiple records can be concatenated into a single stream (or file) and
+decoded incrementally.
+
+If the optional ``msgpack`` package (version 0.6.1 or later, installed via the ``msgpack`` extra) is
+installed with its C extension, it is used for packing and unpacking. Otherwise, a pure Python
+implementation of the subset of MessagePack required for threat events is used. Both produce identical
+output.
+"""
+
+import json
+import struct
+import time
+
+from .constants import ThreatEventProps, EventProps, AnalyzerProps, EntityProps, FilesProps, \
+    SourceProps, TargetProps, HashProps
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+# Whether the msgpack package includes its C extension (its pure Python fallback is slower than the
+# built-in implementation below)
+_MSGPACK_ACCELERATED = msgpack is not None and not msgpack.Packer.__module__.endswith("fallback")
+
+try:
+    _TEXT_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+    _TEXT_TYPES = (str,)
+
+# The version of the key dictionary and key encoding. Version 1 encoded dictionary keys as plain integers.
+KEY_DICTIONARY_VERSION = 2
+
+# The MessagePack extension type used to encode dictionary keys. The extension data is the index of the key
+# in the dictionary (one byte, or two bytes big-endian).
+KEY_EXT_TYPE = 1
+
+# The key dictionary. Keys are encoded as their index in this list.
+#
+# NOTE: This list is append-only. Reordering or removing entries makes previously encoded records
+# undecodable.
+KEY_DICTIONARY = [
+    ThreatEventProps.EVENT_MESSAGE_TYPE,
+    ThreatEventProps.EVENT_MESSAGE_VERSION,
+    ThreatEventProps.EVENT,
+    ThreatEventProps.RECEIVED_UTC,
+    EventProps.CATEGORY,
+    EventProps.EVENT_DESCRIPTION,
+    EventProps.EVENT_ID,
+    EventProps.THREAT_ACTION_TAKEN,
+    EventProps.THREAT_HANDLED,
+    EventProps.THREAT_NAME,
+    EventProps.THREAT_SEVERITY,
+    EventProps.THREAT_TYPE,
+    EventProps.URI,
+    EventProps.ANALYZER,
+    EventProps.ENTITY,
+    EventProps.FILES,
+    EventProps.OTHER_DATA,
+    EventProps.SOURCE,
+    EventProps.TARGET,
+    AnalyzerProps.CONTENT_VERSION,
+    AnalyzerProps.DETECTION_METHOD,
+    AnalyzerProps.DETECTED_UTC,
+    AnalyzerProps.ENGINE_VERSION,
+    AnalyzerProps.HOST_NAME,
+    AnalyzerProps.IPV4,
+    AnalyzerProps.IPV6,
+    AnalyzerProps.MAC,
+    AnalyzerProps.NAME,
+    AnalyzerProps.VERSION,
+    EntityProps.GROUP_NAME,
+    EntityProps.NODE_TEXT_PATH,
+    EntityProps.OS_PLATFORM,
+    EntityProps.OS_TYPE,
+    EntityProps.RULE_NAME,
+    EntityProps.SESSION_ID,
+    EntityProps.TYPE,
+    FilesProps.HASH,
+    SourceProps.PORT,
+    SourceProps.PROCESS_NAME,
+    SourceProps.URL,
+    SourceProps.USER_NAME,
+    TargetProps.FILE_NAME,
+    TargetProps.PROTOCOL,
+    HashProps.MD5,
+    HashProps.SHA1,
+    HashProps.SHA256,
+    # Properties commonly sent by ePO in the otherData member
+    "count",
+    "definedAt",
+    "responseEventType",
+    "responseRuleName",
+    "threatSeverityString",
+    # Session identifier as sent by ePO (differs in case from EntityProps.SESSION_ID)
+    "sessionId"
+]
+
+# Maps each key to its index. Property names shared by several constants classes (for example, "id"
+# and "hostName") must only be listed once.
+_KEY_INDEX = dict((key, index) for index, key in enumerate(KEY_DICTIONARY))
+assert len(_KEY_INDEX) == len(KEY_DICTIONARY), "Key dictionary contains duplicates"
+assert len(KEY_DICTIONARY) <= 0x10000, "Key dictionary is too large"
+
+
+def _key_ext_data(index):
+    """
+    Returns the extension data encoding the specified key dictionary index.
+    """
+    return struct.pack(">B", index) if index < 0x100 else struct.pack(">H", index)
+
+
+# Maps each key to the extension data encoding it
+_KEY_EXT_DATA = dict((key, _key_ext_data(index)) for key, index in _KEY_INDEX.items())
+
+
+def _key_from_ext(code, data):
+    """
+    Returns the dictionary key encoded by an extension value.
+    """
+    if code != KEY_EXT_TYPE or len(data) not in (1, 2):
+        raise ValueError("Unsupported MessagePack extension type: {0}".format(code))
+    index = struct.unpack(">B" if len(data) == 1 else ">H", data)[0]
+    try:
+        return KEY_DICTIONARY[index]
+    except IndexError:
+        raise ValueError("Unknown key dictionary index: {0}".format(index))
+
+
+class IncompleteRecordError(Exception):
+    """
+    Raised when the data to decode ends part way through a record.
+    """
+    pass
+
+
+def _pack(obj, parts):
+    """
+    Appends the MessagePack encoding of the specified object to ``parts``, substituting dictionary keys.
+    """
+    if obj is None:
+        parts.append(b"\xc0")
+    elif obj is True:
+        parts.append(b"\xc3")
+    elif obj is False:
+        parts.append(b"\xc2")
+    elif isinstance(obj, _TEXT_TYPES):
+        data = obj.encode("utf-8") if not isinstance(obj, bytes) else obj
+        size = len(data)
+        if size < 32:
+            parts.append(struct.pack("B", 0xa0 | size))
+        elif size < 0x100:
+            parts.append(struct.pack(">BB", 0xd9, size))
+        elif size < 0x10000:
+            parts.append(struct.pack(">BH", 0xda, size))
+        else:
+            parts.append(struct.pack(">BI", 0xdb, size))
+        parts.append(data)
+    elif isinstance(obj, bytes):
+        size = len(obj)
+        if size < 0x100:
+            parts.append(struct.pack(">BB", 0xc4, size))
+        elif size < 0x10000:
+            parts.append(struct.pack(">BH", 0xc5, size))
+        else:
+            parts.append(struct.pack(">BI", 0xc6, size))
+        parts.append(obj)
+    elif isinstance(obj, dict):
+        size = len(obj)
+        if size < 16:
+            parts.append(struct.pack("B", 0x80 | size))
+        elif size < 0x10000:
+            parts.append(struct.pack(">BH", 0xde, size))
+        else:
+            parts.append(struct.pack(">BI", 0xdf, size))
+        for key, value in obj.items():
+            ext_data = _KEY_EXT_DATA.get(key) if isinstance(key, _TEXT_TYPES) else None
+            if ext_data is None:
+                _pack(key, parts)
+            else:
+                # fixext 1 or fixext 2
+                parts.append(struct.pack(">BB", 0xd4 if len(ext_data) == 1 else 0xd5, KEY_EXT_TYPE))
+                parts.append(ext_data)
+            _pack(value, parts)
+    elif isinstance(obj, (int, type(2 ** 64))):
+        if 0 <= obj < 0x80:
+            parts.append(struct.pack("B", obj))
+        elif -32 <= obj < 0:
+            parts.append(struct.pack("b", obj))
+        elif 0 <= obj < 0x100:
+            parts.append(struct.pack(">BB", 0xcc, obj))
+        elif 0 <= obj < 0x10000:
+            parts.append(struct.pack(">BH", 0xcd, obj))
+        elif 0 <= obj < 0x100000000:
+            parts.append(struct.pack(">BI", 0xce, obj))
+        elif obj >= 0:
+            parts.append(struct.pack(">BQ", 0xcf, obj))
+        elif obj >= -0x80:
+            parts.append(struct.pack(">Bb", 0xd0, obj))
+        elif obj >= -0x8000:
+            parts.append(struct.pack(">Bh", 0xd1, obj))
+        elif obj >= -0x80000000:
+            parts.append(struct.pack(">Bi", 0xd2, obj))
+        else:
+            parts.append(struct.pack(">Bq", 0xd3, obj))
+    elif isinstance(obj, float):
+        parts.append(struct.pack(">Bd", 0xcb, obj))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size = len(obj)
+        if size < 16:
+            parts.append(struct.pack("B", 0x90 | size))
+        elif size < 0x10000:
+            parts.append(struct.pack(">BH", 0xdc, size))
+        else:
+            parts.append(struct.pack(">BI", 0xdd, size))
+        for value in obj:
+            _pack(value, parts)
+    else:
+        raise TypeError("Unable to encode value of type {0}".format(type(obj).__name__))
+
+
+# Formats of the fixed-size MessagePack types, keyed by type byte
+_FIXED_FORMATS = {
+    0xcb: ">d", 0xca: ">f",
+    0xcc: ">B", 0xcd: ">H", 0xce: ">I", 0xcf: ">Q",
+    0xd0: ">b", 0xd1: ">h", 0xd2: ">i", 0xd3: ">q"
+}
+
+# Formats of the length prefixes of the variable-size MessagePack types, keyed by type byte
+_LENGTH_FORMATS = {
+    0xd9: ">B", 0xda: ">H", 0xdb: ">I",
+    0xc4: ">B", 0xc5: ">H", 0xc6: ">I",
+    0xdc: ">H", 0xdd: ">I",
+    0xde: ">H", 0xdf: ">I"
+}
+
+
+def _unpack(buf, offset):
+    """
+    Decodes the MessagePack object at the specified offset, restoring dictionary keys.
+
+    :return: A ``(obj, offset)`` tuple containing the object and the offset following it
+    """
+    try:
+        type_byte = buf[offset]
+    except IndexError:
+        raise IncompleteRecordError()
+    offset += 1
+
+    if type_byte < 0x80:
+        return type_byte, offset
+    if type_byte >= 0xe0:
+        return type_byte - 0x100, offset
+    if 0xa0 <= type_byte <= 0xbf:
+        return _read_text(buf, offset, type_byte & 0x1f)
+    if 0x80 <= type_byte <= 0x8f:
+        return _read_map(buf, offset, type_byte & 0x0f)
+    if 0x90 <= type_byte <= 0x9f:
+        return _read_array(buf, offset, type_byte & 0x0f)
+    if type_byte == 0xc0:
+        return None, offset
+    if type_byte == 0xc2:
+        return False, offset
+    if type_byte == 0xc3:
+        return True, offset
+    if type_byte in (0xd4, 0xd5):
+        end = offset + (2 if type_byte == 0xd4 else 3)
+        if end > len(buf):
+            raise IncompleteRecordError()
+        return _key_from_ext(buf[offset], bytes(buf[offset + 1:end])), end
+
+    fixed_format = _FIXED_FORMATS.get(type_byte)
+    if fixed_format:
+        size = struct.calcsize(fixed_format)
+        if offset + size > len(buf):
+            raise IncompleteRecordError()
+        return struct.unpack_from(fixed_format, buf, offset)[0], offset + size
+
+    length_format = _LENGTH_FORMATS.get(type_byte)
+    if length_format is None:
+        raise ValueError("Unsupported MessagePack type: 0x{0:02x}".format(type_byte))
+    size = struct.calcsize(length_format)
+    if offset + size > len(buf):
+        raise IncompleteRecordError()
+    length = struct.unpack_from(length_format, buf, offset)[0]
+    offset += size
+    if type_byte in (0xd9, 0xda, 0xdb):
+        return _read_text(buf, offset, length)
+    if type_byte in (0xc4, 0xc5, 0xc6):
+        if offset + length > len(buf):
+            raise IncompleteRecordError()
+        return bytes(buf[offset:offset + length]), offset + length
+    if type_byte in (0xdc, 0xdd):
+        return _read_array(buf, offset, length)
+    return _read_map(buf, offset, length)
+
+
+def _read_text(buf, offset, length):
+    end = offset + length
+    if end > len(buf):
+        raise IncompleteRecordError()
+    return buf[offset:end].decode("utf-8"), end
+
+
+def _read_array(buf, offset, length):
+    result = []
+    for _ in range(length):
+        value, offset = _unpack(buf, offset)
+        result.append(value)
+    return result, offset
+
+
+def _read_map(buf, offset, length):
+    result = {}
+    for _ in range(length):
+        key, offset = _unpack(buf, offset)
+        value, offset = _unpack(buf, offset)
+        result[key] = value
+    return result, offset
+
+
+def _substitute_keys(obj):
+    """
+    Returns a copy of the specified object with the dictionary keys replaced by ``msgpack`` extension values.
+    """
+    if isinstance(obj, dict):
+        return dict((_MSGPACK_KEYS.get(key, key) if isinstance(key, _TEXT_TYPES) else key,
+                     _substitute_keys(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_substitute_keys(value) for value in obj]
+    return obj
+
+
+# Maps each key to the msgpack extension value encoding it
+_MSGPACK_KEYS = dict((key, msgpack.ExtType(KEY_EXT_TYPE, data)) for key, data in _KEY_EXT_DATA.items()) \
+    if msgpack is not None else {}
+
+
+class ThreatEventCodec(object):
+    """
+    Encodes and decodes threat event ``dict`` (dictionary) objects to and from the compact binary
+    format (see the module documentation).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            codec = ThreatEventCodec()
+
+            # Persist threat events as concatenated records
+            with open("events.bin", "wb") as f:
+                for threat_event_dict in threat_event_dicts:
+                    f.write(codec.encode(threat_event_dict))
+
+            # Read them back
+            with open("events.bin", "rb") as f:
+                for threat_event_dict in codec.decode_stream(f):
+                    print(threat_event_dict[ThreatEventProps.EVENT][EventProps.THREAT_NAME])
+
+    NOTE: ``set`` values (such as those produced by
+    :func:`dxlthreateventclient.client.CommonThreatEventClient.convert_aggregate_fields`) are encoded as
+    arrays and decoded as ``list`` values.
+    """
+
+    # The size of the chunks read from file-like objects when stream decoding
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, use_msgpack=None):
+        """
+        Constructor parameters:
+
+        :param use_msgpack: Whether to use the ``msgpack`` package. By default it is used if it is installed
+            with its C extension.
+        """
+        if use_msgpack and msgpack is None:
+            raise ValueError("The msgpack package is not installed")
+        self._use_msgpack = _MSGPACK_ACCELERATED if use_msgpack is None else use_msgpack
+
+    @property
+    def use_msgpack(self):
+        """
+        Whether the ``msgpack`` package is used for packing and unpacking
+        """
+        return self._use_msgpack
+
+    def encode(self, threat_event_dict):
+        """
+        Encodes a threat event to a single binary record.
+
+        :param threat_event_dict: The threat event ``dict`` (dictionary)
+        :return: The encoded record (``bytes``)
+        """
+        if self._use_msgpack:
+            return msgpack.packb(_substitute_keys(threat_event_dict), use_bin_type=True)
+        parts = []
+        _pack(threat_event_dict, parts)
+        return b"".join(parts)
+
+    def encode_many(self, threat_event_dicts):
+        """
+        Encodes multiple threat events to concatenated binary records.
+
+        :param threat_event_dicts: An iterable of threat event ``dict`` (dictionary) objects
+        :return: The encoded records (``bytes``)
+        """
+        return b"".join(self.encode(threat_event_dict) for threat_event_dict in threat_event_dicts)
+
+    def decode(self, data):
+        """
+        Decodes a single binary record.
+
+        :param data: The encoded record (``bytes``)
+        :return: The threat event ``dict`` (dictionary)
+        """
+        decoder = ThreatEventStreamDecoder(self)
+        decoder.feed(data)
+        records = list(decoder)
+        if len(records) != 1 or decoder.pending_bytes:
+            raise ValueError("Data does not contain exactly one complete record")
+        return records[0]
+
+    def decode_stream(self, source):
+        """
+        Incrementally decodes concatenated binary records, yielding each threat event as soon as it has
+        been read.
+
+        :param source: A file-like object opened in binary mode, or an iterable of ``bytes`` chunks
+        :return: A generator of threat event ``dict`` (dictionary) objects
+        """
+        if hasattr(source, "read"):
+            chunks = iter(lambda: source.read(self.READ_SIZE), b"")
+        else:
+            chunks = source
+        decoder = ThreatEventStreamDecoder(self)
+        for chunk in chunks:
+            decoder.feed(chunk)
+            for threat_event_dict in decoder:
+                yield threat_event_dict
+        if decoder.pending_bytes:
+            raise IncompleteRecordError("Stream ended part way through a record")
+
+
+class ThreatEventStreamDecoder(object):
+    """
+    Incrementally decodes concatenated binary records fed to it in arbitrary chunks.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            decoder = ThreatEventStreamDecoder()
+            for chunk in chunks:
+                decoder.feed(chunk)
+                for threat_event_dict in decoder:
+                    handle(threat_event_dict)
+    """
+
+    def __init__(self, codec=None):
+        """
+        Constructor parameters:
+
+        :param codec: The :class:`ThreatEventCodec` whose settings to use (a default codec if not specified)
+        """
+        codec = codec or ThreatEventCodec()
+        if codec.use_msgpack:
+            # Integer keys are permitted in threat events (strict_map_key defaults to True from msgpack 1.0)
+            self._unpacker = msgpack.Unpacker(raw=False, use_list=True, ext_hook=_key_from_ext,
+                                              strict_map_key=False, max_buffer_size=0x7fffffff)
+        else:
+            self._unpacker = None
+        self._buffer = bytearray()
+        self._offset = 0
+        self._fed = 0
+
+    @property
+    def pending_bytes(self):
+        """
+        The number of bytes that have been fed but not yet decoded
+        """
+        if self._unpacker is not None:
+            return self._fed - self._unpacker.tell()
+        return len(self._buffer) - self._offset
+
+    def feed(self, data):
+        """
+        Adds data to decode.
+
+        :param data: The data (``bytes``)
+        """
+        if self._unpacker is not None:
+            self._unpacker.feed(data)
+            self._fed += len(data)
+            return
+        if self._offset:
+            # Discard data that has already been decoded
+            del self._buffer[:self._offset]
+            self._offset = 0
+        self._buffer.extend(data)
+
+    def __iter__(self):
+        if self._unpacker is not None:
+            for threat_event_dict in self._unpacker:
+                yield threat_event_dict
+            return
+        buf = self._buffer
+        while self._offset < len(buf):
+            try:
+                threat_event_dict, offset = _unpack(buf, self._offset)
+            except IncompleteRecordError:
+                return
+            self._offset = offset
+            yield threat_event_dict
+
+
+def compare_with_json(threat_event_dicts, codec=None, repeat=3):
+    """
+    Compares the size and speed of the binary encoding with JSON for the specified threat events.
+
+    The returned ``dict`` (dictionary) contains the following keys:
+
+        * ``count``: The number of threat events
+        * ``json_bytes``, ``codec_bytes``: The total encoded size of the events
+        * ``size_ratio``: ``codec_bytes`` divided by ``json_bytes``
+        * ``json_encode_seconds``, ``json_decode_seconds``, ``codec_encode_seconds``,
+          ``codec_decode_seconds``: The best time (of ``repeat`` runs) to encode or decode all of the events
+        * ``msgpack``: Whether the ``msgpack`` package was used
+
+    :param threat_event_dicts: A ``list`` of threat event ``dict`` (dictionary) objects
+    :param codec: The :class:`ThreatEventCodec` to use (a default codec if not specified)
+    :param repeat: The number of times to repeat each measurement
+    :return: A ``dict`` (dictionary) containing the comparison
+    """
+    codec = codec or ThreatEventCodec()
+    encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def best_time(func):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            result = func()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    json_encode_seconds, json_payloads = best_time(
+        lambda: [encoder.encode(threat_event_dict).encode("utf-8") for threat_event_dict in threat_event_dicts])
+    json_decode_seconds, _ = best_time(
+        lambda: [json.loads(payload.decode("utf-8")) for payload in json_payloads])
+    codec_encode_seconds, stream = best_time(lambda: codec.encode_many(threat_event_dicts))
+    codec_decode_seconds, _ = best_time(lambda: list(codec.decode_stream([stream])))
+
+    json_bytes = sum(len(payload) for payload in json_payloads)
+    return {
+        "count": len(threat_event_dicts),
+        "json_bytes": json_bytes,
+        "codec_bytes": len(stream),
+        "size_ratio": float(len(stream)) / json_bytes if json_bytes else 0.0,
+        "json_encode_seconds": json_encode_seconds,
+        "json_decode_seconds": json_decode_seconds,
+        "codec_encode_seconds": codec_encode_seconds,
+        "codec_decode_seconds": codec_decode_seconds,
+        "msgpack": codec.use_msgpack
+    }
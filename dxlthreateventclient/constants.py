@@ -3,10 +3,6 @@
 # Copyright (c) 2017 McAfee Inc. - All Rights Reserved.
 ################################################################################
 
-import time
-import struct
-import uuid
-
         
 class ThreatEventProps:
     """
@@ -0,0 +1,499 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .callbacks import CommonThreatEventCallback
+from .memory import estimate_items_size
+from ._util import get_field
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class CorrelationMatch(object):
+    """
+    Describes a pattern detected by a :class:`CorrelationRule`.
+    """
+
+    def __init__(self, rule_name, key, timestamp, threat_event_dicts, values=None):
+        """
+        Constructor parameters:
+
+        :param rule_name: The name of the rule that matched
+        :param key: The value of the rule's key field that the match applies to
+        :param timestamp: The time at which the match occurred
+        :param threat_event_dicts: The threat events that completed the match
+        :param values: The distinct values that were counted (for :class:`DistinctCountRule`)
+        """
+        self.rule_name = rule_name
+        self.key = key
+        self.timestamp = timestamp
+        self.threat_event_dicts = threat_event_dicts
+        self.values = values
+
+    def __repr__(self):
+        return "CorrelationMatch(rule_name={0!r}, key={1!r})".format(self.rule_name, self.key)
+
+
+class CorrelationRule(object):
+    """
+    Base class for correlation rules.
+
+    A rule maintains incremental state per value of its key field (for example, per host name) within a
+    sliding window. Key state is held in an ``OrderedDict`` ordered by last update, so expired keys are
+    removed from the front in amortized constant time, and the least recently updated keys are evicted
+    once ``max_keys`` is exceeded.
+
+    Each rule consists of one or more steps. A step is a ``dict`` mapping a field path (a ``tuple`` of
+    constants such as ``(ThreatEventProps.EVENT, EventProps.THREAT_TYPE)``) to the required value, or to
+    a ``list``, ``tuple`` or ``set`` of accepted values.
+    """
+
+    def __init__(self, name, key_path, steps, window, max_keys):
+        """
+        Constructor parameters:
+
+        :param name: The name of the rule
+        :param key_path: The path to the field that state is kept per value of
+        :param steps: The ``list`` of steps of the rule
+        :param window: The length of the sliding window (in seconds)
+        :param max_keys: The maximum number of keys to hold state for
+        """
+        self.name = name
+        self.key_path = tuple(key_path)
+        self.steps = [dict((tuple(path), value) for path, value in step.items()) for step in steps]
+        self.window = window
+        self.max_keys = max_keys
+        self._state = OrderedDict()
+        self._evicted = 0
+
+    def _touch(self, key, now):
+        """
+        Returns the state for the specified key (creating it if necessary), marking it as most recently
+        updated.
+
+        :param key: The key
+        :param now: The current time
+        :return: The state for the key
+        """
+        state = self._state.pop(key, None)
+        if state is None:
+            state = self._new_state()
+        self._state[key] = state
+        while len(self._state) > self.max_keys:
+            self._state.popitem(last=False)
+            self._evicted += 1
+        return state
+
+    def expire(self, now):
+        """
+        Removes state for keys that have not been updated within the window.
+
+        :param now: The current time
+        """
+        while self._state:
+            key, state = next(iter(self._state.items()))
+            if now - self._last_update(state) <= self.window:
+                break
+            del self._state[key]
+
+    def get_key_count(self):
+        """
+        Returns the number of keys that state is currently held for.
+
+        :return: The number of keys
+        """
+        return len(self._state)
+
+    def get_evicted_count(self):
+        """
+        Returns the number of keys evicted because ``max_keys`` was exceeded.
+
+        :return: The number of evicted keys
+        """
+        return self._evicted
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the key state of the rule.
+
+        :return: The estimated size (in bytes)
+        """
+        return sys.getsizeof(self._state) + estimate_items_size(self._state.items(), len(self._state))
+
+    def evict_memory(self, nbytes):
+        """
+        Evicts the least recently updated keys to release approximately the specified number of bytes.
+
+        :param nbytes: The number of bytes to release
+        :return: The estimated number of bytes released
+        """
+        count = len(self._state)
+        if not count:
+            return 0
+        key_size = max(1, estimate_items_size(self._state.items(), count) // count)
+        evict_count = min(count, -(-nbytes // key_size))
+        for _ in range(evict_count):
+            self._state.popitem(last=False)
+        self._evicted += evict_count
+        return evict_count * key_size
+
+    def _new_state(self):
+        raise NotImplementedError("Must be implemented in a child class.")
+
+    def _last_update(self, state):
+        raise NotImplementedError("Must be implemented in a child class.")
+
+    def process(self, step_index, key, threat_event_dict, now):
+        """
+        Advances the state for the specified key with a threat event that matched a step of the rule.
+
+        :param step_index: The index of the step that the threat event matched
+        :param key: The value of the key field of the threat event
+        :param threat_event_dict: The threat event ``dict`` (dictionary)
+        :param now: The current time
+        :return: A :class:`CorrelationMatch` if the rule matched, ``None`` otherwise
+        """
+        raise NotImplementedError("Must be implemented in a child class.")
+
+
+class DistinctCountRule(CorrelationRule):
+    """
+    Matches when more than ``threshold`` distinct values of a field are seen for the same key within the
+    window.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            # The same threat name on more than 10 distinct entities within 5 minutes
+            rule = DistinctCountRule(
+                "widespread-threat",
+                key_path=(ThreatEventProps.EVENT, EventProps.THREAT_NAME),
+                distinct_path=(ThreatEventProps.EVENT, EventProps.ENTITY, EntityProps.ID),
+                threshold=10, window=300)
+
+    Once a rule has matched for a key, it does not match again for that key until the distinct count has
+    dropped back to (or below) the threshold.
+    """
+
+    def __init__(self, name, key_path, distinct_path, threshold, window, match=None, max_keys=10000,
+                 max_distinct=None):
+        """
+        Constructor parameters:
+
+        :param name: The name of the rule
+        :param key_path: The path to the field to count distinct values per value of
+        :param distinct_path: The path to the field whose distinct values are counted
+        :param threshold: The distinct count that must be exceeded for the rule to match
+        :param window: The length of the sliding window (in seconds)
+        :param match: An optional step ``dict`` that threat events must match to be counted
+        :param max_keys: The maximum number of keys to hold state for
+        :param max_distinct: The maximum number of distinct values to hold per key (defaults to
+            ``threshold + 1``, which is all that is required to detect a match)
+        """
+        super(DistinctCountRule, self).__init__(name, key_path, [match or {}], window, max_keys)
+        self.distinct_path = tuple(distinct_path)
+        self.threshold = threshold
+        self.max_distinct = max_distinct or threshold + 1
+
+    def _new_state(self):
+        # [distinct value -> last seen time (ordered by last seen), matched flag]
+        return [OrderedDict(), False]
+
+    def _last_update(self, state):
+        values = state[0]
+        return next(reversed(values.values())) if values else 0
+
+    def process(self, step_index, key, threat_event_dict, now):
+        value = get_field(threat_event_dict, self.distinct_path)
+        if value is None:
+            return None
+        state = self._touch(key, now)
+        values = state[0]
+
+        # Refresh the value, then expire values that have left the window
+        values.pop(value, None)
+        values[value] = now
+        while values and now - next(iter(values.values())) > self.window:
+            values.popitem(last=False)
+        while len(values) > self.max_distinct:
+            values.popitem(last=False)
+
+        if len(values) > self.threshold:
+            if not state[1]:
+                state[1] = True
+                return CorrelationMatch(self.name, key, now, [threat_event_dict], list(values))
+        else:
+            state[1] = False
+        return None
+
+
+class SequenceRule(CorrelationRule):
+    """
+    Matches when threat events matching each of the steps occur in order for the same key within the
+    window.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            # An exploit prevention event followed by a malware detection on the same host
+            rule = SequenceRule(
+                "exploit-then-malware",
+                key_path=(ThreatEventProps.EVENT, EventProps.ANALYZER, AnalyzerProps.HOST_NAME),
+                steps=[
+                    {(ThreatEventProps.EVENT, EventProps.THREAT_TYPE): "Exploit Prevention"},
+                    {(ThreatEventProps.EVENT, EventProps.THREAT_TYPE): "Malware"}
+                ],
+                window=300)
+
+    The state for each key records, for each prefix of the steps, the start time of the most recent
+    partial match and the events that made it up. Each event therefore advances the state machine in
+    constant time regardless of how many events have been seen.
+    """
+
+    def __init__(self, name, key_path, steps, window, max_keys=10000):
+        """
+        Constructor parameters:
+
+        :param name: The name of the rule
+        :param key_path: The path to the field that the sequence must share (for example, the host name)
+        :param steps: The ``list`` of steps that must be matched in order
+        :param window: The maximum amount of time (in seconds) between the first and last step
+        :param max_keys: The maximum number of keys to hold state for
+        """
+        if len(steps) < 2:
+            raise ValueError("A sequence rule requires at least two steps")
+        super(SequenceRule, self).__init__(name, key_path, steps, window, max_keys)
+
+    def _new_state(self):
+        # [last update time, partial matches (index i: (start time, events) for steps 0..i)]
+        return [0, [None] * (len(self.steps) - 1)]
+
+    def _last_update(self, state):
+        return state[0]
+
+    def process(self, step_index, key, threat_event_dict, now):
+        if step_index and key not in self._state:
+            return None
+        state = self._touch(key, now)
+        state[0] = now
+        partials = state[1]
+
+        if step_index == 0:
+            partials[0] = (now, [threat_event_dict])
+            return None
+
+        previous = partials[step_index - 1]
+        if previous is None or now - previous[0] > self.window:
+            return None
+        start, threat_event_dicts = previous
+        threat_event_dicts = threat_event_dicts + [threat_event_dict]
+        if step_index == len(self.steps) - 1:
+            # The sequence is complete, reset the state for the key
+            partials[:] = [None] * len(partials)
+            return CorrelationMatch(self.name, key, now, threat_event_dicts)
+        partials[step_index] = (start, threat_event_dicts)
+        return None
+
+
+class CorrelationEngine(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that detects patterns across
+    multiple threat events using :class:`CorrelationRule` instances.
+
+    When rules are added, their steps are compiled into hash indexes keyed on the field path and value of
+    each step's first condition. For each threat event, only the steps whose indexed condition matches
+    the event are evaluated, so the cost per event is proportional to the number of matching rules rather
+    than to the number of rules or the event history.
+
+    Detected patterns are passed to :func:`on_correlation_match`, which by default invokes the
+    ``match_callback`` (if one was specified).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            def on_match(match):
+                print("Rule {0} matched for {1}".format(match.rule_name, match.key))
+
+            engine = CorrelationEngine(match_callback=on_match)
+            engine.add_rule(DistinctCountRule(
+                "widespread-threat",
+                key_path=(ThreatEventProps.EVENT, EventProps.THREAT_NAME),
+                distinct_path=(ThreatEventProps.EVENT, EventProps.ENTITY, EntityProps.ID),
+                threshold=10, window=300))
+
+            threat_event_client.add_epo_threat_event_response_callback(engine)
+    """
+
+    def __init__(self, rules=None, match_callback=None, clock=time.time):
+        """
+        Constructor parameters:
+
+        :param rules: An optional ``list`` of :class:`CorrelationRule` instances to add
+        :param match_callback: An optional callable that is invoked with each :class:`CorrelationMatch`
+        :param clock: The callable used to obtain the current time
+        """
+        super(CorrelationEngine, self).__init__()
+        self._match_callback = match_callback
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._rules = []
+        # field path -> value -> list of (rule, step index, remaining conditions). The index is replaced (not
+        # modified) when rules are added, so events are matched against it without holding the lock.
+        self._index = {}
+        # Steps without conditions are evaluated for every event
+        self._unconditional = []
+        self._matches = 0
+        for rule in rules or []:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        """
+        Adds a rule to the engine, compiling its steps into the engine's indexes.
+
+        :param rule: The :class:`CorrelationRule` to add
+        """
+        with self._lock:
+            index = dict(self._index)
+            unconditional = list(self._unconditional)
+            for step_index, step in enumerate(rule.steps):
+                conditions = sorted(step.items())
+                if not conditions:
+                    unconditional.append((rule, step_index, ()))
+                    continue
+                (path, values), remaining = conditions[0], tuple(conditions[1:])
+                if not isinstance(values, (list, tuple, set, frozenset)):
+                    values = [values]
+                value_index = index[path] = dict(index.get(path, {}))
+                for value in values:
+                    value_index[value] = value_index.get(value, []) + [(rule, step_index, remaining)]
+            self._rules.append(rule)
+            self._index = index
+            self._unconditional = unconditional
+
+    @property
+    def rules(self):
+        """
+        The ``list`` of rules in the engine
+        """
+        return list(self._rules)
+
+    @staticmethod
+    def _matches_conditions(threat_event_dict, conditions):
+        for path, values in conditions:
+            value = get_field(threat_event_dict, path)
+            if isinstance(values, (list, tuple, set, frozenset)):
+                if value not in values:
+                    return False
+            elif value != values:
+                return False
+        return True
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Evaluates the threat event against the rules whose indexed conditions it matches.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        candidates = list(self._unconditional)
+        for path, value_index in self._index.items():
+            try:
+                entries = value_index.get(get_field(threat_event_dict, path))
+            except TypeError:
+                # Unhashable values (lists, dicts) can not match an indexed condition
+                continue
+            if entries:
+                candidates.extend(entries)
+        if not candidates:
+            return
+
+        matches = []
+        with self._lock:
+            now = self._clock()
+            for rule, step_index, remaining in candidates:
+                if remaining and not self._matches_conditions(threat_event_dict, remaining):
+                    continue
+                key = get_field(threat_event_dict, rule.key_path)
+                if key is None:
+                    continue
+                rule.expire(now)
+                match = rule.process(step_index, key, threat_event_dict, now)
+                if match:
+                    matches.append(match)
+            self._matches += len(matches)
+
+        for match in matches:
+            try:
+                self.on_correlation_match(match)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error handling correlation match")
+
+    def on_correlation_match(self, match):
+        """
+        Invoked when a rule has matched. By default, this invokes the ``match_callback`` that was
+        specified when the engine was constructed.
+
+        :param match: The :class:`CorrelationMatch`
+        """
+        if self._match_callback:
+            self._match_callback(match)
+
+    def expire(self):
+        """
+        Removes state that has left the window of each rule.
+        """
+        with self._lock:
+            now = self._clock()
+            for rule in self._rules:
+                rule.expire(now)
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the state of the rules (see
+        :mod:`dxlthreateventclient.memory`).
+
+        :return: The estimated size (in bytes)
+        """
+        with self._lock:
+            return sum(rule.estimate_memory() for rule in self._rules)
+
+    def evict_memory(self, nbytes):
+        """
+        Evicts the least recently updated keys of the rules, starting with the rule holding the most memory,
+        to release approximately the specified number of bytes (see :mod:`dxlthreateventclient.memory`).
+
+        :param nbytes: The number of bytes to release
+        :return: The estimated number of bytes released
+        """
+        with self._lock:
+            released = 0
+            for rule in sorted(self._rules, key=lambda r: r.estimate_memory(), reverse=True):
+                if released >= nbytes:
+                    break
+                released += rule.evict_memory(nbytes - released)
+            return released
+
+    def get_stats(self):
+        """
+        Returns the correlation statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``matches``: The number of matches detected
+            * ``rules``: A ``dict`` mapping each rule name to a ``dict`` containing the number of ``keys``
+              state is held for and the number of keys ``evicted`` due to the ``max_keys`` limit
+
+        :return: A ``dict`` (dictionary) containing the correlation statistics
+        """
+        with self._lock:
+            return {
+                "matches": self._matches,
+                "rules": dict((rule.name, {"keys": rule.get_key_count(), "evicted": rule.get_evicted_count()})
+                              for rule in self._rules)
+            }
@@ -0,0 +1,400 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from .callbacks import CommonThreatEventCallback
+from .memory import estimate_items_size
+from ._util import HIGHEST_SEVERITY, LOWEST_SEVERITY, get_severity, get_deadline, get_remaining, \
+    merge_drain_results, drain_component
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket rate limiter.
+
+    Tokens are added to the bucket at ``rate`` tokens per second, up to a maximum of ``burst``
+    tokens. Each dispatched event consumes a single token.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        Constructor parameters:
+
+        :param rate: The number of tokens added to the bucket per second
+        :param burst: The maximum number of tokens the bucket can hold (defaults to ``rate``)
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be greater than zero")
+        self._lock = threading.Lock()
+        self._rate = float(rate)
+        self._burst = float(burst if burst else max(rate, 1))
+        self._tokens = self._burst
+        self._last = time.time()
+
+    @property
+    def rate(self):
+        """
+        The number of tokens added to the bucket per second
+        """
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        if rate <= 0:
+            raise ValueError("Rate must be greater than zero")
+        with self._lock:
+            self._refill()
+            self._rate = float(rate)
+
+    @property
+    def burst(self):
+        """
+        The maximum number of tokens the bucket can hold
+        """
+        return self._burst
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Attempts to remove the specified number of tokens from the bucket.
+
+        :param tokens: The number of tokens to acquire
+        :return: ``True`` if the tokens were acquired, ``False`` otherwise
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def time_until_available(self, tokens=1):
+        """
+        Returns the amount of time (in seconds) until the specified number of tokens will be
+        available in the bucket.
+
+        :param tokens: The number of tokens
+        :return: The amount of time (in seconds) until the tokens are available
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                return 0.0
+            return (tokens - self._tokens) / self._rate
+
+
+class PriorityDispatchCallback(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that places received threat
+    events into priority queues keyed on the threat event severity
+    (:const:`dxlthreateventclient.constants.EventProps.THREAT_SEVERITY`) and dispatches them to another
+    threat event callback from one or more worker threads.
+
+    Events are always dispatched from the most severe (``1``) to the least severe (``7``) non-empty
+    queue. Dispatching can optionally be rate limited via a token bucket.
+
+    When the dispatcher is overloaded, low-severity events are handled first:
+
+        * Once the number of queued events reaches ``overload_threshold`` (a fraction of
+          ``max_queue_size``), incoming events are sampled according to ``overload_sample_rates``
+          (a ``dict`` mapping severity to the fraction of events to keep).
+        * Once ``max_queue_size`` events are queued, the oldest event of the least severe non-empty queue
+          is shed to make room for the incoming event. If the incoming event is less severe than (or
+          as severe as) everything that is queued, the incoming event is shed instead.
+
+    The counts of shed and sampled-out events are available via :func:`get_stats`.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            # Dispatch at most 500 events per second to "my_callback", sampling 10% of severity 6
+            # and 7 events once the queue is half full
+            dispatcher = PriorityDispatchCallback(
+                my_callback, rate=500, max_queue_size=10000,
+                overload_threshold=0.5, overload_sample_rates={6: 0.1, 7: 0.1})
+
+            threat_event_client.add_epo_threat_event_response_callback(dispatcher)
+    """
+
+    def __init__(self, threat_event_callback, rate=None, burst=None, max_queue_size=10000,
+                 overload_threshold=1.0, overload_sample_rates=None, worker_count=1):
+        """
+        Constructor parameters:
+
+        :param threat_event_callback: The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback`
+            to dispatch threat events to
+        :param rate: The maximum number of events to dispatch per second (``None`` for no limit)
+        :param burst: The maximum number of events that can be dispatched in a burst (defaults to ``rate``)
+        :param max_queue_size: The maximum number of events to hold across all priority queues
+        :param overload_threshold: The fraction of ``max_queue_size`` at which sampling of incoming
+            events starts
+        :param overload_sample_rates: A ``dict`` mapping severity to the fraction (``0.0`` to ``1.0``) of
+            incoming events of that severity to keep while overloaded
+        :param worker_count: The number of worker threads used to dispatch events
+        """
+        super(PriorityDispatchCallback, self).__init__()
+        if max_queue_size < 1:
+            raise ValueError("Maximum queue size must be at least one")
+        self._threat_event_callback = threat_event_callback
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._max_queue_size = max_queue_size
+        self._overload_size = max(1, int(max_queue_size * overload_threshold))
+        self._sample_rates = dict(overload_sample_rates or {})
+
+        # One queue per severity, index 0 holds the most severe events
+        self._queues = [deque() for _ in range(HIGHEST_SEVERITY, LOWEST_SEVERITY + 1)]
+        self._queued = 0
+        self._in_progress = 0
+        self._condition = threading.Condition()
+        self._running = True
+
+        self._received = 0
+        self._dispatched = 0
+        self._errors = 0
+        self._lost = 0
+        # The result of the most recent drain
+        self._drain_result = None
+        self._shed = dict.fromkeys(range(HIGHEST_SEVERITY, LOWEST_SEVERITY + 1), 0)
+        self._sampled_out = dict.fromkeys(range(HIGHEST_SEVERITY, LOWEST_SEVERITY + 1), 0)
+
+        self._workers = []
+        for i in range(worker_count):
+            worker = threading.Thread(target=self._worker_loop,
+                                      name="PriorityDispatchWorker-{0}".format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def threat_event_callback(self):
+        """
+        The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that events are dispatched to
+        """
+        return self._threat_event_callback
+
+    @property
+    def token_bucket(self):
+        """
+        The :class:`TokenBucket` used to rate limit dispatching (``None`` if dispatching is not rate limited)
+        """
+        return self._bucket
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Queues the threat event for dispatching, shedding or sampling low-severity events if the
+        dispatcher is overloaded.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        severity = get_severity(threat_event_dict)
+        with self._condition:
+            self._received += 1
+            if not self._running:
+                self._lost += 1
+                return
+
+            if self._queued >= self._overload_size and severity in self._sample_rates:
+                if random.random() >= self._sample_rates[severity]:
+                    self._sampled_out[severity] += 1
+                    return
+
+            if self._queued >= self._max_queue_size and not self._shed_one(severity):
+                self._shed[severity] += 1
+                return
+
+            self._queues[severity - HIGHEST_SEVERITY].append((threat_event_dict, original_event))
+            self._queued += 1
+            self._condition.notify()
+
+    def _shed_one(self, severity):
+        """
+        Sheds the oldest queued event that is less severe than the specified severity.
+
+        NOTE: Must be invoked while holding the condition lock.
+
+        :param severity: The severity of the incoming event
+        :return: ``True`` if an event was shed, ``False`` otherwise
+        """
+        for shed_severity in range(LOWEST_SEVERITY, severity, -1):
+            queue = self._queues[shed_severity - HIGHEST_SEVERITY]
+            if queue:
+                queue.popleft()
+                self._queued -= 1
+                self._shed[shed_severity] += 1
+                return True
+        return False
+
+    def _next_event(self):
+        """
+        Removes and returns the next (most severe) queued event.
+
+        NOTE: Must be invoked while holding the condition lock.
+
+        :return: The next ``(threat_event_dict, original_event)`` tuple
+        """
+        for queue in self._queues:
+            if queue:
+                self._queued -= 1
+                return queue.popleft()
+        return None
+
+    def _worker_loop(self):
+        """
+        Dispatches queued events in priority order until the dispatcher is closed.
+        """
+        while True:
+            with self._condition:
+                while self._running and not self._queued:
+                    self._condition.wait()
+                if not self._queued:
+                    return
+                if self._bucket and not self._bucket.try_acquire():
+                    self._condition.wait(self._bucket.time_until_available())
+                    continue
+                threat_event_dict, original_event = self._next_event()
+                self._in_progress += 1
+
+            succeeded = False
+            try:
+                self._threat_event_callback.on_threat_event(threat_event_dict, original_event)
+                succeeded = True
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error dispatching threat event")
+            finally:
+                with self._condition:
+                    self._in_progress -= 1
+                    if succeeded:
+                        self._dispatched += 1
+                    else:
+                        self._errors += 1
+                    self._condition.notify_all()
+
+    def drain(self, timeout=None):
+        """
+        Stops accepting events and waits for the queued events to be dispatched, then drains the threat event
+        callback that events are dispatched to. Events still queued when the timeout expires are discarded.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: A ``dict`` (dictionary) containing the number of queued events that were ``flushed``
+            (passed to the threat event callback, whether or not it raised an exception) and ``lost``
+            (discarded), and the number of events still ``in_flight``
+        """
+        deadline = get_deadline(timeout)
+        result = super(PriorityDispatchCallback, self).drain(timeout)
+        with self._condition:
+            self._running = False
+            completed = self._dispatched + self._errors
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(get_remaining(deadline))
+        with self._condition:
+            lost = self._queued
+            for queue in self._queues:
+                queue.clear()
+            self._queued = 0
+            self._lost += lost
+            flushed = self._dispatched + self._errors - completed
+            in_flight = self._in_progress
+            self._condition.notify_all()
+        result = merge_drain_results(
+            result, {"flushed": flushed, "lost": lost, "in_flight": in_flight},
+            drain_component(self._threat_event_callback, deadline))
+        with self._condition:
+            self._drain_result = result
+        return result
+
+    def close(self, timeout=None):
+        """
+        Stops accepting events and waits for the queued events to be dispatched (see :func:`drain`). The
+        detailed drain result is available via :func:`get_drain_result`.
+
+        :param timeout: The maximum amount of time (in seconds) to wait for the queued events to be
+            dispatched (``None`` to wait indefinitely)
+        :return: ``True`` if all queued events were dispatched, ``False`` otherwise
+        """
+        result = self.drain(timeout)
+        return not result["lost"] and not result["in_flight"]
+
+    def get_drain_result(self):
+        """
+        Returns the result of the most recent :func:`drain` (or :func:`close`).
+
+        :return: The drain result (see :func:`drain`), or ``None`` if the dispatcher has not been drained
+        """
+        with self._condition:
+            return self._drain_result
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the queued events (see
+        :mod:`dxlthreateventclient.memory`).
+
+        :return: The estimated size (in bytes)
+        """
+        with self._condition:
+            return sum(estimate_items_size(queue, len(queue)) for queue in self._queues)
+
+    def evict_memory(self, nbytes):
+        """
+        Sheds the oldest queued events, starting with the least severe, to release approximately the specified
+        number of bytes (see :mod:`dxlthreateventclient.memory`). Evicted events are counted as ``shed``.
+
+        :param nbytes: The number of bytes to release
+        :return: The estimated number of bytes released
+        """
+        released = 0
+        with self._condition:
+            for severity in range(LOWEST_SEVERITY, HIGHEST_SEVERITY - 1, -1):
+                queue = self._queues[severity - HIGHEST_SEVERITY]
+                if not queue:
+                    continue
+                event_size = max(1, estimate_items_size(queue, len(queue)) // len(queue))
+                while queue and released < nbytes:
+                    queue.popleft()
+                    self._queued -= 1
+                    self._shed[severity] += 1
+                    released += event_size
+                if released >= nbytes:
+                    break
+            self._condition.notify_all()
+        return released
+
+    def get_stats(self):
+        """
+        Returns the dispatching statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``received``: The number of events received
+            * ``dispatched``: The number of events successfully handled by the threat event callback
+            * ``errors``: The number of events for which the threat event callback raised an exception (not
+              included in ``dispatched``)
+            * ``lost``: The number of events discarded by (or received after) :func:`drain`
+            * ``queued``: A ``dict`` mapping severity to the number of currently queued events
+            * ``shed``: A ``dict`` mapping severity to the number of events shed due to overload
+            * ``sampled_out``: A ``dict`` mapping severity to the number of events dropped by overload sampling
+
+        :return: A ``dict`` (dictionary) containing the dispatching statistics
+        """
+        with self._condition:
+            return {
+                "received": self._received,
+                "dispatched": self._dispatched,
+                "errors": self._errors,
+                "lost": self._lost,
+                "queued": dict((severity, len(self._queues[severity - HIGHEST_SEVERITY]))
+                               for severity in range(HIGHEST_SEVERITY, LOWEST_SEVERITY + 1)),
+                "shed": dict(self._shed),
+                "sampled_out": dict(self._sampled_out)
+            }
@@ -0,0 +1,335 @@
+"""
+Memory accounting for long-running threat event subscribers.
+
+Components that hold threat events or derived state (queues, caches, stores) implement the memory
+accounting protocol:
+
+    * ``estimate_memory()``: Returns the estimated number of bytes held by the component
+    * ``evict_memory(nbytes)`` (optional): Releases approximately ``nbytes`` bytes (for example, by evicting the
+      least recently used entries) and returns the estimated number of bytes released
+
+A :class:`MemoryAccountant` tracks the estimates of registered components and enforces a global budget by
+asking components to evict. Estimates are conservative: a threat event referenced by several components
+(for example, queued by a dispatcher and held in correlation state) is counted once per component.
+
+Diagnostic snapshots of the Python heap are available via :func:`take_diagnostic_snapshot`.
+"""
+
+import itertools
+import logging
+import sys
+import threading
+from collections import deque
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+# The number of items sampled when estimating the size of a collection
+DEFAULT_SAMPLE_SIZE = 32
+
+_CONTAINER_TYPES = (list, tuple, set, frozenset, deque)
+
+
+def estimate_size(obj, _seen=None):
+    """
+    Estimates the number of bytes held by an object, including the objects it references via containers,
+    attributes and slots. Objects referenced more than once are only counted once.
+
+    :param obj: The object
+    :return: The estimated size (in bytes)
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, _CONTAINER_TYPES):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    else:
+        if hasattr(obj, "__dict__"):
+            size += estimate_size(vars(obj), _seen)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                size += estimate_size(getattr(obj, slot), _seen)
+    return size
+
+
+def estimate_items_size(items, count, sample_size=DEFAULT_SAMPLE_SIZE):
+    """
+    Estimates the number of bytes held by the items of a collection by sampling the first ``sample_size``
+    items, so that the cost of the estimate does not grow with the size of the collection.
+
+    :param items: An iterable of the items
+    :param count: The total number of items
+    :param sample_size: The number of items to sample
+    :return: The estimated size (in bytes)
+    """
+    if not count:
+        return 0
+    sampled = [estimate_size(item) for item in itertools.islice(items, sample_size)]
+    if not sampled:
+        return 0
+    return int(float(sum(sampled)) / len(sampled) * count)
+
+
+def start_tracing(frames=1):
+    """
+    Starts tracing Python memory allocations (see :mod:`tracemalloc`), which is required by
+    :func:`take_diagnostic_snapshot`. Tracing adds overhead to every allocation, so it should only be
+    enabled while diagnosing memory growth.
+
+    :param frames: The number of stack frames recorded per allocation
+    """
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_tracing():
+    """
+    Stops tracing Python memory allocations.
+    """
+    import tracemalloc
+    tracemalloc.stop()
+
+
+def take_diagnostic_snapshot(limit=25, group_by="lineno", compare_to=None):
+    """
+    Takes a snapshot of traced Python memory allocations (see :func:`start_tracing`) and returns the
+    locations that hold the most memory.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            start_tracing()
+            baseline = take_diagnostic_snapshot()
+            ...
+            diagnostic = take_diagnostic_snapshot(compare_to=baseline)
+            print(format_diagnostic_snapshot(diagnostic))
+
+    :param limit: The maximum number of locations to return
+    :param group_by: How allocations are grouped (``filename``, ``lineno`` or ``traceback``)
+    :param compare_to: A previous diagnostic snapshot. If specified, locations are ordered by growth since
+        that snapshot.
+    :return: A ``dict`` (dictionary) containing the ``current`` and ``peak`` traced memory (in bytes), the
+        ``top`` locations (a ``list`` of ``dict`` objects containing the ``location``, ``size``, ``count``
+        and, when comparing, ``size_diff``), and the underlying ``snapshot``
+    """
+    import tracemalloc
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Memory allocations are not being traced (see start_tracing)")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    if compare_to is not None:
+        stats = snapshot.compare_to(compare_to["snapshot"], group_by)
+        top = [{"location": str(stat.traceback), "size": stat.size, "count": stat.count,
+                "size_diff": stat.size_diff} for stat in stats[:limit]]
+    else:
+        stats = snapshot.statistics(group_by)
+        top = [{"location": str(stat.traceback), "size": stat.size, "count": stat.count}
+               for stat in stats[:limit]]
+    return {"current": current, "peak": peak, "top": top, "snapshot": snapshot}
+
+
+def format_diagnostic_snapshot(diagnostic):
+    """
+    Formats a diagnostic snapshot (see :func:`take_diagnostic_snapshot`) as human-readable text.
+
+    :param diagnostic: The diagnostic snapshot
+    :return: The formatted snapshot (``str``)
+    """
+    lines = ["Traced memory: current={0} KiB, peak={1} KiB".format(
+        diagnostic["current"] // 1024, diagnostic["peak"] // 1024)]
+    for entry in diagnostic["top"]:
+        diff = " ({0:+d} KiB)".format(entry["size_diff"] // 1024) if "size_diff" in entry else ""
+        lines.append("{0}: {1} KiB{2}, {3} blocks".format(
+            entry["location"], entry["size"] // 1024, diff, entry["count"]))
+    return "\n".join(lines)
+
+
+class MemoryAccountant(object):
+    """
+    Tracks the estimated memory held by registered components and enforces a global budget.
+
+    When the total estimate exceeds the budget, components that support eviction are asked to release the
+    excess, in ascending ``priority`` order (components with the same priority are asked largest first).
+    The budget is enforced on demand via :func:`enforce`, or periodically from a background thread (see
+    :func:`start`).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            accountant = MemoryAccountant(budget=512 * 1024 * 1024)
+            accountant.register("dispatcher", dispatcher, priority=1)
+            accountant.register("host-state", host_state_tracker)
+            accountant.register("correlation", correlation_engine)
+            accountant.start(interval=30)
+
+            print(accountant.get_stats())
+    """
+
+    def __init__(self, budget=None):
+        """
+        Constructor parameters:
+
+        :param budget: The maximum number of bytes that registered components may hold (``None`` for no
+            limit)
+        """
+        self.budget = budget
+        self._lock = threading.Lock()
+        # name -> (component, priority)
+        self._components = {}
+        self._usage = {}
+        self._enforcements = 0
+        self._evicted_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name, component, priority=0):
+        """
+        Registers a component that implements the memory accounting protocol.
+
+        :param name: The name of the component
+        :param component: The component
+        :param priority: The eviction priority (components with lower values are asked to evict first)
+        """
+        if not hasattr(component, "estimate_memory"):
+            raise ValueError("Component does not support memory accounting: {0}".format(name))
+        with self._lock:
+            self._components[name] = (component, priority)
+
+    def unregister(self, name):
+        """
+        Unregisters a component.
+
+        :param name: The name of the component
+        """
+        with self._lock:
+            self._components.pop(name, None)
+            self._usage.pop(name, None)
+
+    def get_usage(self):
+        """
+        Estimates the memory held by each registered component.
+
+        :return: A ``dict`` (dictionary) mapping component name to its estimated size (in bytes)
+        """
+        with self._lock:
+            components = list(self._components.items())
+        usage = {}
+        for name, (component, _) in components:
+            try:
+                usage[name] = component.estimate_memory()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error estimating memory of component: %s", name)
+        with self._lock:
+            self._usage = usage
+        return dict(usage)
+
+    def enforce(self):
+        """
+        Estimates the memory held by the registered components and, if the total exceeds the budget, asks
+        components to evict the excess.
+
+        :return: The estimated number of bytes released
+        """
+        usage = self.get_usage()
+        excess = sum(usage.values()) - self.budget if self.budget is not None else 0
+        if excess <= 0:
+            return 0
+        with self._lock:
+            components = sorted(((priority, -usage.get(name, 0), name, component)
+                                 for name, (component, priority) in self._components.items()
+                                 if hasattr(component, "evict_memory")),
+                                key=lambda entry: entry[:3])
+        logger.warning("Memory budget exceeded by %d bytes, evicting", excess)
+        released = 0
+        for _, _, name, component in components:
+            if released >= excess:
+                break
+            try:
+                released += component.evict_memory(excess - released)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error evicting memory from component: %s", name)
+        with self._lock:
+            self._enforcements += 1
+            self._evicted_bytes += released
+        return released
+
+    def start(self, interval=60.0):
+        """
+        Starts a background thread that enforces the budget periodically.
+
+        :param interval: The interval (in seconds) between enforcements
+        """
+        self.stop()
+        self._stop.clear()
+
+        def enforce_loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.enforce()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error enforcing memory budget")
+
+        self._thread = threading.Thread(target=enforce_loop, name="MemoryAccountant")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread started by :func:`start`.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def diagnostic_snapshot(self, limit=25, group_by="lineno", compare_to=None):
+        """
+        Takes a diagnostic snapshot of traced Python memory allocations (see :func:`take_diagnostic_snapshot`)
+        that also includes the current estimates of the registered components (``components``).
+
+        :param limit: The maximum number of locations to return
+        :param group_by: How allocations are grouped (``filename``, ``lineno`` or ``traceback``)
+        :param compare_to: A previous diagnostic snapshot to compare to
+        :return: The diagnostic snapshot
+        """
+        diagnostic = take_diagnostic_snapshot(limit, group_by, compare_to)
+        diagnostic["components"] = self.get_usage()
+        return diagnostic
+
+    def get_stats(self):
+        """
+        Returns the memory accounting statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``budget``: The budget (in bytes)
+            * ``usage``: A ``dict`` mapping component name to its most recently estimated size (in bytes)
+            * ``total``: The total of the most recent estimates (in bytes)
+            * ``enforcements``: The number of times the budget was exceeded and eviction was requested
+            * ``evicted_bytes``: The estimated number of bytes released by eviction
+
+        :return: A ``dict`` (dictionary) containing the memory accounting statistics
+        """
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "usage": dict(self._usage),
+                "total": sum(self._usage.values()),
+                "enforcements": self._enforcements,
+                "evicted_bytes": self._evicted_bytes
+            }
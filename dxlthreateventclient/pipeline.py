@@ -0,0 +1,453 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .callbacks import CommonThreatEventCallback
+from .constants import ThreatEventProps, EventProps
+from .routing import ANY, RoutingTable
+from .sampling import ThreatEventSampler
+from ._util import get_field, get_severity, get_deadline, get_remaining, merge_drain_results, drain_component
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+_THREAT_TYPE_PATH = (ThreatEventProps.EVENT, EventProps.THREAT_TYPE)
+
+# The interval (in seconds) at which retired pipelines are checked for in-flight events
+_RETIRE_POLL_INTERVAL = 0.01
+
+
+def parse_field_path(field):
+    """
+    Converts a field reference from a configuration into a field path.
+
+    :param field: A dotted field reference (for example, ``"event.analyzer.hostName"``) or a sequence of keys
+    :return: The field path (a ``tuple`` of keys)
+    """
+    if isinstance(field, (list, tuple)):
+        return tuple(field)
+    return tuple(field.split("."))
+
+
+def compile_filter(filter_config):
+    """
+    Compiles a filter configuration into a predicate.
+
+    A filter configuration is a ``dict`` (dictionary) containing a ``field`` (see :func:`parse_field_path`)
+    and one of the following conditions:
+
+        * ``equals``: The field must be equal to the value
+        * ``in``: The field must be one of the values in the ``list``
+        * ``not_in``: The field must not be one of the values in the ``list``
+        * ``min``: The field must be greater than or equal to the value
+        * ``max``: The field must be less than or equal to the value (for example, ``{"field":
+          "event.threatSeverity", "max": 3}`` passes events of severity ``3`` or more severe)
+
+    Values that cannot be compared with ``min`` or ``max`` (for example, a string compared with a number) do
+    not match.
+
+    :param filter_config: The filter configuration
+    :return: The predicate (a callable that takes a threat event ``dict`` and returns ``True`` to pass it)
+    """
+    path = parse_field_path(filter_config["field"])
+    if "equals" in filter_config:
+        expected = filter_config["equals"]
+        return lambda threat_event_dict: get_field(threat_event_dict, path) == expected
+    if "in" in filter_config:
+        values = frozenset(filter_config["in"])
+        return lambda threat_event_dict: get_field(threat_event_dict, path) in values
+    if "not_in" in filter_config:
+        values = frozenset(filter_config["not_in"])
+        return lambda threat_event_dict: get_field(threat_event_dict, path) not in values
+    if "min" in filter_config or "max" in filter_config:
+        minimum = filter_config.get("min")
+        maximum = filter_config.get("max")
+
+        def in_range(threat_event_dict):
+            value = get_field(threat_event_dict, path)
+            if value is None:
+                return False
+            try:
+                return (minimum is None or value >= minimum) and (maximum is None or value <= maximum)
+            except TypeError:
+                return False
+        return in_range
+    raise ValueError("Filter has no condition: {0}".format(filter_config))
+
+
+class ThreatEventPipeline(object):
+    """
+    A compiled, immutable pipeline of filters, an optional sampler, optional routes and sinks.
+
+    Pipelines are created with :func:`ThreatEventPipeline.compile` and installed in a
+    :class:`ReloadableCallback`.
+    """
+
+    def __init__(self, filters=(), sampler=None, sinks=None, routing_table=None, config=None, owned_sinks=()):
+        """
+        Constructor parameters:
+
+        :param filters: A sequence of predicates (see :func:`compile_filter`)
+        :param sampler: An optional :class:`dxlthreateventclient.sampling.ThreatEventSampler`
+        :param sinks: A ``dict`` (dictionary) mapping sink name to
+            :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback`
+        :param routing_table: An optional :class:`dxlthreateventclient.routing.RoutingTable` that selects the
+            sinks for each event (all sinks receive every event if not specified)
+        :param config: The configuration the pipeline was compiled from
+        :param owned_sinks: The names of the sinks that were created for the pipeline by a factory (as opposed
+            to sink instances owned by the caller). Only these sinks are drained when the pipeline is retired.
+        """
+        self._filters = tuple(filters)
+        self._sampler = sampler
+        self._sinks = dict(sinks or {})
+        self._sink_callbacks = tuple(self._sinks.values())
+        self._routing_table = routing_table
+        self.config = config
+        self._owned_sinks = frozenset(owned_sinks)
+        # One entry per event being processed. Appending to and popping from a deque are atomic, so
+        # in-flight events are tracked without a lock.
+        self._in_flight = deque()
+
+    @staticmethod
+    def compile(config, sink_registry=None, previous=None):
+        """
+        Compiles a pipeline from a configuration.
+
+        The configuration is a ``dict`` (dictionary) that may contain the following keys:
+
+            * ``filters``: A ``list`` of filter configurations (see :func:`compile_filter`). All filters must
+              pass for an event to reach the sinks.
+            * ``sampling``: A ``dict`` containing the ``rates``, ``default_rate`` and ``always_keep_severity``
+              settings of a :class:`dxlthreateventclient.sampling.ThreatEventSampler`
+            * ``sinks``: A ``list`` of sink names, or a ``dict`` mapping sink name to sink settings
+            * ``routes``: A ``list`` of routes (see :class:`dxlthreateventclient.routing.RoutingTable`). Each
+              route is a ``dict`` containing the names of its ``sinks`` (which must be listed in ``sinks``),
+              the ``field`` to route on (see :func:`parse_field_path`) and the ``value`` or ``values`` to
+              route. A route without a ``value`` routes the values of the field that have no other route,
+              and a route without a ``field`` routes events that match no other route. If ``routes`` are
+              specified, each event only reaches the sinks it is routed to, otherwise every event reaches all
+              sinks.
+
+        Sinks are resolved by name from the ``sink_registry``, which maps each name to either a
+        :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` or a factory that creates one from
+        the sink settings. Sinks created by a factory are reused from the ``previous`` pipeline when their
+        settings are unchanged. Sink instances from the registry are used as-is, and are never drained when a
+        pipeline is retired, since they may be used again by a later configuration.
+
+        :param config: The configuration
+        :param sink_registry: A ``dict`` (dictionary) mapping sink name to a callback or factory
+        :param previous: The pipeline being replaced (if any)
+        :return: The compiled :class:`ThreatEventPipeline`
+        """
+        sink_registry = sink_registry or {}
+        filters = [compile_filter(filter_config) for filter_config in config.get("filters", [])]
+
+        sampler = None
+        sampling = config.get("sampling")
+        if sampling:
+            sampler = ThreatEventSampler(rates=sampling.get("rates"),
+                                         default_rate=sampling.get("default_rate", 1.0),
+                                         always_keep_severity=sampling.get("always_keep_severity", 2))
+
+        sink_configs = config.get("sinks", [])
+        if not isinstance(sink_configs, dict):
+            sink_configs = dict((name, None) for name in sink_configs)
+        previous_sinks = previous.owned_sinks if previous else {}
+        previous_configs = (previous.config or {}).get("sinks", {}) if previous else {}
+        if not isinstance(previous_configs, dict):
+            previous_configs = dict((name, None) for name in previous_configs)
+
+        sinks = {}
+        owned_sinks = []
+        for name, settings in sink_configs.items():
+            if name not in sink_registry:
+                raise ValueError("Unknown sink: {0}".format(name))
+            entry = sink_registry[name]
+            if hasattr(entry, "on_threat_event"):
+                sinks[name] = entry
+                continue
+            if name in previous_sinks and previous_configs.get(name) == settings:
+                sinks[name] = previous_sinks[name]
+            else:
+                sinks[name] = entry(settings or {})
+            owned_sinks.append(name)
+
+        routing_table = None
+        routes = config.get("routes")
+        if routes is not None:
+            routing_table = RoutingTable()
+            for route in routes:
+                path = parse_field_path(route["field"]) if "field" in route else None
+                values = route["values"] if "values" in route else [route.get("value", ANY)]
+                for name in route["sinks"]:
+                    if name not in sinks:
+                        raise ValueError("Route refers to a sink that is not configured: {0}".format(name))
+                    for value in values:
+                        routing_table.add_route(sinks[name], path, value)
+        return ThreatEventPipeline(filters, sampler, sinks, routing_table, config, owned_sinks)
+
+    @property
+    def sinks(self):
+        """
+        A ``dict`` (dictionary) mapping sink name to sink callback
+        """
+        return dict(self._sinks)
+
+    @property
+    def owned_sinks(self):
+        """
+        A ``dict`` (dictionary) mapping sink name to sink callback for the sinks that were created by a factory
+        """
+        return dict((name, sink) for name, sink in self._sinks.items() if name in self._owned_sinks)
+
+    @property
+    def sampler(self):
+        """
+        The :class:`dxlthreateventclient.sampling.ThreatEventSampler` (``None`` if events are not sampled)
+        """
+        return self._sampler
+
+    @property
+    def in_flight(self):
+        """
+        The number of events currently being processed by the pipeline
+        """
+        return len(self._in_flight)
+
+    def process(self, threat_event_dict, original_event, is_current=None):
+        """
+        Passes a threat event through the filters and sampler to the sinks.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        :param is_current: An optional callable that takes the pipeline and returns whether it is still active.
+            It is called once the event has been marked in flight, and the event is not processed if it
+            returns ``False``.
+        :return: ``False`` if the event was not processed because the pipeline is no longer active, otherwise
+            ``True``
+        """
+        self._in_flight.append(None)
+        try:
+            if is_current is not None and not is_current(self):
+                return False
+            for event_filter in self._filters:
+                if not event_filter(threat_event_dict):
+                    return True
+            sampler = self._sampler
+            if sampler and not sampler.should_keep(get_severity(threat_event_dict),
+                                                   get_field(threat_event_dict, _THREAT_TYPE_PATH)):
+                return True
+            routing_table = self._routing_table
+            for sink in routing_table.route(threat_event_dict) if routing_table else self._sink_callbacks:
+                try:
+                    sink.on_threat_event(threat_event_dict, original_event)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error passing threat event to sink")
+            return True
+        finally:
+            self._in_flight.pop()
+
+
+class ReloadableCallback(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` whose processing pipeline (filters,
+    sampling, routes and sinks) can be replaced while it remains registered with the client, so configuration
+    changes do not require re-creating the DXL client or re-registering callbacks.
+
+    The active :class:`ThreatEventPipeline` is held in a single attribute. Reloading compiles a new pipeline
+    and replaces the attribute, which is atomic, so the event path reads the pipeline without any locking.
+    Events that were already being processed by the previous pipeline complete on it. Sinks that were
+    created by a factory and are no longer used are drained once the previous pipeline has no in-flight
+    events. Sink instances in the registry are not drained on reload (only by :func:`drain`).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            callback = ReloadableCallback(
+                sink_registry={"siem": siem_callback, "tracker": host_state_tracker})
+            callback.load_config_file("pipeline.json")
+            callback.watch_config_file("pipeline.json", interval=5)
+
+            threat_event_client.add_epo_threat_event_response_callback(callback)
+
+        Where ``pipeline.json`` contains, for example:
+
+        .. code-block:: json
+
+            {
+                "filters": [{"field": "event.threatSeverity", "max": 4}],
+                "sampling": {"rates": {"Exploit Prevention": 0.25}, "always_keep_severity": 2},
+                "sinks": ["siem", "tracker"]
+            }
+    """
+
+    def __init__(self, config=None, sink_registry=None, retire_timeout=30.0):
+        """
+        Constructor parameters:
+
+        :param config: The initial configuration (see :func:`ThreatEventPipeline.compile`). If not specified,
+            events are discarded until a configuration is loaded.
+        :param sink_registry: A ``dict`` (dictionary) mapping sink name to a
+            :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` or a factory that creates one
+            from sink settings
+        :param retire_timeout: The maximum amount of time (in seconds) to wait for sinks that are no longer
+            used to drain after a reload
+        """
+        super(ReloadableCallback, self).__init__()
+        self._sink_registry = dict(sink_registry or {})
+        self._retire_timeout = retire_timeout
+        self._reload_lock = threading.Lock()
+        self._generation = 0
+        self._pipeline = ThreatEventPipeline.compile(config or {}, self._sink_registry)
+        self._watcher = None
+        self._watching = threading.Event()
+
+    @property
+    def pipeline(self):
+        """
+        The active :class:`ThreatEventPipeline`
+        """
+        return self._pipeline
+
+    @property
+    def generation(self):
+        """
+        The number of times the pipeline has been reloaded
+        """
+        return self._generation
+
+    def register_sink(self, name, sink):
+        """
+        Adds a sink (or sink factory) to the registry. The sink is used once a configuration that refers to
+        it is loaded.
+
+        :param name: The name of the sink
+        :param sink: The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback`, or a factory that
+            creates one from sink settings
+        """
+        with self._reload_lock:
+            self._sink_registry[name] = sink
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Passes the threat event to the active pipeline.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        # The event is marked in flight on the pipeline before the pipeline is checked to still be active, so
+        # a concurrent reload either waits for the event or the event is retried on the new pipeline
+        while not self._pipeline.process(threat_event_dict, original_event, self._is_current):
+            pass
+
+    def _is_current(self, pipeline):
+        """
+        Returns whether the specified pipeline is the active pipeline.
+        """
+        return pipeline is self._pipeline
+
+    def reload(self, config):
+        """
+        Compiles a new pipeline from the configuration and atomically replaces the active pipeline. If the
+        configuration is invalid, an exception is raised and the active pipeline is left unchanged.
+
+        Waiting for the events in flight on the previous pipeline, and draining its sinks that are no longer
+        used, happens after the reload lock is released, so a slow retirement does not block other reloads.
+
+        :param config: The configuration (see :func:`ThreatEventPipeline.compile`)
+        :return: The drain result of the sinks that are no longer used (see
+            :func:`dxlthreateventclient.callbacks.CommonThreatEventCallback.drain`)
+        """
+        with self._reload_lock:
+            previous = self._pipeline
+            pipeline = ThreatEventPipeline.compile(config, self._sink_registry, previous)
+            self._pipeline = pipeline
+            self._generation += 1
+        return self._retire(previous, pipeline)
+
+    def _retire(self, previous, pipeline):
+        """
+        Waits for the events in flight on the previous pipeline, then drains the sinks it created that are not
+        used by the new pipeline.
+        """
+        deadline = get_deadline(self._retire_timeout)
+        while previous.in_flight:
+            remaining = get_remaining(deadline)
+            if remaining is not None and remaining <= 0:
+                break
+            time.sleep(_RETIRE_POLL_INTERVAL)
+        active = set(id(sink) for sink in pipeline.sinks.values())
+        results = [drain_component(sink, deadline) for sink in previous.owned_sinks.values()
+                   if id(sink) not in active]
+        return merge_drain_results(*results)
+
+    def load_config_file(self, path):
+        """
+        Loads a JSON configuration file and reloads the pipeline from it.
+
+        :param path: The path of the configuration file
+        :return: The drain result of the sinks that are no longer used (see :func:`reload`)
+        """
+        with open(path) as f:
+            config = json.load(f)
+        return self.reload(config)
+
+    def watch_config_file(self, path, interval=5.0):
+        """
+        Starts a background thread that reloads the pipeline whenever the configuration file is modified.
+        Invalid configurations are logged and ignored.
+
+        :param path: The path of the configuration file
+        :param interval: The interval (in seconds) at which the file is checked for modifications
+        """
+        self.stop_watching()
+        self._watching.clear()
+
+        def watch():
+            last_modified = os.path.getmtime(path) if os.path.exists(path) else None
+            while not self._watching.wait(interval):
+                try:
+                    modified = os.path.getmtime(path)
+                except OSError:
+                    continue
+                if modified == last_modified:
+                    continue
+                last_modified = modified
+                try:
+                    self.load_config_file(path)
+                    logger.info("Reloaded threat event pipeline configuration from %s", path)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error reloading threat event pipeline configuration from %s", path)
+
+        self._watcher = threading.Thread(target=watch, name="ReloadableCallbackWatcher")
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop_watching(self):
+        """
+        Stops the background thread started by :func:`watch_config_file`.
+        """
+        if self._watcher is not None:
+            self._watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def drain(self, timeout=None):
+        """
+        Stops watching the configuration file, waits for in-flight events and drains the sinks of the active
+        pipeline.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: The combined drain result of the sinks (see
+            :func:`dxlthreateventclient.callbacks.CommonThreatEventCallback.drain`)
+        """
+        deadline = get_deadline(timeout)
+        self.stop_watching()
+        result = super(ReloadableCallback, self).drain(timeout)
+        with self._reload_lock:
+            sinks = self._pipeline.sinks.values()
+            return merge_drain_results(result, *[drain_component(sink, deadline) for sink in sinks])
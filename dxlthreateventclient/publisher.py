@@ -0,0 +1,393 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from dxlclient.message import Event
+
+from .constants import ThreatEventProps, EventProps, AnalyzerProps, EntityProps, SourceProps, TargetProps
+from .memory import estimate_items_size
+from ._util import get_constant_values, get_deadline, get_remaining
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+# The default message type for threat events
+DEFAULT_EVENT_MESSAGE_TYPE = "McAfee Common Event"
+
+# The default message version for threat events
+DEFAULT_EVENT_MESSAGE_VERSION = "1.0"
+
+# The members of the event member that contain nested properties, mapped to their constants class
+_EVENT_MEMBER_PROPS = {
+    EventProps.ANALYZER: AnalyzerProps,
+    EventProps.ENTITY: EntityProps,
+    EventProps.SOURCE: SourceProps,
+    EventProps.TARGET: TargetProps
+}
+
+
+def create_threat_event(event=None, analyzer=None, entity=None, files=None, source=None, target=None,
+                        other_data=None, event_message_type=DEFAULT_EVENT_MESSAGE_TYPE,
+                        event_message_version=DEFAULT_EVENT_MESSAGE_VERSION):
+    """
+    Creates a normalized threat event ``dict`` (dictionary) from the specified property ``dict`` objects.
+
+    Every property listed in the constants classes is present in the returned ``dict``. Properties that
+    were not specified are set to ``None``. Properties that are not listed in the constants classes are
+    preserved as-is.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            threat_event_dict = create_threat_event(
+                event={
+                    EventProps.THREAT_NAME: "ExP:Heap",
+                    EventProps.THREAT_SEVERITY: 2
+                },
+                analyzer={
+                    AnalyzerProps.HOST_NAME: "SAMPLE-HOSTNAME"
+                })
+
+    :param event: A ``dict`` of :class:`dxlthreateventclient.constants.EventProps` properties. This may
+        also contain the ``analyzer``, ``entity``, etc. members, which are merged with the corresponding
+        parameters.
+    :param analyzer: A ``dict`` of :class:`dxlthreateventclient.constants.AnalyzerProps` properties
+    :param entity: A ``dict`` of :class:`dxlthreateventclient.constants.EntityProps` properties
+    :param files: A ``list`` of file ``dict`` objects (see :class:`dxlthreateventclient.constants.FilesProps`)
+    :param source: A ``dict`` of :class:`dxlthreateventclient.constants.SourceProps` properties
+    :param target: A ``dict`` of :class:`dxlthreateventclient.constants.TargetProps` properties
+    :param other_data: A ``dict`` of additional properties for the ``otherData`` member
+    :param event_message_type: The message type of the threat event
+    :param event_message_version: The message version of the threat event
+    :return: The normalized threat event ``dict`` (dictionary)
+    """
+    event_dict = dict.fromkeys(get_constant_values(EventProps))
+    event_dict.update(event or {})
+
+    members = {
+        EventProps.ANALYZER: analyzer,
+        EventProps.ENTITY: entity,
+        EventProps.SOURCE: source,
+        EventProps.TARGET: target
+    }
+    for member, props_class in _EVENT_MEMBER_PROPS.items():
+        member_dict = dict.fromkeys(get_constant_values(props_class))
+        member_dict.update(event_dict.get(member) or {})
+        member_dict.update(members[member] or {})
+        event_dict[member] = member_dict
+
+    event_dict[EventProps.FILES] = list(event_dict.get(EventProps.FILES) or []) + list(files or [])
+    other_data_dict = dict(event_dict.get(EventProps.OTHER_DATA) or {})
+    other_data_dict.update(other_data or {})
+    event_dict[EventProps.OTHER_DATA] = other_data_dict
+
+    return {
+        ThreatEventProps.EVENT_MESSAGE_TYPE: event_message_type,
+        ThreatEventProps.EVENT_MESSAGE_VERSION: event_message_version,
+        ThreatEventProps.EVENT: event_dict
+    }
+
+
+class ThreatEventPublisher(object):
+    """
+    Publishes threat events to a DXL topic.
+
+    Threat events can be provided as Python ``dict`` objects (see :func:`create_threat_event`) or as
+    pre-encoded JSON (``str`` or ``bytes``). A single JSON encoder is shared by all sends.
+
+    When ``batch_size`` is ``1`` (the default), each call to :func:`publish` sends the event on the
+    calling thread. Otherwise, events are queued and taken from the queue in batches by ``sender_count``
+    background threads, which pipelines encoding and sending with the callers producing the events. The DXL
+    client has no batch send, so each event is still sent as its own DXL event message (batching reduces
+    queue locking and thread wake-ups, not the number of messages). Synchronous sends from different threads
+    are not serialized.
+
+    Throughput mode (``throughput_mode=True``) is intended for high-volume re-publishing. It defaults
+    to larger batches and multiple sender threads.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            with ThreatEventPublisher(client, "/my/enriched/threat/events",
+                                      throughput_mode=True) as publisher:
+                for threat_event_dict in enriched_events:
+                    publisher.publish(threat_event_dict)
+    """
+
+    # The batch size used in throughput mode (when not specified)
+    THROUGHPUT_BATCH_SIZE = 256
+
+    # The number of sender threads used in throughput mode (when not specified)
+    THROUGHPUT_SENDER_COUNT = 2
+
+    def __init__(self, dxl_client, topic, batch_size=None, flush_interval=0.1, max_queue_size=10000,
+                 sender_count=None, block_when_full=True, throughput_mode=False):
+        """
+        Constructor parameters:
+
+        :param dxl_client: The DXL client to use for communication with the fabric
+        :param topic: The topic to publish threat events to
+        :param batch_size: The maximum number of events to send per batch (``1`` sends synchronously)
+        :param flush_interval: The maximum amount of time (in seconds) a queued event waits before a
+            partial batch is sent
+        :param max_queue_size: The maximum number of queued events
+        :param sender_count: The number of background sender threads
+        :param block_when_full: Whether :func:`publish` blocks while the queue is full. If ``False``, events
+            published while the queue is full are dropped (and counted in :func:`get_stats`).
+        :param throughput_mode: Whether to use the throughput mode defaults for ``batch_size`` and
+            ``sender_count``
+        """
+        if batch_size is None:
+            batch_size = self.THROUGHPUT_BATCH_SIZE if throughput_mode else 1
+        if sender_count is None:
+            sender_count = self.THROUGHPUT_SENDER_COUNT if throughput_mode else 1
+
+        self._dxl_client = dxl_client
+        self._topic = topic
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._block_when_full = block_when_full
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._in_progress = 0
+
+        self._published = 0
+        self._sent = 0
+        self._dropped = 0
+        self._errors = 0
+
+        self._senders = []
+        if self._batch_size > 1:
+            for i in range(max(1, sender_count)):
+                sender = threading.Thread(target=self._sender_loop,
+                                          name="ThreatEventPublisher-{0}".format(i))
+                sender.daemon = True
+                sender.start()
+                self._senders.append(sender)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def topic(self):
+        """
+        The topic that threat events are published to
+        """
+        return self._topic
+
+    def encode(self, threat_event):
+        """
+        Encodes a threat event to a DXL payload.
+
+        :param threat_event: The threat event (a ``dict``, or a pre-encoded JSON ``str`` or ``bytes``)
+        :return: The encoded payload (``bytes``)
+        """
+        if isinstance(threat_event, dict):
+            threat_event = self._encoder.encode(threat_event)
+        if not isinstance(threat_event, bytes):
+            threat_event = threat_event.encode("utf-8")
+        return threat_event
+
+    def publish(self, threat_event):
+        """
+        Publishes a threat event.
+
+        :param threat_event: The threat event (a ``dict``, or a pre-encoded JSON ``str`` or ``bytes``)
+        :return: ``True`` if the event was sent or queued, ``False`` if it was dropped or (when sending
+            synchronously) could not be sent
+        """
+        if not self._senders:
+            with self._condition:
+                if not self._running:
+                    self._dropped += 1
+                    return False
+                self._in_progress += 1
+            sent = False
+            try:
+                sent = self._send([threat_event]) == 1
+            finally:
+                with self._condition:
+                    self._in_progress -= 1
+                    if sent:
+                        self._published += 1
+                    self._condition.notify_all()
+            return sent
+
+        with self._condition:
+            while self._running and len(self._queue) >= self._max_queue_size and self._block_when_full:
+                self._condition.wait()
+            if not self._running or len(self._queue) >= self._max_queue_size:
+                self._dropped += 1
+                return False
+            self._queue.append(threat_event)
+            self._published += 1
+            if len(self._queue) >= self._batch_size:
+                self._condition.notify_all()
+        return True
+
+    def publish_many(self, threat_events):
+        """
+        Publishes multiple threat events.
+
+        :param threat_events: An iterable of threat events (see :func:`publish`)
+        :return: The number of events that were sent or queued
+        """
+        count = 0
+        for threat_event in threat_events:
+            if self.publish(threat_event):
+                count += 1
+        return count
+
+    def _send(self, threat_events):
+        """
+        Sends a batch of threat events, one DXL event message per threat event.
+
+        :param threat_events: The threat events to send
+        :return: The number of events that were sent
+        """
+        sent = errors = 0
+        for threat_event in threat_events:
+            try:
+                event = Event(self._topic)
+                event.payload = self.encode(threat_event)
+                self._dxl_client.send_event(event)
+                sent += 1
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error publishing threat event")
+                errors += 1
+        with self._condition:
+            self._sent += sent
+            self._errors += errors
+        return sent
+
+    def _sender_loop(self):
+        """
+        Sends batches of queued events until the publisher is closed.
+        """
+        while True:
+            with self._condition:
+                deadline = None
+                while self._running and len(self._queue) < self._batch_size:
+                    if not self._queue:
+                        deadline = None
+                        self._condition.wait()
+                        continue
+                    if deadline is None:
+                        deadline = time.time() + self._flush_interval
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if not self._queue:
+                    return
+                count = min(self._batch_size, len(self._queue))
+                batch = [self._queue.popleft() for _ in range(count)]
+                self._in_progress += count
+                self._condition.notify_all()
+
+            try:
+                self._send(batch)
+            finally:
+                with self._condition:
+                    self._in_progress -= count
+                    self._condition.notify_all()
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the queued events (see
+        :mod:`dxlthreateventclient.memory`).
+
+        :return: The estimated size (in bytes)
+        """
+        with self._condition:
+            return estimate_items_size(self._queue, len(self._queue))
+
+    def flush(self, timeout=None):
+        """
+        Waits for all queued events to be sent.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: ``True`` if all queued events were sent, ``False`` otherwise
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._queue or self._in_progress:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def drain(self, timeout=None):
+        """
+        Stops accepting events and sends the queued events. Events still queued when the timeout expires
+        are discarded.
+
+        :param timeout: The maximum amount of time (in seconds) to wait for queued events to be sent
+            (``None`` to wait indefinitely)
+        :return: A ``dict`` (dictionary) containing the number of queued events that were ``flushed``
+            (sent, or failed to send) and ``lost`` (discarded), and the number of events still ``in_flight``
+        """
+        with self._condition:
+            self._running = False
+            completed = self._sent + self._errors
+            self._condition.notify_all()
+        self.flush(timeout)
+        with self._condition:
+            lost = len(self._queue)
+            self._queue.clear()
+            self._dropped += lost
+            self._condition.notify_all()
+            return {"flushed": self._sent + self._errors - completed, "lost": lost,
+                    "in_flight": self._in_progress}
+
+    def close(self, timeout=None):
+        """
+        Drains the publisher (see :func:`drain`) and stops the sender threads.
+
+        :param timeout: The maximum amount of time (in seconds) to wait for queued events to be sent
+            (``None`` to wait indefinitely)
+        :return: The drain result (see :func:`drain`)
+        """
+        deadline = get_deadline(timeout)
+        result = self.drain(timeout)
+        for sender in self._senders:
+            sender.join(get_remaining(deadline))
+        return result
+
+    def get_stats(self):
+        """
+        Returns the publishing statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``published``: The number of events passed to :func:`publish` that were sent (synchronously) or
+              queued
+            * ``sent``: The number of events sent to the fabric
+            * ``queued``: The number of events waiting to be sent
+            * ``dropped``: The number of events dropped because the queue was full, or discarded or rejected
+              by :func:`drain`
+            * ``errors``: The number of events that could not be sent
+
+        :return: A ``dict`` (dictionary) containing the publishing statistics
+        """
+        with self._condition:
+            return {
+                "published": self._published,
+                "sent": self._sent,
+                "queued": len(self._queue) + self._in_progress,
+                "dropped": self._dropped,
+                "errors": self._errors
+            }
@@ -0,0 +1,503 @@
+"""
+Statistical rollups of threat events in bounded memory.
+
+Rollups are computed with streaming data structures whose size does not depend on the number of events:
+
+    * :class:`CountMinSketch` with :class:`TopK`: approximate most frequent values (for example, threat names)
+    * :class:`HyperLogLog`: approximate number of distinct values (for example, host names)
+    * :class:`TimeBucketRing`: exact counts per time bucket (for example, per minute) over a fixed number of
+      buckets
+
+:class:`RollupCallback` maintains a standard set of rollups for received threat events.
+"""
+
+import logging
+import math
+import sys
+import threading
+import time
+
+from .callbacks import CommonThreatEventCallback
+from .constants import ThreatEventProps, EventProps, AnalyzerProps, SourceProps
+from ._util import get_field, get_severity
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _hash64(value, seed=0):
+    """
+    Returns a well-distributed 64-bit hash of a value (the SplitMix64 finalizer applied to the built-in hash,
+    which is not well distributed for small integers).
+    """
+    h = (hash(value) + seed * 0x9E3779B97F4A7C15) & _MASK_64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return h ^ (h >> 31)
+
+
+class CountMinSketch(object):
+    """
+    Estimates the number of occurrences of values in fixed memory (``width * depth`` counters).
+
+    Estimates never undercount. With ``width`` ``w`` and ``depth`` ``d``, an estimate exceeds the true count by
+    more than ``2 / w`` of the total count with probability at most ``2 ** -d``.
+
+    NOTE: This class is not thread-safe.
+    """
+
+    def __init__(self, width=2048, depth=4):
+        """
+        Constructor parameters:
+
+        :param width: The number of counters per row
+        :param depth: The number of rows (independent hash functions)
+        """
+        self.width = width
+        self.depth = depth
+        self._rows = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def add(self, value, count=1):
+        """
+        Adds occurrences of a value.
+
+        :param value: The value (must be hashable)
+        :param count: The number of occurrences
+        :return: The new estimate for the value
+        """
+        self.total += count
+        estimate = None
+        h = _hash64(value)
+        # Derive the row indexes from two halves of a single hash (Kirsch-Mitzenmacher)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        for i, row in enumerate(self._rows):
+            index = (h1 + i * h2) % self.width
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, value):
+        """
+        Returns the estimated number of occurrences of a value.
+
+        :param value: The value
+        :return: The estimated number of occurrences
+        """
+        h = _hash64(value)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        return min(row[(h1 + i * h2) % self.width] for i, row in enumerate(self._rows))
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the sketch.
+
+        :return: The estimated size (in bytes)
+        """
+        return sum(sys.getsizeof(row) for row in self._rows)
+
+
+class TopK(object):
+    """
+    Tracks the ``k`` most frequent values using a :class:`CountMinSketch` for frequencies and a bounded set
+    of candidates.
+
+    NOTE: This class is not thread-safe.
+    """
+
+    def __init__(self, k=10, width=2048, depth=4):
+        """
+        Constructor parameters:
+
+        :param k: The number of values to track
+        :param width: The width of the count-min sketch
+        :param depth: The depth of the count-min sketch
+        """
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        # value -> estimated count
+        self._candidates = {}
+        self._min_count = 0
+
+    def add(self, value, count=1):
+        """
+        Adds occurrences of a value.
+
+        :param value: The value (must be hashable)
+        :param count: The number of occurrences
+        """
+        estimate = self.sketch.add(value, count)
+        candidates = self._candidates
+        if value in candidates:
+            previous = candidates[value]
+            candidates[value] = estimate
+            # Counts only increase, so the minimum only changes when a candidate with the minimum count is
+            # updated
+            if previous == self._min_count:
+                self._min_count = min(candidates.values())
+        elif len(candidates) < self.k:
+            candidates[value] = estimate
+            self._min_count = min(candidates.values())
+        elif estimate > self._min_count:
+            del candidates[min(candidates, key=candidates.get)]
+            candidates[value] = estimate
+            self._min_count = min(candidates.values())
+
+    def get_top(self, k=None):
+        """
+        Returns the most frequent values.
+
+        :param k: The maximum number of values to return (defaults to ``k``)
+        :return: A ``list`` of ``(value, estimated count)`` tuples, most frequent first
+        """
+        top = sorted(self._candidates.items(), key=lambda item: item[1], reverse=True)
+        return top[:k or self.k]
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the sketch and candidates.
+
+        :return: The estimated size (in bytes)
+        """
+        return self.sketch.estimate_memory() + sys.getsizeof(self._candidates)
+
+
+class HyperLogLog(object):
+    """
+    Estimates the number of distinct values in fixed memory (``2 ** precision`` bytes), with a standard error
+    of about ``1.04 / sqrt(2 ** precision)`` (about 1.6% at the default precision).
+
+    NOTE: This class is not thread-safe.
+    """
+
+    def __init__(self, precision=12):
+        """
+        Constructor parameters:
+
+        :param precision: The number of hash bits used to select a register (``4`` to ``16``)
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError("Precision must be between 4 and 16")
+        self.precision = precision
+        self._registers = bytearray(1 << precision)
+
+    def add(self, value):
+        """
+        Adds a value.
+
+        :param value: The value (must be hashable)
+        """
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        remaining = (h << self.precision) & _MASK_64
+        # The position of the leftmost 1-bit of the remaining bits
+        rank = 65 - remaining.bit_length() if remaining else 65 - self.precision
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def merge(self, other):
+        """
+        Merges another :class:`HyperLogLog` of the same precision into this one.
+
+        :param other: The other :class:`HyperLogLog`
+        """
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self._registers = bytearray(max(a, b) for a, b in zip(self._registers, other._registers))
+
+    def count(self):
+        """
+        Returns the estimated number of distinct values.
+
+        :return: The estimated number of distinct values
+        """
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the registers.
+
+        :return: The estimated size (in bytes)
+        """
+        return sys.getsizeof(self._registers)
+
+
+class TimeBucketRing(object):
+    """
+    Counts occurrences of values per time bucket, keeping the ``bucket_count`` most recent buckets in a ring.
+
+    At most ``max_keys`` distinct values are counted per bucket. Further values are counted under the
+    :const:`OTHER` key.
+
+    NOTE: This class is not thread-safe.
+    """
+
+    #: The key under which values beyond ``max_keys`` are counted
+    OTHER = "__other__"
+
+    def __init__(self, bucket_seconds=60, bucket_count=60, max_keys=100):
+        """
+        Constructor parameters:
+
+        :param bucket_seconds: The length of each bucket (in seconds)
+        :param bucket_count: The number of buckets kept
+        :param max_keys: The maximum number of distinct values counted per bucket
+        """
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = bucket_count
+        self.max_keys = max_keys
+        # The bucket number (time divided by bucket length) held in each slot, and the slot counts
+        self._bucket_numbers = [None] * bucket_count
+        self._buckets = [None] * bucket_count
+
+    def add(self, value, now, count=1):
+        """
+        Adds occurrences of a value.
+
+        :param value: The value (must be hashable)
+        :param now: The time of the occurrences
+        :param count: The number of occurrences
+        """
+        number = int(now // self.bucket_seconds)
+        slot = number % self.bucket_count
+        counts = self._buckets[slot]
+        if self._bucket_numbers[slot] != number:
+            if self._bucket_numbers[slot] is not None and self._bucket_numbers[slot] > number:
+                # Too old for the ring
+                return
+            counts = self._buckets[slot] = {}
+            self._bucket_numbers[slot] = number
+        if value not in counts and len(counts) >= self.max_keys:
+            value = self.OTHER
+        counts[value] = counts.get(value, 0) + count
+
+    def get_buckets(self, now, count=None):
+        """
+        Returns the counts of the most recent buckets.
+
+        :param now: The current time
+        :param count: The number of buckets to return (defaults to ``bucket_count``)
+        :return: A ``list`` of ``(bucket start time, counts dict)`` tuples, oldest first. Buckets without
+            occurrences have empty counts.
+        """
+        count = min(count or self.bucket_count, self.bucket_count)
+        current = int(now // self.bucket_seconds)
+        buckets = []
+        for number in range(current - count + 1, current + 1):
+            slot = number % self.bucket_count
+            counts = self._buckets[slot] if self._bucket_numbers[slot] == number else None
+            buckets.append((number * self.bucket_seconds, dict(counts or {})))
+        return buckets
+
+    def get_totals(self, now, count=None):
+        """
+        Returns the counts summed over the most recent buckets.
+
+        :param now: The current time
+        :param count: The number of buckets to sum (defaults to ``bucket_count``)
+        :return: A ``dict`` mapping value to count
+        """
+        totals = {}
+        for _, counts in self.get_buckets(now, count):
+            for value, value_count in counts.items():
+                totals[value] = totals.get(value, 0) + value_count
+        return totals
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the buckets.
+
+        :return: The estimated size (in bytes)
+        """
+        return sum(sys.getsizeof(counts) for counts in self._buckets if counts)
+
+
+class RollupCallback(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that maintains live rollups of the
+    received threat events in bounded memory, without storing the events:
+
+        * Counts per time bucket (per minute by default) by ``severity``
+          (:const:`dxlthreateventclient.constants.EventProps.THREAT_SEVERITY`) and ``threat_type``
+          (:const:`dxlthreateventclient.constants.EventProps.THREAT_TYPE`)
+        * The top-K ``threat_name`` (:const:`dxlthreateventclient.constants.EventProps.THREAT_NAME`),
+          ``host_name`` (:const:`dxlthreateventclient.constants.AnalyzerProps.HOST_NAME`) and ``source_ipv4``
+          (:const:`dxlthreateventclient.constants.SourceProps.IPV4`) values
+        * The number of distinct ``host_name`` and ``source_ipv4`` values
+
+    Top-K and distinct counts cover the events received since the callback was created or last reset (see
+    :func:`reset`).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            rollups = RollupCallback(top_k=20)
+            threat_event_client.add_epo_threat_event_response_callback(rollups)
+
+            # Events per minute by severity over the last 15 minutes
+            print(rollups.get_counts("severity", buckets=15))
+            print(rollups.get_top("host_name"))
+            print(rollups.get_distinct("host_name"))
+    """
+
+    # The dimensions counted per time bucket, mapped to their field paths
+    COUNT_DIMENSIONS = {
+        "threat_type": (ThreatEventProps.EVENT, EventProps.THREAT_TYPE)
+    }
+
+    # The dimensions tracked with top-K, mapped to their field paths
+    TOP_DIMENSIONS = {
+        "threat_name": (ThreatEventProps.EVENT, EventProps.THREAT_NAME),
+        "host_name": (ThreatEventProps.EVENT, EventProps.ANALYZER, AnalyzerProps.HOST_NAME),
+        "source_ipv4": (ThreatEventProps.EVENT, EventProps.SOURCE, SourceProps.IPV4)
+    }
+
+    # The dimensions tracked with distinct counts
+    DISTINCT_DIMENSIONS = ("host_name", "source_ipv4")
+
+    def __init__(self, top_k=10, sketch_width=2048, sketch_depth=4, hll_precision=12, bucket_seconds=60,
+                 bucket_count=60, max_bucket_keys=100, clock=time.time):
+        """
+        Constructor parameters:
+
+        :param top_k: The number of most frequent values tracked per dimension
+        :param sketch_width: The width of the count-min sketches
+        :param sketch_depth: The depth of the count-min sketches
+        :param hll_precision: The precision of the HyperLogLog distinct counters
+        :param bucket_seconds: The length of each time bucket (in seconds)
+        :param bucket_count: The number of time buckets kept
+        :param max_bucket_keys: The maximum number of distinct values counted per time bucket
+        :param clock: The callable used to obtain the current time
+        """
+        super(RollupCallback, self).__init__()
+        self._top_k = top_k
+        self._sketch_width = sketch_width
+        self._sketch_depth = sketch_depth
+        self._hll_precision = hll_precision
+        self._bucket_seconds = bucket_seconds
+        self._bucket_count = bucket_count
+        self._max_bucket_keys = max_bucket_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discards all rollups.
+        """
+        with self._lock:
+            self._since = self._clock()
+            self._events = 0
+            self._rings = dict((dimension, TimeBucketRing(self._bucket_seconds, self._bucket_count,
+                                                          self._max_bucket_keys))
+                               for dimension in ["severity"] + list(self.COUNT_DIMENSIONS))
+            self._tops = dict((dimension, TopK(self._top_k, self._sketch_width, self._sketch_depth))
+                              for dimension in self.TOP_DIMENSIONS)
+            self._distincts = dict((dimension, HyperLogLog(self._hll_precision))
+                                   for dimension in self.DISTINCT_DIMENSIONS)
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Adds the threat event to the rollups.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        severity = get_severity(threat_event_dict)
+        counted = [(dimension, get_field(threat_event_dict, path))
+                   for dimension, path in self.COUNT_DIMENSIONS.items()]
+        tracked = [(dimension, get_field(threat_event_dict, path))
+                   for dimension, path in self.TOP_DIMENSIONS.items()]
+        with self._lock:
+            now = self._clock()
+            self._events += 1
+            self._rings["severity"].add(severity, now)
+            for dimension, value in counted:
+                self._rings[dimension].add(value, now)
+            for dimension, value in tracked:
+                if value is not None:
+                    self._tops[dimension].add(value)
+                    if dimension in self._distincts:
+                        self._distincts[dimension].add(value)
+
+    def get_counts(self, dimension, buckets=None):
+        """
+        Returns the counts per time bucket for a dimension.
+
+        :param dimension: The dimension (``severity`` or ``threat_type``)
+        :param buckets: The number of most recent buckets to return (defaults to all buckets)
+        :return: A ``list`` of ``(bucket start time, counts dict)`` tuples, oldest first
+        """
+        with self._lock:
+            return self._rings[dimension].get_buckets(self._clock(), buckets)
+
+    def get_top(self, dimension, k=None):
+        """
+        Returns the most frequent values of a dimension.
+
+        :param dimension: The dimension (``threat_name``, ``host_name`` or ``source_ipv4``)
+        :param k: The maximum number of values to return (defaults to ``top_k``)
+        :return: A ``list`` of ``(value, estimated count)`` tuples, most frequent first
+        """
+        with self._lock:
+            return self._tops[dimension].get_top(k)
+
+    def get_distinct(self, dimension):
+        """
+        Returns the estimated number of distinct values of a dimension.
+
+        :param dimension: The dimension (``host_name`` or ``source_ipv4``)
+        :return: The estimated number of distinct values
+        """
+        with self._lock:
+            return self._distincts[dimension].count()
+
+    def snapshot(self, buckets=None):
+        """
+        Returns a snapshot of all rollups.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``since``: The time the rollups were started (or last reset)
+            * ``events``: The number of events received since then
+            * ``counts``: A ``dict`` mapping each time bucket dimension to its counts (see :func:`get_counts`)
+            * ``top``: A ``dict`` mapping each top-K dimension to its most frequent values (see
+              :func:`get_top`)
+            * ``distinct``: A ``dict`` mapping each distinct count dimension to its estimated number of
+              distinct values
+
+        :param buckets: The number of most recent time buckets to include (defaults to all buckets)
+        :return: A ``dict`` (dictionary) containing the rollups
+        """
+        with self._lock:
+            now = self._clock()
+            return {
+                "since": self._since,
+                "events": self._events,
+                "counts": dict((dimension, ring.get_buckets(now, buckets))
+                               for dimension, ring in self._rings.items()),
+                "top": dict((dimension, top.get_top()) for dimension, top in self._tops.items()),
+                "distinct": dict((dimension, hll.count()) for dimension, hll in self._distincts.items())
+            }
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the rollups (see :mod:`dxlthreateventclient.memory`).
+        The size is bounded by the constructor parameters.
+
+        :return: The estimated size (in bytes)
+        """
+        with self._lock:
+            return sum(rollup.estimate_memory() for rollup in
+                       list(self._rings.values()) + list(self._tops.values()) + list(self._distincts.values()))
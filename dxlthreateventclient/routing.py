@@ -0,0 +1,271 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from .callbacks import CommonThreatEventCallback
+from ._util import get_field, get_deadline, merge_drain_results, drain_component
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class _Any(object):
+    """
+    The type of the :const:`ANY` wildcard value.
+    """
+
+    def __repr__(self):
+        return "ANY"
+
+
+#: A wildcard route value. A handler routed on ``ANY`` value of a field receives the events whose value for
+#: that field has no exact route.
+ANY = _Any()
+
+
+class _CompiledRoutes(object):
+    """
+    An immutable snapshot of the routes of a :class:`RoutingTable`.
+    """
+
+    def __init__(self, paths, exact, fallbacks, defaults):
+        # The routed field paths, in the order they were first added (so the order in which handlers are
+        # returned does not depend on hashing)
+        self.paths = paths
+        # field path -> {value -> tuple of handlers}
+        self.exact = exact
+        # field path -> tuple of handlers for values without an exact route
+        self.fallbacks = fallbacks
+        # Handlers for events that match no route
+        self.defaults = defaults
+
+
+class RoutingTable(object):
+    """
+    Maps threat event field values to the handlers
+    (:class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` instances) interested in them.
+
+    Routes are indexed by field path (for example, ``(ThreatEventProps.EVENT, EventProps.THREAT_TYPE)``)
+    and then by value in hash tables, so the cost of routing an event depends on the number of distinct
+    field paths, not on the number of routes or handlers. For each field path, an event is routed to the
+    handlers registered for its exact value, or to the wildcard (:const:`ANY`) handlers of that field if
+    there are none. Events that match no route are routed to the default handlers.
+
+    Routes are compiled into an immutable snapshot when they are modified, so events can be routed
+    concurrently with modifications without locking.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (field path, value, handler) tuples in the order they were added
+        self._routes = []
+        self._compiled = _CompiledRoutes((), {}, {}, ())
+
+    def add_route(self, handler, path=None, value=ANY):
+        """
+        Adds a route.
+
+        :param handler: The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` to route
+            matching events to
+        :param path: The field path (a ``tuple`` of keys). If ``None``, the handler is a default handler that
+            receives events that match no other route.
+        :param value: The field value to route on, or :const:`ANY` to receive events whose value for the field
+            has no exact route
+        """
+        if path is not None:
+            path = tuple(path)
+            if value is not ANY:
+                # Fail early for values that cannot be indexed
+                hash(value)
+        with self._lock:
+            self._routes.append((path, value, handler))
+            self._compile()
+
+    def add_routes(self, handler, path, values):
+        """
+        Adds a route for each of the specified values of a field.
+
+        :param handler: The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` to route
+            matching events to
+        :param path: The field path (a ``tuple`` of keys)
+        :param values: The field values to route on
+        """
+        for value in values:
+            self.add_route(handler, path, value)
+
+    def remove_handler(self, handler):
+        """
+        Removes all of the routes to a handler.
+
+        :param handler: The handler
+        """
+        with self._lock:
+            self._routes = [route for route in self._routes if route[2] is not handler]
+            self._compile()
+
+    @property
+    def handlers(self):
+        """
+        The distinct handlers of all routes (a ``list``)
+        """
+        with self._lock:
+            return _unique(route[2] for route in self._routes)
+
+    def _compile(self):
+        """
+        Rebuilds the routing snapshot from the routes.
+
+        NOTE: Must be invoked while holding the lock.
+        """
+        exact = {}
+        fallbacks = {}
+        defaults = []
+        for path, value, handler in self._routes:
+            if path is None:
+                defaults.append(handler)
+            elif value is ANY:
+                fallbacks.setdefault(path, []).append(handler)
+            else:
+                exact.setdefault(path, {}).setdefault(value, []).append(handler)
+        self._compiled = _CompiledRoutes(
+            tuple(OrderedDict.fromkeys(path for path, _, _ in self._routes if path is not None)),
+            dict((path, dict((value, tuple(_unique(handlers))) for value, handlers in values.items()))
+                 for path, values in exact.items()),
+            dict((path, tuple(_unique(handlers))) for path, handlers in fallbacks.items()),
+            tuple(_unique(defaults)))
+
+    def route(self, threat_event_dict):
+        """
+        Returns the handlers a threat event is routed to.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :return: A ``list`` of distinct handlers (ordered by the field paths in the order they were first routed,
+            then by the order in which the routes were added)
+        """
+        compiled = self._compiled
+        matched = []
+        for path in compiled.paths:
+            handlers = None
+            values = compiled.exact.get(path)
+            if values:
+                try:
+                    handlers = values.get(get_field(threat_event_dict, path))
+                except TypeError:
+                    # Unhashable value, no exact route can match
+                    pass
+            if handlers is None:
+                handlers = compiled.fallbacks.get(path)
+            if handlers:
+                matched.extend(handlers)
+        if not matched:
+            return list(compiled.defaults)
+        return _unique(matched) if len(matched) > 1 else matched
+
+
+def _unique(handlers):
+    """
+    Returns the distinct handlers, preserving their order.
+    """
+    seen = set()
+    result = []
+    for handler in handlers:
+        if id(handler) not in seen:
+            seen.add(id(handler))
+            result.append(handler)
+    return result
+
+
+class RoutingCallback(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that decodes each threat event once
+    and dispatches it only to the handlers whose routes match (see :class:`RoutingTable`).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            threat_type = (ThreatEventProps.EVENT, EventProps.THREAT_TYPE)
+            analyzer_name = (ThreatEventProps.EVENT, EventProps.ANALYZER, AnalyzerProps.NAME)
+
+            router = RoutingCallback()
+            router.routing_table.add_route(malware_handler, threat_type, "Malware")
+            router.routing_table.add_route(other_threats_handler, threat_type, ANY)
+            router.routing_table.add_route(ens_handler, analyzer_name, "McAfee Endpoint Security")
+            router.routing_table.add_route(unmatched_handler)
+
+            threat_event_client.add_epo_threat_event_response_callback(router)
+    """
+
+    def __init__(self, routing_table=None):
+        """
+        Constructor parameters:
+
+        :param routing_table: The :class:`RoutingTable` (an empty table if not specified)
+        """
+        super(RoutingCallback, self).__init__()
+        self._routing_table = routing_table or RoutingTable()
+        self._lock = threading.Lock()
+        self._routed = 0
+        self._unrouted = 0
+        self._errors = 0
+
+    @property
+    def routing_table(self):
+        """
+        The :class:`RoutingTable` used to route events
+        """
+        return self._routing_table
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Dispatches the threat event to the handlers it is routed to.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        handlers = self._routing_table.route(threat_event_dict)
+        errors = 0
+        for handler in handlers:
+            try:
+                handler.on_threat_event(threat_event_dict, original_event)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error routing threat event")
+                errors += 1
+        with self._lock:
+            if handlers:
+                self._routed += 1
+            else:
+                self._unrouted += 1
+            self._errors += errors
+
+    def drain(self, timeout=None):
+        """
+        Waits for in-flight events and then drains each of the handlers in the routing table.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: The combined drain result (see
+            :func:`dxlthreateventclient.callbacks.CommonThreatEventCallback.drain`)
+        """
+        deadline = get_deadline(timeout)
+        result = super(RoutingCallback, self).drain(timeout)
+        return merge_drain_results(result, *[drain_component(handler, deadline)
+                                             for handler in self._routing_table.handlers])
+
+    def get_stats(self):
+        """
+        Returns the routing statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``routed``: The number of events routed to at least one handler
+            * ``unrouted``: The number of events that matched no route (and there were no default handlers)
+            * ``errors``: The number of times a handler raised an exception
+
+        :return: A ``dict`` (dictionary) containing the routing statistics
+        """
+        with self._lock:
+            return {
+                "routed": self._routed,
+                "unrouted": self._unrouted,
+                "errors": self._errors
+            }
@@ -0,0 +1,365 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+from .callbacks import CommonThreatEventCallback
+from .constants import ThreatEventProps, EventProps
+from .memory import estimate_items_size
+from ._util import LOWEST_SEVERITY, normalize_severity, get_severity, get_field, get_deadline, get_remaining, \
+    merge_drain_results, drain_component
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+_THREAT_TYPE_PATH = (ThreatEventProps.EVENT, EventProps.THREAT_TYPE)
+
+# Patterns used to extract the sampling header fields from a raw (undecoded) payload. The surrounding
+# quotes ensure that similarly named properties (such as "threatSeverityString") are not matched.
+_SEVERITY_PATTERN = re.compile(b'"' + EventProps.THREAT_SEVERITY.encode("utf-8") + b'"\\s*:\\s*"?(-?\\d+)')
+_THREAT_TYPE_PATTERN = re.compile(b'"' + EventProps.THREAT_TYPE.encode("utf-8") + b'"\\s*:\\s*"((?:[^"\\\\]|\\\\.)*)"')
+
+
+def parse_sampling_header(payload):
+    """
+    Extracts the severity and threat type from a raw threat event payload without decoding it in full.
+
+    :param payload: The raw payload (``bytes``)
+    :return: A ``(severity, threat_type)`` tuple. The severity is normalized (see
+        :const:`dxlthreateventclient.constants.EventProps.THREAT_SEVERITY`) and the threat type is
+        ``None`` if it is not present.
+    """
+    match = _SEVERITY_PATTERN.search(payload)
+    severity = normalize_severity(match.group(1)) if match else LOWEST_SEVERITY
+    match = _THREAT_TYPE_PATTERN.search(payload)
+    threat_type = None
+    if match:
+        raw = match.group(1)
+        threat_type = raw.decode("utf-8")
+        if "\\" in threat_type:
+            # Resolve escape sequences
+            threat_type = json.loads('"' + threat_type + '"')
+    return severity, threat_type
+
+
+class ThreatEventSampler(object):
+    """
+    Decides which threat events to keep based on their severity and threat type.
+
+        * Events at or above the ``always_keep_severity`` (numerically less than or equal to it) are always
+          kept.
+        * Other events are kept with the probability configured for their threat type in ``rates``, or
+          ``default_rate`` if their threat type is not listed.
+
+    The number of events seen and kept is counted per threat type, so that consumers of the sampled
+    events can rescale totals (see :func:`get_counters`). The counters are updated under a lock, so
+    :func:`should_keep` briefly acquires the lock for every event. The lock is only held for the counter
+    update and is rarely contended, but all threads sampling with the same sampler share it.
+    """
+
+    def __init__(self, rates=None, default_rate=1.0, always_keep_severity=2):
+        """
+        Constructor parameters:
+
+        :param rates: A ``dict`` mapping threat type to the fraction (``0.0`` to ``1.0``) of events to keep
+        :param default_rate: The fraction of events to keep for threat types not listed in ``rates``
+        :param always_keep_severity: Events with this severity or a more severe (lower) value are always kept
+        """
+        self._rates = dict(rates or {})
+        self._default_rate = default_rate
+        self._always_keep_severity = always_keep_severity
+        self._lock = threading.Lock()
+        # threat type -> [seen, kept]
+        self._counters = {}
+
+    @property
+    def rates(self):
+        """
+        A ``dict`` mapping threat type to the fraction of events kept
+        """
+        return dict(self._rates)
+
+    @property
+    def default_rate(self):
+        """
+        The fraction of events kept for threat types not listed in :attr:`rates`
+        """
+        return self._default_rate
+
+    @property
+    def always_keep_severity(self):
+        """
+        Events with this severity or a more severe (lower) value are always kept
+        """
+        return self._always_keep_severity
+
+    def should_keep(self, severity, threat_type):
+        """
+        Decides whether to keep an event, updating the counters.
+
+        :param severity: The severity of the event
+        :param threat_type: The threat type of the event
+        :return: ``True`` if the event should be kept, ``False`` otherwise
+        """
+        keep = severity <= self._always_keep_severity or \
+            random.random() < self._rates.get(threat_type, self._default_rate)
+        self.count(threat_type, 1, 1 if keep else 0)
+        return keep
+
+    def count(self, threat_type, seen, kept):
+        """
+        Updates the counters for a threat type.
+
+        :param threat_type: The threat type
+        :param seen: The number of events seen
+        :param kept: The number of events kept
+        """
+        with self._lock:
+            counters = self._counters.get(threat_type)
+            if counters is None:
+                counters = self._counters[threat_type] = [0, 0]
+            counters[0] += seen
+            counters[1] += kept
+
+    def get_counters(self):
+        """
+        Returns the sampling counters.
+
+        The returned ``dict`` (dictionary) maps each threat type (``None`` for events without a threat type)
+        to a ``dict`` containing the number of events ``seen`` and ``kept``, and the ``weight`` by which
+        counts of kept events should be multiplied to estimate the counts of all events.
+
+        :return: A ``dict`` (dictionary) containing the sampling counters
+        """
+        with self._lock:
+            return dict((threat_type, {"seen": seen, "kept": kept,
+                                       "weight": float(seen) / kept if kept else 0.0})
+                        for threat_type, (seen, kept) in self._counters.items())
+
+
+class SamplingCallback(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that passes a statistically
+    representative subset of threat events to another threat event callback.
+
+    When the callback is registered with the client, the sampling decision is made from the severity and
+    threat type, which are extracted from the raw payload with a minimal header parse (see
+    :func:`parse_sampling_header`). Only events that are kept are decoded in full. When events are passed
+    to the callback already decoded (via :func:`on_threat_event`), the same decision is made from the
+    decoded ``dict``.
+
+    Events that pass the per-threat-type rates of the :class:`ThreatEventSampler` can additionally be
+    limited with reservoir sampling: when ``reservoir_size`` is specified, at most that many events per
+    threat type are kept in each ``window``, chosen uniformly at random from the events of that window.
+    Reservoirs are delivered when their window ends (by a background thread, so that held events are
+    delivered even when no further events arrive), or when :func:`flush` or :func:`drain` is invoked. Events
+    that are always kept due to their severity bypass the reservoirs and are delivered immediately.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            sampler = ThreatEventSampler(rates={"Exploit Prevention": 0.1}, default_rate=0.5,
+                                         always_keep_severity=2)
+            sampling_callback = SamplingCallback(my_callback, sampler, reservoir_size=100, window=60)
+            threat_event_client.add_epo_threat_event_response_callback(sampling_callback)
+
+            # Estimate the total number of exploit prevention events from those that were kept
+            counters = sampler.get_counters()["Exploit Prevention"]
+            estimated_total = counters["kept"] * counters["weight"]
+    """
+
+    def __init__(self, threat_event_callback, sampler=None, reservoir_size=None, window=60.0, clock=time.time):
+        """
+        Constructor parameters:
+
+        :param threat_event_callback: The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback`
+            to pass sampled threat events to
+        :param sampler: The :class:`ThreatEventSampler` (a sampler that keeps all events if not specified)
+        :param reservoir_size: The maximum number of events to keep per threat type in each window
+            (``None`` to disable reservoir sampling)
+        :param window: The length of each reservoir sampling window (in seconds)
+        :param clock: The callable used to obtain the current time
+        """
+        super(SamplingCallback, self).__init__()
+        self._threat_event_callback = threat_event_callback
+        self._sampler = sampler or ThreatEventSampler()
+        self._reservoir_size = reservoir_size
+        self._window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._window_start = clock()
+        # threat type -> [events seen in window, reservoir of original events]
+        self._reservoirs = {}
+        # (thread, stop event) of the thread delivering reservoirs as windows end, started with the first
+        # reservoir event
+        self._flusher = None
+
+    @property
+    def sampler(self):
+        """
+        The :class:`ThreatEventSampler` used to make sampling decisions
+        """
+        return self._sampler
+
+    def on_event(self, event):
+        """
+        Makes the sampling decision from the raw payload, only decoding events that are kept (once they are
+        delivered).
+
+        :param event: The original DXL Threat Event message that was received
+        """
+        self._in_flight.append(None)
+        try:
+            severity, threat_type = parse_sampling_header(event.payload)
+            self._sample(severity, threat_type, None, event)
+        finally:
+            self._in_flight.pop()
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Samples a threat event that has already been decoded (for example, by a
+        :class:`dxlthreateventclient.dispatch.PriorityDispatchCallback` that passes events to this callback).
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        self._sample(get_severity(threat_event_dict), get_field(threat_event_dict, _THREAT_TYPE_PATH),
+                     threat_event_dict, original_event)
+
+    def _sample(self, severity, threat_type, threat_event_dict, event):
+        """
+        Delivers the event immediately, holds it in a reservoir or discards it. Events received from the
+        fabric are passed undecoded (``threat_event_dict`` is ``None``).
+        """
+        if self._sampler.should_keep(severity, threat_type):
+            if self._reservoir_size is None or severity <= self._sampler.always_keep_severity:
+                if threat_event_dict is None:
+                    threat_event_dict = self._decode_threat_event(event)
+                self._threat_event_callback.on_threat_event(threat_event_dict, event)
+            else:
+                self._add_to_reservoir(threat_type, threat_event_dict, event)
+
+    def _add_to_reservoir(self, threat_type, threat_event_dict, event):
+        """
+        Adds an event to the reservoir for its threat type. Events received from the fabric are held
+        undecoded (``threat_event_dict`` is ``None``) and are only decoded if they are delivered.
+        """
+        expired = None
+        with self._lock:
+            now = self._clock()
+            if now - self._window_start >= self._window:
+                expired = self._swap_reservoirs(now)
+            reservoir = self._reservoirs.get(threat_type)
+            if reservoir is None:
+                reservoir = self._reservoirs[threat_type] = [0, []]
+            reservoir[0] += 1
+            if len(reservoir[1]) < self._reservoir_size:
+                reservoir[1].append((threat_event_dict, event))
+            else:
+                index = random.randint(0, reservoir[0] - 1)
+                if index < self._reservoir_size:
+                    reservoir[1][index] = (threat_event_dict, event)
+            if self._flusher is None:
+                stop = threading.Event()
+                flusher = threading.Thread(target=self._flush_loop, args=(stop,), name="SamplingCallbackFlusher")
+                flusher.daemon = True
+                flusher.start()
+                self._flusher = (flusher, stop)
+        if expired:
+            self._deliver(expired)
+
+    def _flush_loop(self, stop):
+        """
+        Delivers the reservoirs at the end of each window, so that held events are delivered even if no
+        further events arrive.
+
+        :param stop: The ``threading.Event`` that is set to stop the thread
+        """
+        remaining = self._window
+        while not stop.wait(remaining):
+            expired = None
+            with self._lock:
+                now = self._clock()
+                if now - self._window_start >= self._window:
+                    expired = self._swap_reservoirs(now)
+                remaining = max(0.0, self._window_start + self._window - now)
+            if expired:
+                self._deliver(expired)
+
+    def _swap_reservoirs(self, now):
+        """
+        Starts a new window, returning the reservoirs of the previous window.
+
+        NOTE: Must be invoked while holding the lock.
+        """
+        expired = self._reservoirs
+        self._reservoirs = {}
+        self._window_start = now
+        return expired
+
+    def _deliver(self, reservoirs):
+        """
+        Decodes and delivers the events held in the specified reservoirs.
+
+        :param reservoirs: The reservoirs
+        :return: The number of events delivered
+        """
+        delivered = 0
+        for threat_type, (seen, events) in reservoirs.items():
+            # Events that passed the sampler but were not retained by the reservoir were not kept
+            self._sampler.count(threat_type, 0, len(events) - seen)
+            for threat_event_dict, event in events:
+                try:
+                    if threat_event_dict is None:
+                        threat_event_dict = self._decode_threat_event(event)
+                    self._threat_event_callback.on_threat_event(threat_event_dict, event)
+                    delivered += 1
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error delivering sampled threat event")
+        return delivered
+
+    def flush(self):
+        """
+        Ends the current reservoir sampling window, delivering the events held in the reservoirs.
+
+        :return: The number of events delivered
+        """
+        with self._lock:
+            expired = self._swap_reservoirs(self._clock())
+        return self._deliver(expired)
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the reservoirs (see :mod:`dxlthreateventclient.memory`).
+
+        :return: The estimated size (in bytes)
+        """
+        with self._lock:
+            return sum(estimate_items_size(events, len(events)) for _, events in self._reservoirs.values())
+
+    def drain(self, timeout=None):
+        """
+        Waits for in-flight events, delivers the events held in the reservoirs and then drains the threat
+        event callback that sampled events are passed to.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: A ``dict`` (dictionary) containing the number of reservoir events that were ``flushed``
+            (delivered) and ``lost``, and the number of events still ``in_flight``
+        """
+        deadline = get_deadline(timeout)
+        result = super(SamplingCallback, self).drain(timeout)
+        with self._lock:
+            # The flusher thread is started again if further events are held
+            flusher, self._flusher = self._flusher, None
+            expired = self._swap_reservoirs(self._clock())
+        if flusher:
+            flusher[1].set()
+            flusher[0].join(get_remaining(deadline))
+        held = sum(len(events) for _, events in expired.values())
+        flushed = self._deliver(expired)
+        return merge_drain_results(
+            result, {"flushed": flushed, "lost": held - flushed},
+            drain_component(self._threat_event_callback, deadline))
@@ -0,0 +1,590 @@
+"""
+Threat event callbacks that forward threat events to external systems (such as a SIEM) over HTTP or syslog.
+
+Sinks queue events and deliver them in batches from a pool of worker threads, each of which holds a
+persistent connection. Failed batches are retried with exponential backoff and jitter. The latency of each
+delivery attempt is reported to latency listeners, which can be used to slow down upstream dispatching
+(see :class:`AimdRateController`).
+"""
+
+import json
+import logging
+import random
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection
+    from urllib.parse import urlparse
+except ImportError:  # pragma: no cover
+    from httplib import HTTPConnection, HTTPSConnection
+    from urlparse import urlparse
+
+from .callbacks import CommonThreatEventCallback
+from .memory import estimate_items_size
+from ._util import get_severity, get_deadline, get_remaining, merge_drain_results
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class SinkError(Exception):
+    """
+    Raised when a sink rejects a batch of events.
+    """
+
+    def __init__(self, message, retryable=True):
+        """
+        Constructor parameters:
+
+        :param message: The error message
+        :param retryable: Whether delivery of the batch should be retried
+        """
+        super(SinkError, self).__init__(message)
+        self.retryable = retryable
+
+
+class AimdRateController(object):
+    """
+    A latency listener (see :func:`BatchingSink.add_latency_listener`) that adjusts the rate of a
+    :class:`dxlthreateventclient.dispatch.TokenBucket` using additive-increase/multiplicative-decrease.
+
+    Each delivery that succeeds within ``target_latency`` increases the rate by ``increase`` events per
+    second (up to ``max_rate``). A delivery that fails or exceeds ``target_latency`` multiplies the rate by
+    ``decrease`` (down to ``min_rate``), at most once per ``target_latency`` so that the batches in flight
+    when a sink slows down only reduce the rate once.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            sink = HttpSink("https://siem.example.com/ingest")
+            dispatcher = PriorityDispatchCallback(sink, rate=1000)
+            sink.add_latency_listener(
+                AimdRateController(dispatcher.token_bucket, target_latency=0.5, min_rate=50, max_rate=5000))
+
+            threat_event_client.add_epo_threat_event_response_callback(dispatcher)
+    """
+
+    def __init__(self, token_bucket, target_latency, min_rate, max_rate=None, increase=None, decrease=0.5):
+        """
+        Constructor parameters:
+
+        :param token_bucket: The :class:`dxlthreateventclient.dispatch.TokenBucket` to adjust
+        :param target_latency: The delivery latency (in seconds) above which the rate is decreased
+        :param min_rate: The minimum rate (events per second)
+        :param max_rate: The maximum rate (events per second, defaults to the initial rate of the bucket)
+        :param increase: The number of events per second added after each fast delivery (defaults to 1% of
+            ``max_rate``)
+        :param decrease: The factor the rate is multiplied by after a slow or failed delivery
+        """
+        if token_bucket is None:
+            raise ValueError("A token bucket is required (create the dispatcher with a rate)")
+        self._bucket = token_bucket
+        self._target_latency = target_latency
+        self._min_rate = min_rate
+        self._max_rate = max_rate or token_bucket.rate
+        self._increase = increase or max(self._max_rate / 100.0, 1.0)
+        self._decrease = decrease
+        self._lock = threading.Lock()
+        self._last_decrease = 0
+
+    def __call__(self, latency, success):
+        """
+        Adjusts the rate based on the outcome of a delivery.
+
+        :param latency: The time (in seconds) taken by the delivery attempt
+        :param success: Whether the delivery succeeded
+        """
+        with self._lock:
+            rate = self._bucket.rate
+            if success and latency <= self._target_latency:
+                rate = min(self._max_rate, rate + self._increase)
+            else:
+                now = time.time()
+                if now - self._last_decrease < self._target_latency:
+                    return
+                self._last_decrease = now
+                rate = max(self._min_rate, rate * self._decrease)
+            self._bucket.rate = rate
+
+
+class BatchingSink(CommonThreatEventCallback):
+    """
+    Base class for threat event callbacks that deliver events in batches over persistent connections.
+
+    Received events are queued and delivered by ``connection_count`` worker threads, each of which holds a
+    persistent connection (created on first use and re-created after a connection error). A batch is sent
+    once ``batch_size`` events are queued or the oldest queued event has waited ``flush_interval`` seconds.
+
+    A batch that fails with a retryable error is retried up to ``max_retries`` times, waiting a random
+    amount of time between zero and ``min(max_backoff, initial_backoff * 2 ** attempt)`` seconds before
+    each retry (exponential backoff with full jitter).
+
+    When the queue is full, :func:`on_threat_event` blocks (or drops the event if ``block_when_full`` is
+    ``False``). When the sink is placed behind a :class:`dxlthreateventclient.dispatch.PriorityDispatchCallback`,
+    blocking holds back the dispatcher's workers, so the dispatcher sheds low severity events first.
+
+    Subclasses implement :func:`_create_connection`, :func:`_close_connection` and :func:`_send_batch`, and
+    may override :func:`_encode`.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1.0, max_queue_size=10000, connection_count=2,
+                 max_retries=5, initial_backoff=0.1, max_backoff=30.0, block_when_full=True):
+        """
+        Constructor parameters:
+
+        :param batch_size: The maximum number of events per batch
+        :param flush_interval: The maximum amount of time (in seconds) a queued event waits before a partial
+            batch is sent
+        :param max_queue_size: The maximum number of queued events
+        :param connection_count: The number of persistent connections (and worker threads)
+        :param max_retries: The maximum number of times delivery of a batch is retried
+        :param initial_backoff: The maximum wait (in seconds) before the first retry
+        :param max_backoff: The upper limit (in seconds) of the wait before a retry
+        :param block_when_full: Whether :func:`on_threat_event` blocks while the queue is full. If ``False``,
+            events received while the queue is full are dropped.
+        """
+        super(BatchingSink, self).__init__()
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval
+        self._max_queue_size = max_queue_size
+        self._max_retries = max_retries
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._block_when_full = block_when_full
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+        self._latency_listeners = ()
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._closed = threading.Event()
+        self._in_progress = 0
+
+        self._received = 0
+        self._sent = 0
+        self._batches = 0
+        self._retries = 0
+        self._dropped = 0
+        self._errors = 0
+        self._latency = 0.0
+
+        self._workers = []
+        for i in range(max(1, connection_count)):
+            worker = threading.Thread(target=self._worker_loop,
+                                      name="{0}-{1}".format(self.__class__.__name__, i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add_latency_listener(self, listener):
+        """
+        Adds a listener that is invoked with the latency (in seconds) and outcome (``True`` if successful)
+        of each delivery attempt (see :class:`AimdRateController`).
+
+        :param listener: The listener (a callable that takes ``latency`` and ``success`` arguments)
+        """
+        with self._condition:
+            self._latency_listeners = self._latency_listeners + (listener,)
+
+    def remove_latency_listener(self, listener):
+        """
+        Removes a latency listener.
+
+        :param listener: The listener
+        """
+        with self._condition:
+            self._latency_listeners = tuple(l for l in self._latency_listeners if l is not listener)
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Queues the threat event for delivery.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        with self._condition:
+            self._received += 1
+            while self._running and len(self._queue) >= self._max_queue_size and self._block_when_full:
+                self._condition.wait()
+            if not self._running or len(self._queue) >= self._max_queue_size:
+                self._dropped += 1
+                return
+            self._queue.append(threat_event_dict)
+            if len(self._queue) >= self._batch_size:
+                self._condition.notify_all()
+
+    def _encode(self, threat_event_dict):
+        """
+        Encodes a threat event for delivery.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :return: The encoded event (``bytes``)
+        """
+        return self._encoder.encode(threat_event_dict).encode("utf-8")
+
+    def _create_connection(self):
+        """
+        Creates a connection to the sink.
+
+        :return: The connection
+        """
+        raise NotImplementedError()
+
+    def _close_connection(self, connection):
+        """
+        Closes a connection to the sink.
+
+        :param connection: The connection
+        """
+        raise NotImplementedError()
+
+    def _send_batch(self, connection, payloads):
+        """
+        Sends a batch of encoded events. Raises an exception if the batch was not delivered.
+
+        :param connection: The connection
+        :param payloads: The encoded events (a ``list`` of ``bytes``)
+        """
+        raise NotImplementedError()
+
+    def _worker_loop(self):
+        """
+        Delivers batches of queued events until the sink is drained.
+        """
+        connection = None
+        while True:
+            with self._condition:
+                deadline = None
+                while self._running and len(self._queue) < self._batch_size:
+                    if not self._queue:
+                        deadline = None
+                        self._condition.wait()
+                        continue
+                    if deadline is None:
+                        deadline = time.time() + self._flush_interval
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if not self._queue:
+                    break
+                count = min(self._batch_size, len(self._queue))
+                batch = [self._queue.popleft() for _ in range(count)]
+                self._in_progress += count
+                self._condition.notify_all()
+
+            try:
+                connection = self._deliver(connection, batch)
+            finally:
+                with self._condition:
+                    self._in_progress -= count
+                    self._condition.notify_all()
+        if connection is not None:
+            self._close_quietly(connection)
+
+    def _close_quietly(self, connection):
+        try:
+            self._close_connection(connection)
+        except Exception:  # pylint: disable=broad-except
+            logger.debug("Error closing sink connection", exc_info=True)
+
+    def _deliver(self, connection, batch):
+        """
+        Delivers a batch of events, retrying retryable failures.
+
+        :param connection: The worker's current connection (``None`` if not connected)
+        :param batch: The threat event ``dict`` objects to deliver
+        :return: The worker's connection after delivery (``None`` if it was closed)
+        """
+        payloads = []
+        for threat_event_dict in batch:
+            try:
+                payloads.append(self._encode(threat_event_dict))
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error encoding threat event")
+        with self._condition:
+            self._errors += len(batch) - len(payloads)
+        if not payloads:
+            return connection
+
+        attempt = 0
+        while True:
+            start = time.time()
+            error = None
+            try:
+                if connection is None:
+                    connection = self._create_connection()
+                self._send_batch(connection, payloads)
+            except Exception as ex:  # pylint: disable=broad-except
+                error = ex
+            latency = time.time() - start
+            for listener in self._latency_listeners:
+                try:
+                    listener(latency, error is None)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error invoking sink latency listener")
+
+            if error is None:
+                with self._condition:
+                    self._sent += len(payloads)
+                    self._batches += 1
+                    # Exponentially weighted moving average of successful delivery latency
+                    self._latency = latency if not self._latency else 0.8 * self._latency + 0.2 * latency
+                return connection
+
+            if not isinstance(error, SinkError) and connection is not None:
+                # The connection is in an unknown state, create a new one for the next attempt
+                self._close_quietly(connection)
+                connection = None
+            retryable = getattr(error, "retryable", True)
+            if not retryable or attempt >= self._max_retries or \
+                    self._closed.wait(random.uniform(0, min(self._max_backoff,
+                                                            self._initial_backoff * 2 ** attempt))):
+                logger.error("Error delivering %d threat events to sink: %s", len(payloads), error)
+                with self._condition:
+                    self._errors += len(payloads)
+                return connection
+            attempt += 1
+            with self._condition:
+                self._retries += 1
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the queued events (see
+        :mod:`dxlthreateventclient.memory`).
+
+        :return: The estimated size (in bytes)
+        """
+        with self._condition:
+            return estimate_items_size(self._queue, len(self._queue))
+
+    def flush(self, timeout=None):
+        """
+        Waits for all queued events to be delivered.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: ``True`` if all queued events were delivered (or failed), ``False`` otherwise
+        """
+        deadline = get_deadline(timeout)
+        with self._condition:
+            self._condition.notify_all()
+            while self._queue or self._in_progress:
+                remaining = get_remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def drain(self, timeout=None):
+        """
+        Stops accepting events and delivers the queued events. Events still queued when the timeout expires
+        are discarded.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: A ``dict`` (dictionary) containing the number of queued events that were ``flushed``
+            (delivered, or failed to deliver) and ``lost`` (discarded), and the number of events still
+            ``in_flight``
+        """
+        deadline = get_deadline(timeout)
+        result = super(BatchingSink, self).drain(timeout)
+        with self._condition:
+            self._running = False
+            completed = self._sent + self._errors
+            self._condition.notify_all()
+        self.flush(get_remaining(deadline))
+        with self._condition:
+            lost = len(self._queue)
+            self._queue.clear()
+            self._dropped += lost
+            self._condition.notify_all()
+            return merge_drain_results(result, {"flushed": self._sent + self._errors - completed, "lost": lost,
+                                                "in_flight": self._in_progress})
+
+    def close(self, timeout=None):
+        """
+        Drains the sink (see :func:`drain`), abandons retries that are still pending and closes the
+        connections.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: The drain result (see :func:`drain`)
+        """
+        deadline = get_deadline(timeout)
+        result = self.drain(timeout)
+        self._closed.set()
+        for worker in self._workers:
+            worker.join(get_remaining(deadline))
+        return result
+
+    def get_stats(self):
+        """
+        Returns the delivery statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``received``: The number of events received
+            * ``sent``: The number of events delivered
+            * ``batches``: The number of batches delivered
+            * ``retries``: The number of delivery attempts that were retried
+            * ``queued``: The number of events waiting to be delivered
+            * ``dropped``: The number of events dropped because the queue was full, or discarded or rejected
+              by :func:`drain`
+            * ``errors``: The number of events that could not be encoded or delivered
+            * ``latency``: The moving average latency (in seconds) of successful deliveries
+
+        :return: A ``dict`` (dictionary) containing the delivery statistics
+        """
+        with self._condition:
+            return {
+                "received": self._received,
+                "sent": self._sent,
+                "batches": self._batches,
+                "retries": self._retries,
+                "queued": len(self._queue) + self._in_progress,
+                "dropped": self._dropped,
+                "errors": self._errors,
+                "latency": self._latency
+            }
+
+
+class HttpSink(BatchingSink):
+    """
+    A sink that posts batches of threat events to an HTTP(S) endpoint as newline-delimited JSON
+    (``application/x-ndjson``) over persistent (keep-alive) connections.
+
+    Responses with a ``2xx`` status are successful. ``429`` and ``5xx`` responses and connection errors are
+    retried, other responses are treated as permanent failures.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            sink = HttpSink("https://siem.example.com/ingest",
+                            headers={"Authorization": "Bearer " + token},
+                            batch_size=500, connection_count=4)
+            threat_event_client.add_epo_threat_event_response_callback(sink)
+    """
+
+    def __init__(self, url, headers=None, timeout=10.0, ssl_context=None, **kwargs):
+        """
+        Constructor parameters:
+
+        :param url: The URL to post events to
+        :param headers: A ``dict`` (dictionary) of additional request headers
+        :param timeout: The connection and response timeout (in seconds)
+        :param ssl_context: The :class:`ssl.SSLContext` used for ``https`` URLs (the default context if not
+            specified)
+        :param kwargs: The batching parameters (see :class:`BatchingSink`)
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError("Unsupported URL scheme: {0}".format(parsed.scheme))
+        self._url = url
+        self._https = parsed.scheme == "https"
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+        self._timeout = timeout
+        self._ssl_context = ssl_context or (ssl.create_default_context() if self._https else None)
+        self._headers = {"Content-Type": "application/x-ndjson", "Connection": "keep-alive"}
+        self._headers.update(headers or {})
+        super(HttpSink, self).__init__(**kwargs)
+
+    @property
+    def url(self):
+        """
+        The URL events are posted to
+        """
+        return self._url
+
+    def _create_connection(self):
+        if self._https:
+            return HTTPSConnection(self._host, self._port, timeout=self._timeout, context=self._ssl_context)
+        return HTTPConnection(self._host, self._port, timeout=self._timeout)
+
+    def _close_connection(self, connection):
+        connection.close()
+
+    def _send_batch(self, connection, payloads):
+        connection.request("POST", self._path, b"\n".join(payloads) + b"\n", self._headers)
+        response = connection.getresponse()
+        # The response must be read in full before the connection can be reused
+        response.read()
+        if not 200 <= response.status < 300:
+            raise SinkError("HTTP {0} {1}".format(response.status, response.reason),
+                            retryable=response.status == 429 or response.status >= 500)
+
+
+class SyslogSink(BatchingSink):
+    """
+    A sink that sends threat events as RFC 5424 syslog messages, with the JSON threat event as the message
+    body. The syslog severity of each message is derived from the threat event severity.
+
+    Over TCP, each worker thread holds a persistent connection, messages are framed with octet counting
+    (RFC 6587) and each batch is written with a single send. Over UDP, each message is sent as a datagram.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            sink = SyslogSink("siem.example.com", 6514, protocol="tcp", app_name="epo-threats")
+            threat_event_client.add_epo_threat_event_response_callback(sink)
+    """
+
+    # The "local0" facility
+    DEFAULT_FACILITY = 16
+
+    def __init__(self, host, port=514, protocol="tcp", facility=DEFAULT_FACILITY, app_name="dxlthreatevent",
+                 timeout=10.0, **kwargs):
+        """
+        Constructor parameters:
+
+        :param host: The syslog server host
+        :param port: The syslog server port
+        :param protocol: The transport protocol (``tcp`` or ``udp``)
+        :param facility: The syslog facility code
+        :param app_name: The syslog application name
+        :param timeout: The connection and send timeout (in seconds)
+        :param kwargs: The batching parameters (see :class:`BatchingSink`)
+        """
+        if protocol not in ("tcp", "udp"):
+            raise ValueError("Unsupported protocol: {0}".format(protocol))
+        self._address = (host, port)
+        self._protocol = protocol
+        self._facility = facility
+        self._header_suffix = " {0} {1} - threatEvent - ".format(socket.gethostname() or "-", app_name)
+        self._timeout = timeout
+        super(SyslogSink, self).__init__(**kwargs)
+
+    def _encode(self, threat_event_dict):
+        now = time.time()
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + ".{0:06d}Z".format(
+            int((now % 1) * 1000000))
+        priority = self._facility * 8 + min(get_severity(threat_event_dict), 7)
+        message = "<{0}>1 {1}{2}".format(priority, timestamp, self._header_suffix).encode("utf-8") + \
+            super(SyslogSink, self)._encode(threat_event_dict)
+        if self._protocol == "tcp":
+            message = "{0} ".format(len(message)).encode("utf-8") + message
+        return message
+
+    def _create_connection(self):
+        if self._protocol == "tcp":
+            return socket.create_connection(self._address, self._timeout)
+        connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        connection.settimeout(self._timeout)
+        connection.connect(self._address)
+        return connection
+
+    def _close_connection(self, connection):
+        connection.close()
+
+    def _send_batch(self, connection, payloads):
+        if self._protocol == "tcp":
+            connection.sendall(b"".join(payloads))
+        else:
+            for payload in payloads:
+                connection.send(payload)
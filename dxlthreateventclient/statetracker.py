@@ -0,0 +1,385 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .callbacks import CommonThreatEventCallback
+from .codec import ThreatEventCodec
+from .constants import ThreatEventProps, EventProps, AnalyzerProps, EntityProps
+from .memory import estimate_items_size
+from ._util import get_field, get_severity
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+_ENTITY_ID_PATH = (ThreatEventProps.EVENT, EventProps.ENTITY, EntityProps.ID)
+_HOST_NAME_PATH = (ThreatEventProps.EVENT, EventProps.ANALYZER, AnalyzerProps.HOST_NAME)
+_THREAT_NAME_PATH = (ThreatEventProps.EVENT, EventProps.THREAT_NAME)
+_THREAT_ACTION_TAKEN_PATH = (ThreatEventProps.EVENT, EventProps.THREAT_ACTION_TAKEN)
+_THREAT_HANDLED_PATH = (ThreatEventProps.EVENT, EventProps.THREAT_HANDLED)
+
+
+class HostState(object):
+    """
+    The current threat state of a host (entity), as maintained by :class:`HostStateTracker`.
+
+    The following attributes are available:
+
+        * ``entity_id``: The entity identifier (:const:`dxlthreateventclient.constants.EntityProps.ID`)
+        * ``host_name``: The host name (:const:`dxlthreateventclient.constants.AnalyzerProps.HOST_NAME`)
+        * ``latest_severity``: The severity of the most recent threat event
+        * ``latest_threat_name``: The threat name of the most recent threat event
+        * ``last_threat_action_taken``: The most recent action taken
+          (:const:`dxlthreateventclient.constants.EventProps.THREAT_ACTION_TAKEN`)
+        * ``last_updated``: The time the most recent threat event was received
+        * ``event_count``: The number of threat events received for the host
+        * ``open_threats``: A ``dict`` mapping the name of each unhandled threat (``threatHandled`` is ``0``)
+          to a ``dict`` containing its ``severity``, ``count``, ``first_seen`` and ``last_seen`` time
+    """
+
+    __slots__ = ("entity_id", "host_name", "latest_severity", "latest_threat_name", "last_threat_action_taken",
+                 "last_updated", "event_count", "open_threats")
+
+    def __init__(self, entity_id=None, host_name=None):
+        self.entity_id = entity_id
+        self.host_name = host_name
+        self.latest_severity = None
+        self.latest_threat_name = None
+        self.last_threat_action_taken = None
+        self.last_updated = 0
+        self.event_count = 0
+        self.open_threats = {}
+
+    def copy(self):
+        """
+        Returns a copy of the host state.
+
+        :return: The copy of the :class:`HostState`
+        """
+        return HostState.from_dict(self.to_dict())
+
+    def to_dict(self):
+        """
+        Returns a ``dict`` (dictionary) representation of the host state.
+
+        :return: The ``dict`` (dictionary) representation
+        """
+        result = dict((name, getattr(self, name)) for name in self.__slots__)
+        result["open_threats"] = dict((name, dict(threat)) for name, threat in self.open_threats.items())
+        return result
+
+    @staticmethod
+    def from_dict(state_dict):
+        """
+        Creates a host state from its ``dict`` (dictionary) representation.
+
+        :param state_dict: The ``dict`` (dictionary) representation (see :func:`to_dict`)
+        :return: The :class:`HostState`
+        """
+        state = HostState()
+        for name in HostState.__slots__:
+            if name in state_dict:
+                setattr(state, name, state_dict[name])
+        state.open_threats = dict((name, dict(threat)) for name, threat in (state.open_threats or {}).items())
+        return state
+
+    def __repr__(self):
+        return "HostState(entity_id={0!r}, host_name={1!r}, latest_severity={2!r}, open_threats={3})".format(
+            self.entity_id, self.host_name, self.latest_severity, len(self.open_threats))
+
+
+class HostStateTracker(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that incrementally maintains the
+    current threat state of each host, allowing constant-time lookups of the latest state by entity
+    identifier (:const:`dxlthreateventclient.constants.EntityProps.ID`) or host name
+    (:const:`dxlthreateventclient.constants.AnalyzerProps.HOST_NAME`).
+
+    Memory is bounded: once ``max_hosts`` hosts are tracked the least recently updated host is evicted, and
+    hosts that have not been updated for ``ttl`` seconds are expired.
+
+    The state table can be saved to disk with :func:`snapshot` and loaded with :func:`restore` to allow
+    fast restarts. Snapshots are written in the compact binary format of
+    :class:`dxlthreateventclient.codec.ThreatEventCodec`.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            tracker = HostStateTracker(max_hosts=100000, ttl=7 * 24 * 3600)
+            if os.path.exists("hosts.snapshot"):
+                tracker.restore("hosts.snapshot")
+            threat_event_client.add_epo_threat_event_response_callback(tracker)
+
+            state = tracker.get_host_state(host_name="SAMPLE-HOSTNAME")
+            if state:
+                print(state.latest_severity, state.last_threat_action_taken, len(state.open_threats))
+    """
+
+    # The version of the snapshot format (version 2 uses version 2 of the codec key encoding)
+    SNAPSHOT_VERSION = 2
+
+    def __init__(self, max_hosts=100000, ttl=None, max_open_threats=100, clock=time.time):
+        """
+        Constructor parameters:
+
+        :param max_hosts: The maximum number of hosts to track
+        :param ttl: The amount of time (in seconds) after which hosts that have not been updated are
+            expired (``None`` to never expire hosts)
+        :param max_open_threats: The maximum number of open (unhandled) threats to track per host
+        :param clock: The callable used to obtain the current time
+        """
+        super(HostStateTracker, self).__init__()
+        self._max_hosts = max_hosts
+        self._ttl = ttl
+        self._max_open_threats = max_open_threats
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> HostState, ordered from least to most recently updated
+        self._states = OrderedDict()
+        # host name -> key
+        self._host_names = {}
+        self._evicted = 0
+        self._expired = 0
+
+    @staticmethod
+    def _key(entity_id, host_name):
+        # Hosts are keyed by entity identifier, falling back to the host name when it is not available
+        return ("id", entity_id) if entity_id is not None else ("host", host_name)
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Updates the state of the host that the threat event pertains to.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        entity_id = get_field(threat_event_dict, _ENTITY_ID_PATH)
+        host_name = get_field(threat_event_dict, _HOST_NAME_PATH)
+        if entity_id is None and host_name is None:
+            return
+
+        severity = get_severity(threat_event_dict)
+        threat_name = get_field(threat_event_dict, _THREAT_NAME_PATH)
+        action_taken = get_field(threat_event_dict, _THREAT_ACTION_TAKEN_PATH)
+        handled = get_field(threat_event_dict, _THREAT_HANDLED_PATH)
+
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            key = self._key(entity_id, host_name)
+            state = self._states.pop(key, None)
+            if state is None and entity_id is not None and host_name is not None:
+                # Adopt the state of a host that was previously only known by its host name
+                state = self._states.pop(self._key(None, host_name), None)
+            if state is None:
+                state = HostState(entity_id, host_name)
+            self._states[key] = state
+
+            if host_name is not None:
+                if state.host_name is not None and state.host_name != host_name and \
+                        self._host_names.get(state.host_name) == key:
+                    # The previous host name may since have been reported by another host
+                    del self._host_names[state.host_name]
+                state.host_name = host_name
+                self._host_names[host_name] = key
+            if entity_id is not None:
+                state.entity_id = entity_id
+
+            state.latest_severity = severity
+            state.latest_threat_name = threat_name
+            if action_taken is not None:
+                state.last_threat_action_taken = action_taken
+            state.last_updated = now
+            state.event_count += 1
+
+            if threat_name is not None and handled is not None:
+                self._update_open_threats(state, threat_name, severity, handled, now)
+
+            while len(self._states) > self._max_hosts:
+                self._remove_oldest()
+                self._evicted += 1
+
+    def _update_open_threats(self, state, threat_name, severity, handled, now):
+        """
+        Records an unhandled threat as open, or closes it once a handled event for the threat is received.
+        """
+        try:
+            handled = int(handled)
+        except (TypeError, ValueError):
+            return
+        open_threats = state.open_threats
+        if handled:
+            open_threats.pop(threat_name, None)
+            return
+        threat = open_threats.get(threat_name)
+        if threat is None:
+            if len(open_threats) >= self._max_open_threats:
+                # Make room by dropping the threat that was seen least recently
+                oldest = min(open_threats, key=lambda name: open_threats[name]["last_seen"])
+                del open_threats[oldest]
+            open_threats[threat_name] = {"severity": severity, "count": 1, "first_seen": now, "last_seen": now}
+        else:
+            threat["severity"] = min(threat["severity"], severity)
+            threat["count"] += 1
+            threat["last_seen"] = now
+
+    def _remove_oldest(self):
+        """
+        Removes the least recently updated host.
+
+        NOTE: Must be invoked while holding the lock.
+        """
+        key, state = self._states.popitem(last=False)
+        if state.host_name is not None and self._host_names.get(state.host_name) == key:
+            del self._host_names[state.host_name]
+
+    def _expire(self, now):
+        """
+        Removes hosts that have not been updated within the TTL.
+
+        NOTE: Must be invoked while holding the lock.
+        """
+        if self._ttl is None:
+            return
+        while self._states:
+            state = next(iter(self._states.values()))
+            if now - state.last_updated <= self._ttl:
+                break
+            self._remove_oldest()
+            self._expired += 1
+
+    def expire(self):
+        """
+        Removes hosts that have not been updated within the TTL.
+        """
+        with self._lock:
+            self._expire(self._clock())
+
+    def get_host_state(self, entity_id=None, host_name=None):
+        """
+        Returns the current state of a host, looked up by entity identifier or host name.
+
+        :param entity_id: The entity identifier (:const:`dxlthreateventclient.constants.EntityProps.ID`)
+        :param host_name: The host name (:const:`dxlthreateventclient.constants.AnalyzerProps.HOST_NAME`)
+        :return: A copy of the :class:`HostState`, or ``None`` if the host is not tracked
+        """
+        with self._lock:
+            state = None
+            if entity_id is not None:
+                state = self._states.get(self._key(entity_id, None))
+            if state is None and host_name is not None:
+                key = self._host_names.get(host_name)
+                state = self._states.get(key) if key else None
+            if state is None:
+                return None
+            if self._ttl is not None and self._clock() - state.last_updated > self._ttl:
+                return None
+            return state.copy()
+
+    def get_host_count(self):
+        """
+        Returns the number of tracked hosts.
+
+        :return: The number of tracked hosts
+        """
+        with self._lock:
+            return len(self._states)
+
+    def get_stats(self):
+        """
+        Returns the state tracker statistics.
+
+        The returned ``dict`` (dictionary) contains the number of tracked ``hosts``, and the number of hosts
+        ``evicted`` due to the ``max_hosts`` limit and ``expired`` due to the TTL.
+
+        :return: A ``dict`` (dictionary) containing the state tracker statistics
+        """
+        with self._lock:
+            return {"hosts": len(self._states), "evicted": self._evicted, "expired": self._expired}
+
+    def estimate_memory(self):
+        """
+        Returns the estimated number of bytes held by the tracked host states (see
+        :mod:`dxlthreateventclient.memory`).
+
+        :return: The estimated size (in bytes)
+        """
+        with self._lock:
+            return sys.getsizeof(self._states) + sys.getsizeof(self._host_names) + \
+                estimate_items_size(self._states.values(), len(self._states))
+
+    def evict_memory(self, nbytes):
+        """
+        Evicts the least recently updated hosts to release approximately the specified number of bytes (see
+        :mod:`dxlthreateventclient.memory`).
+
+        :param nbytes: The number of bytes to release
+        :return: The estimated number of bytes released
+        """
+        with self._lock:
+            count = len(self._states)
+            if not count:
+                return 0
+            host_size = max(1, estimate_items_size(self._states.values(), count) // count)
+            evict_count = min(count, -(-nbytes // host_size))
+            for _ in range(evict_count):
+                self._remove_oldest()
+            self._evicted += evict_count
+            return evict_count * host_size
+
+    def snapshot(self, path):
+        """
+        Atomically writes the state table to the specified file.
+
+        :param path: The path of the snapshot file
+        :return: The number of hosts written
+        """
+        with self._lock:
+            states = [state.to_dict() for state in self._states.values()]
+        codec = ThreatEventCodec()
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(codec.encode({"version": self.SNAPSHOT_VERSION, "count": len(states)}))
+            for state in states:
+                f.write(codec.encode(state))
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+        return len(states)
+
+    def restore(self, path):
+        """
+        Loads the state table from a file written by :func:`snapshot`, replacing the current state.
+        Hosts that have expired according to the TTL are skipped, and the least recently updated hosts
+        beyond ``max_hosts`` are evicted (and counted as such).
+
+        :param path: The path of the snapshot file
+        :return: The number of hosts restored
+        """
+        with open(path, "rb") as f:
+            records = ThreatEventCodec().decode_stream(f)
+            header = next(records, None)
+            if not header or header.get("version") != self.SNAPSHOT_VERSION:
+                raise ValueError("Unsupported host state snapshot: " + path)
+            states = [HostState.from_dict(record) for record in records]
+
+        with self._lock:
+            now = self._clock()
+            self._states.clear()
+            self._host_names.clear()
+            for state in sorted(states, key=lambda s: s.last_updated):
+                if self._ttl is not None and now - state.last_updated > self._ttl:
+                    continue
+                key = self._key(state.entity_id, state.host_name)
+                self._states[key] = state
+                if state.host_name is not None:
+                    self._host_names[state.host_name] = key
+            while len(self._states) > self._max_hosts:
+                self._remove_oldest()
+                self._evicted += 1
+            return len(self._states)
@@ -0,0 +1,473 @@
+"""
+Streaming decoding of threat event payloads.
+
+Aggregated ePO threat events can carry very large ``otherData`` ``listOf*`` strings and long ``files``
+arrays. Decoding such payloads in full with ``json.loads`` materializes every value at once. The
+:class:`StreamingThreatEventDecoder` instead walks the payload value by value, so that:
+
+    * Oversized strings are truncated and long arrays are cut short without materializing the remainder
+    * Configured fields are skipped entirely (their values are scanned over, not decoded)
+    * Required fields are handed to a callback as soon as they have been parsed, which may stop decoding of
+      events that are not wanted
+"""
+
+import json
+import logging
+import re
+import threading
+from json.decoder import scanstring
+
+from .callbacks import CommonThreatEventCallback
+from ._util import get_deadline, merge_drain_results, drain_component
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# The body of a string (up to, but not including, its closing quote)
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+# The tokens that are significant while skipping over an array or object (strings are matched whole so that
+# brackets within them are ignored)
+_STRUCTURE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', re.DOTALL)
+_SCALAR_END = re.compile(r"[^,\]}\s]*")
+_LITERALS = {"true": True, "false": False, "null": None}
+
+try:
+    _TEXT_TYPES = (str, unicode)  # pylint: disable=undefined-variable
+except NameError:
+    _TEXT_TYPES = (str,)
+
+# The maximum number of characters removed from a truncated string to avoid splitting an escape sequence
+_MAX_ESCAPE_LENGTH = 6
+
+# The maximum number of payload characters that encode a single decoded character (a surrogate pair of
+# "\uXXXX" escape sequences)
+_MAX_ENCODED_CHAR_LENGTH = 12
+
+
+class _StopDecoding(Exception):
+    """
+    Raised when the required fields callback rejects an event.
+    """
+
+
+class _Parse(object):
+    """
+    The state of a single streaming decode.
+    """
+
+    def __init__(self, decoder, text, on_required_fields):
+        self.decoder = decoder
+        self.text = text
+        self.on_required_fields = on_required_fields
+        self.pending = set(decoder.required_fields) if on_required_fields else None
+        self.root = None
+        self.truncated_strings = 0
+        self.truncated_arrays = 0
+        self.skipped_fields = 0
+
+    def _error(self, message, idx):
+        raise ValueError("{0}: char {1}".format(message, idx))
+
+    def _skip_whitespace(self, idx):
+        return _WHITESPACE.match(self.text, idx).end()
+
+    def parse(self):
+        idx = self._skip_whitespace(0)
+        if self.text[idx:idx + 1] != "{":
+            self._error("Expecting object", idx)
+        self.root = {}
+        idx = self._parse_object(idx, (), self.root)
+        if self.pending is not None and self.on_required_fields is not None:
+            # Not all of the required fields were present
+            self._required_fields_parsed()
+        if self._skip_whitespace(idx) != len(self.text):
+            self._error("Extra data", idx)
+        return self.root
+
+    def _required_fields_parsed(self):
+        callback, self.on_required_fields = self.on_required_fields, None
+        if callback(self.root) is False:
+            raise _StopDecoding()
+
+    def _completed(self, path):
+        pending = self.pending
+        if pending and path in pending:
+            pending.discard(path)
+            if not pending:
+                self._required_fields_parsed()
+
+    def _parse_value(self, idx):
+        """
+        Parses a value. Objects and arrays are returned empty with the index of their opening character, so
+        that the caller can attach them to their parent before filling them.
+        """
+        text = self.text
+        char = text[idx:idx + 1]
+        if char == '"':
+            return self._parse_string(idx)
+        if char == "{":
+            return {}, idx
+        if char == "[":
+            return [], idx
+        match = _NUMBER.match(text, idx)
+        if match and match.end() > idx:
+            number = match.group()
+            if match.group(1) or match.group(2):
+                return float(number), match.end()
+            return int(number), match.end()
+        for literal, value in _LITERALS.items():
+            if text.startswith(literal, idx):
+                return value, idx + len(literal)
+        return self._error("Expecting value", idx)
+
+    def _parse_string(self, idx):
+        text = self.text
+        end = _STRING_BODY.match(text, idx + 1).end()
+        if text[end:end + 1] != '"':
+            self._error("Unterminated string", idx)
+        max_length = self.decoder.max_string_length
+        if max_length is None or end - idx - 1 <= max_length:
+            # The decoded string is no longer than its encoding
+            return scanstring(text, idx + 1)
+        # Strings are truncated by their decoded length (as when decoding with json.loads). Only a prefix that
+        # is long enough to hold max_length decoded characters is decoded, backing off if the prefix ends within
+        # an escape sequence.
+        prefix_length = (max_length + 1) * _MAX_ENCODED_CHAR_LENGTH
+        if end - idx - 1 <= prefix_length:
+            value = scanstring(text, idx + 1)[0]
+        else:
+            prefix = text[idx + 1:idx + 1 + prefix_length]
+            for cut in range(_MAX_ESCAPE_LENGTH):
+                try:
+                    value = scanstring(prefix[:len(prefix) - cut] + '"', 0)[0]
+                    break
+                except ValueError:
+                    continue
+            else:
+                self._error("Invalid string", idx)
+        if len(value) > max_length:
+            value = value[:max_length]
+            self.truncated_strings += 1
+        return value, end + 1
+
+    def _fill(self, container, idx, path):
+        if isinstance(container, dict):
+            return self._parse_object(idx, path, container)
+        return self._parse_array(idx, path, container)
+
+    def _parse_object(self, idx, path, obj):
+        text = self.text
+        skip_fields = self.decoder.skip_fields
+        idx = self._skip_whitespace(idx + 1)
+        if text[idx:idx + 1] == "}":
+            return idx + 1
+        while True:
+            if text[idx:idx + 1] != '"':
+                self._error("Expecting property name enclosed in double quotes", idx)
+            key, idx = scanstring(text, idx + 1)
+            idx = self._skip_whitespace(idx)
+            if text[idx:idx + 1] != ":":
+                self._error("Expecting ':' delimiter", idx)
+            idx = self._skip_whitespace(idx + 1)
+            child_path = path + (key,)
+            if child_path in skip_fields:
+                idx = skip_value(text, idx)
+                self.skipped_fields += 1
+            else:
+                value, idx = self._parse_value(idx)
+                obj[key] = value
+                if isinstance(value, (dict, list)):
+                    idx = self._fill(value, idx, child_path)
+                self._completed(child_path)
+            idx = self._skip_whitespace(idx)
+            char = text[idx:idx + 1]
+            if char == "}":
+                return idx + 1
+            if char != ",":
+                self._error("Expecting ',' delimiter", idx)
+            idx = self._skip_whitespace(idx + 1)
+
+    def _parse_array(self, idx, path, array):
+        text = self.text
+        max_items = self.decoder.max_array_items
+        idx = self._skip_whitespace(idx + 1)
+        if text[idx:idx + 1] == "]":
+            return idx + 1
+        while True:
+            if max_items is not None and len(array) >= max_items:
+                # Scan over the remaining items without decoding them
+                self.truncated_arrays += 1
+                return _skip_to_close(text, idx, 1)
+            else:
+                # Array elements share the path of the array
+                value, idx = self._parse_value(idx)
+                array.append(value)
+                if isinstance(value, (dict, list)):
+                    idx = self._fill(value, idx, path)
+            idx = self._skip_whitespace(idx)
+            char = text[idx:idx + 1]
+            if char == "]":
+                return idx + 1
+            if char != ",":
+                self._error("Expecting ',' delimiter", idx)
+            idx = self._skip_whitespace(idx + 1)
+
+
+def skip_value(text, idx):
+    """
+    Scans over a JSON value without decoding it.
+
+    :param text: The JSON text
+    :param idx: The index of the first character of the value
+    :return: The index of the first character after the value
+    """
+    char = text[idx:idx + 1]
+    if char == '"':
+        return _STRING_BODY.match(text, idx + 1).end() + 1
+    if char not in ("{", "["):
+        return _SCALAR_END.match(text, idx).end()
+    return _skip_to_close(text, idx + 1, 1)
+
+
+def _skip_to_close(text, idx, depth):
+    """
+    Scans over the remainder of ``depth`` levels of nested arrays or objects.
+
+    :param text: The JSON text
+    :param idx: The index to start scanning from
+    :param depth: The number of arrays or objects that are open
+    :return: The index of the first character after the closing character of the outermost array or object
+    """
+    for match in _STRUCTURE.finditer(text, idx):
+        char = match.group()
+        if char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if not depth:
+                return match.end()
+    raise ValueError("Unterminated value: char {0}".format(idx))
+
+
+class StreamingThreatEventDecoder(object):
+    """
+    Decodes threat event payloads value by value, applying size limits and handing the required fields to a
+    callback early (see the module documentation).
+
+    Incremental decoding trades CPU time for memory: large payloads decode several times more slowly than
+    with ``json.loads``, but only the values within the limits are materialized. Payloads smaller than
+    ``streaming_threshold`` bytes are therefore decoded with ``json.loads`` and then have the limits applied.
+    Either way, strings are truncated to ``max_string_length`` decoded characters.
+
+    NOTE: The payload is decoded from UTF-8 to text in full before it is scanned (the scanner operates on
+    text), so the memory held while decoding is the payload plus one text copy of it (up to four times the
+    payload size for non-ASCII text), in addition to the values that are materialized.
+
+    Field paths (for ``skip_fields`` and ``required_fields``) are tuples of keys, such as
+    ``(ThreatEventProps.EVENT, EventProps.OTHER_DATA)``. Elements of an array share the path of the array.
+    """
+
+    def __init__(self, max_string_length=None, max_array_items=None, skip_fields=None, required_fields=None,
+                 streaming_threshold=64 * 1024):
+        """
+        Constructor parameters:
+
+        :param max_string_length: The maximum number of characters decoded per string (longer strings are
+            truncated, ``None`` for no limit)
+        :param max_array_items: The maximum number of items decoded per array (further items are discarded,
+            ``None`` for no limit)
+        :param skip_fields: The paths of fields that are not decoded (and are absent from decoded events)
+        :param required_fields: The paths of the fields that are passed to the required fields callback (see
+            :func:`decode`)
+        :param streaming_threshold: The payload size (in bytes) from which payloads are decoded incrementally
+        """
+        self.max_string_length = max_string_length
+        self.max_array_items = max_array_items
+        self.skip_fields = frozenset(tuple(path) for path in skip_fields or ())
+        self.required_fields = frozenset(tuple(path) for path in required_fields or ())
+        self.streaming_threshold = streaming_threshold
+        self._lock = threading.Lock()
+        self._decoded = 0
+        self._streamed = 0
+        self._stopped = 0
+        self._truncated_strings = 0
+        self._truncated_arrays = 0
+        self._skipped_fields = 0
+
+    def decode(self, payload, on_required_fields=None):
+        """
+        Decodes a threat event payload.
+
+        :param payload: The payload (``bytes`` or ``str``)
+        :param on_required_fields: An optional callable that is invoked with the partially decoded threat event
+            ``dict`` as soon as all of the ``required_fields`` have been decoded (or once decoding completes,
+            if some are not present). If it returns ``False``, decoding stops and ``None`` is returned.
+        :return: The threat event ``dict`` (dictionary), or ``None`` if decoding was stopped
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        if not self.required_fields:
+            on_required_fields = None
+        parse = _Parse(self, payload, on_required_fields)
+        streamed = len(payload) >= self.streaming_threshold
+        try:
+            if streamed:
+                threat_event_dict = parse.parse()
+            else:
+                threat_event_dict = self._apply_limits(json.loads(payload), (), parse)
+                if on_required_fields is not None and on_required_fields(threat_event_dict) is False:
+                    raise _StopDecoding()
+        except _StopDecoding:
+            threat_event_dict = None
+        with self._lock:
+            self._decoded += 1
+            self._streamed += 1 if streamed else 0
+            self._stopped += 1 if threat_event_dict is None else 0
+            self._truncated_strings += parse.truncated_strings
+            self._truncated_arrays += parse.truncated_arrays
+            self._skipped_fields += parse.skipped_fields
+        return threat_event_dict
+
+    def _apply_limits(self, value, path, parse):
+        """
+        Applies the limits to a value that was decoded in full.
+        """
+        if isinstance(value, dict):
+            for key in list(value):
+                child_path = path + (key,)
+                if child_path in self.skip_fields:
+                    del value[key]
+                    parse.skipped_fields += 1
+                else:
+                    value[key] = self._apply_limits(value[key], child_path, parse)
+        elif isinstance(value, list):
+            if self.max_array_items is not None and len(value) > self.max_array_items:
+                del value[self.max_array_items:]
+                parse.truncated_arrays += 1
+            for i, item in enumerate(value):
+                value[i] = self._apply_limits(item, path, parse)
+        elif isinstance(value, _TEXT_TYPES) and self.max_string_length is not None and \
+                len(value) > self.max_string_length:
+            value = value[:self.max_string_length]
+            parse.truncated_strings += 1
+        return value
+
+    def get_stats(self):
+        """
+        Returns the decoding statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``decoded``: The number of payloads decoded
+            * ``streamed``: The number of payloads decoded incrementally
+            * ``stopped``: The number of payloads whose decoding was stopped by the required fields callback
+            * ``truncated_strings``: The number of strings truncated
+            * ``truncated_arrays``: The number of arrays cut short
+            * ``skipped_fields``: The number of fields skipped
+
+        :return: A ``dict`` (dictionary) containing the decoding statistics
+        """
+        with self._lock:
+            return {
+                "decoded": self._decoded,
+                "streamed": self._streamed,
+                "stopped": self._stopped,
+                "truncated_strings": self._truncated_strings,
+                "truncated_arrays": self._truncated_arrays,
+                "skipped_fields": self._skipped_fields
+            }
+
+
+class StreamingDecodeCallback(CommonThreatEventCallback):
+    """
+    A :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that decodes received threat events
+    with a :class:`StreamingThreatEventDecoder` and passes them to another threat event callback.
+
+    When the decoder has ``required_fields``, :func:`on_required_fields` is invoked with the partially decoded
+    event as soon as they are available. Returning ``False`` from it discards the event without decoding the
+    rest of the payload.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            decoder = StreamingThreatEventDecoder(
+                max_string_length=16 * 1024, max_array_items=100,
+                skip_fields=[(ThreatEventProps.EVENT, EventProps.OTHER_DATA, "listOfHashes")],
+                required_fields=[(ThreatEventProps.EVENT, EventProps.THREAT_SEVERITY)])
+
+            def wanted(partial_threat_event_dict, event):
+                return partial_threat_event_dict["event"]["threatSeverity"] <= 3
+
+            callback = StreamingDecodeCallback(my_callback, decoder, required_fields_callback=wanted)
+            threat_event_client.add_epo_threat_event_response_callback(callback)
+    """
+
+    def __init__(self, threat_event_callback, decoder=None, required_fields_callback=None):
+        """
+        Constructor parameters:
+
+        :param threat_event_callback: The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback`
+            to pass decoded threat events to
+        :param decoder: The :class:`StreamingThreatEventDecoder` (a decoder without limits if not specified)
+        :param required_fields_callback: An optional callable invoked by the default implementation of
+            :func:`on_required_fields`
+        """
+        super(StreamingDecodeCallback, self).__init__()
+        self._threat_event_callback = threat_event_callback
+        self._decoder = decoder or StreamingThreatEventDecoder()
+        self._required_fields_callback = required_fields_callback
+
+    @property
+    def threat_event_callback(self):
+        """
+        The :class:`dxlthreateventclient.callbacks.CommonThreatEventCallback` that decoded events are passed to
+        """
+        return self._threat_event_callback
+
+    @property
+    def decoder(self):
+        """
+        The :class:`StreamingThreatEventDecoder` used to decode events
+        """
+        return self._decoder
+
+    def _decode_threat_event(self, event):
+        return self._decoder.decode(
+            event.payload, lambda threat_event_dict: self.on_required_fields(threat_event_dict, event))
+
+    def on_required_fields(self, threat_event_dict, original_event):
+        """
+        Invoked with the partially decoded threat event once its required fields have been decoded. By default,
+        this invokes the ``required_fields_callback`` that was specified when the callback was constructed.
+
+        :param threat_event_dict: The partially decoded threat event ``dict`` (dictionary)
+        :param original_event: The original DXL event message that was received
+        :return: ``False`` to discard the event without decoding the rest of the payload
+        """
+        if self._required_fields_callback is not None:
+            return self._required_fields_callback(threat_event_dict, original_event)
+        return True
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        """
+        Passes the decoded threat event to the threat event callback.
+
+        :param threat_event_dict: A Python ``dict`` (dictionary) containing the details of the threat event
+        :param original_event: The original DXL event message that was received
+        """
+        self._threat_event_callback.on_threat_event(threat_event_dict, original_event)
+
+    def drain(self, timeout=None):
+        """
+        Waits for in-flight events and then drains the threat event callback.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: The combined drain result (see
+            :func:`dxlthreateventclient.callbacks.CommonThreatEventCallback.drain`)
+        """
+        deadline = get_deadline(timeout)
+        result = super(StreamingDecodeCallback, self).drain(timeout)
+        return merge_drain_results(result, drain_component(self._threat_event_callback, deadline))
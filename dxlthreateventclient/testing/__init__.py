@@ -0,0 +1,5 @@
+from __future__ import absolute_import
+
+from .fabric import InMemoryFabric, FakeDxlClient, LoadGenerator, \
+    constant_profile, square_wave_profile, ramp_profile, create_sample_threat_event
+from .mockserver import MockHttpServer, MockSyslogServer
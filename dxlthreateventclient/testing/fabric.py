@@ -0,0 +1,519 @@
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from dxlclient import UuidGenerator
+from dxlclient.message import Event
+
+from ..constants import EventProps, AnalyzerProps, EntityProps, SourceProps
+from ..publisher import create_threat_event
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class InMemoryFabric(object):
+    """
+    An in-process stand-in for a DXL fabric, used to exercise threat event callbacks without a broker.
+
+    Like the DXL client, events are placed on a bounded incoming queue and delivered to the registered
+    event callbacks by a pool of worker threads (``thread_pool_size``). An optional ``latency`` delays
+    delivery of each event, simulating the time taken to traverse the fabric.
+
+    Clients connect to the fabric through :class:`FakeDxlClient` instances.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            fabric = InMemoryFabric(thread_pool_size=4, latency=(0.001, 0.005))
+            with FakeDxlClient(fabric) as client:
+                threat_event_client = CommonThreatEventClient(client)
+                threat_event_client.add_epo_threat_event_response_callback(my_callback)
+
+                generator = LoadGenerator(fabric, EPO_THREAT_EVENT_RESPONSE_TOPIC,
+                                          square_wave_profile(1000, 20000, period=5.0, duty=0.2))
+                print(generator.run(duration=30))
+                fabric.wait_until_idle()
+                print(fabric.get_stats())
+    """
+
+    def __init__(self, thread_pool_size=1, queue_size=1000, latency=0.0, block_when_full=True):
+        """
+        Constructor parameters:
+
+        :param thread_pool_size: The number of threads used to deliver events to callbacks
+        :param queue_size: The maximum number of events waiting to be delivered
+        :param latency: The delivery latency (in seconds). This can be a fixed value, a ``(min, max)``
+            tuple for a uniformly distributed latency, or a callable returning the latency.
+        :param block_when_full: Whether publishing blocks while the incoming queue is full. If ``False``,
+            events published while the queue is full are dropped (and counted in :func:`get_stats`).
+        """
+        self._queue_size = queue_size
+        self._latency = latency
+        self._block_when_full = block_when_full
+        self._callbacks = {}
+        self._callbacks_lock = threading.Lock()
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._in_progress = 0
+
+        self._published = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._latencies = deque(maxlen=100000)
+
+        self._workers = []
+        for i in range(thread_pool_size):
+            worker = threading.Thread(target=self._worker_loop, name="InMemoryFabric-{0}".format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add_event_callback(self, topic, event_callback):
+        """
+        Registers an event callback for the specified topic.
+
+        :param topic: The topic
+        :param event_callback: The event callback (an object with an ``on_event`` method)
+        """
+        with self._callbacks_lock:
+            callbacks = list(self._callbacks.get(topic, ()))
+            if event_callback not in callbacks:
+                callbacks.append(event_callback)
+            # Callback lists are replaced rather than modified so delivery does not require the lock
+            self._callbacks[topic] = tuple(callbacks)
+
+    def remove_event_callback(self, topic, event_callback):
+        """
+        Unregisters an event callback from the specified topic.
+
+        :param topic: The topic
+        :param event_callback: The event callback
+        """
+        with self._callbacks_lock:
+            callbacks = [callback for callback in self._callbacks.get(topic, ())
+                         if callback is not event_callback]
+            if callbacks:
+                self._callbacks[topic] = tuple(callbacks)
+            else:
+                self._callbacks.pop(topic, None)
+
+    def _next_latency(self):
+        latency = self._latency
+        if callable(latency):
+            return latency()
+        if isinstance(latency, tuple):
+            return random.uniform(latency[0], latency[1])
+        return latency
+
+    def publish(self, topic, payload):
+        """
+        Publishes an event to the fabric.
+
+        :param topic: The topic to publish the event to
+        :param payload: The event payload (``bytes``, ``str`` or a ``dict`` which is encoded as JSON)
+        :return: ``True`` if the event was queued for delivery, ``False`` if it was dropped
+        """
+        if isinstance(payload, dict):
+            payload = json.dumps(payload)
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8")
+
+        now = time.time()
+        with self._condition:
+            self._published += 1
+            while self._running and self._block_when_full and len(self._queue) >= self._queue_size:
+                self._condition.wait()
+            if not self._running or len(self._queue) >= self._queue_size:
+                self._dropped += 1
+                return False
+            self._queue.append((now, now + self._next_latency(), topic, payload))
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._condition.notify_all()
+        return True
+
+    def send_event(self, event):
+        """
+        Publishes a DXL :class:`dxlclient.message.Event` message to the fabric.
+
+        :param event: The :class:`dxlclient.message.Event` to send
+        :return: ``True`` if the event was queued for delivery, ``False`` if it was dropped
+        """
+        return self.publish(event.destination_topic, event.payload)
+
+    def _worker_loop(self):
+        """
+        Delivers queued events to the registered callbacks until the fabric is closed.
+        """
+        while True:
+            with self._condition:
+                while self._running and not self._queue:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                published, due, topic, payload = self._queue.popleft()
+                self._in_progress += 1
+                self._condition.notify_all()
+
+            errors = 0
+            try:
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                for callback in self._callbacks.get(topic, ()):
+                    # A new message is created for each callback, as it would be by the DXL client
+                    event = Event(topic)
+                    event.payload = payload
+                    try:
+                        callback.on_event(event)
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception("Error invoking event callback")
+                        errors += 1
+            finally:
+                with self._condition:
+                    self._in_progress -= 1
+                    self._delivered += 1
+                    self._errors += errors
+                    self._latencies.append(time.time() - published)
+                    self._condition.notify_all()
+
+    def wait_until_idle(self, timeout=None):
+        """
+        Waits until all published events have been delivered.
+
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: ``True`` if all events were delivered, ``False`` otherwise
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._queue or self._in_progress:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Delivers the queued events and stops the worker threads.
+
+        :param timeout: The maximum amount of time (in seconds) to wait for queued events to be delivered
+        :return: ``True`` if all queued events were delivered, ``False`` otherwise
+        """
+        idle = self.wait_until_idle(timeout)
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        return idle
+
+    def get_stats(self):
+        """
+        Returns the fabric statistics.
+
+        The returned ``dict`` (dictionary) contains the following keys:
+
+            * ``published``: The number of events published
+            * ``delivered``: The number of events delivered to the registered callbacks
+            * ``dropped``: The number of events dropped because the incoming queue was full
+            * ``errors``: The number of callback invocations that raised an exception
+            * ``queued``: The number of events waiting to be delivered
+            * ``max_queue_depth``: The maximum number of events that were waiting to be delivered
+            * ``latency_p50``, ``latency_p99``, ``latency_max``: The time (in seconds) from publishing an
+              event to the completion of its callbacks, over the most recent deliveries
+
+        :return: A ``dict`` (dictionary) containing the fabric statistics
+        """
+        with self._condition:
+            latencies = sorted(self._latencies)
+            stats = {
+                "published": self._published,
+                "delivered": self._delivered,
+                "dropped": self._dropped,
+                "errors": self._errors,
+                "queued": len(self._queue) + self._in_progress,
+                "max_queue_depth": self._max_queue_depth
+            }
+        stats["latency_p50"] = latencies[len(latencies) // 2] if latencies else 0.0
+        stats["latency_p99"] = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+        stats["latency_max"] = latencies[-1] if latencies else 0.0
+        return stats
+
+
+class FakeDxlClient(object):
+    """
+    A stand-in for :class:`dxlclient.client.DxlClient` that communicates through an
+    :class:`InMemoryFabric`. It supports the event-related subset of the DXL client API and can be
+    passed to :class:`dxlthreateventclient.client.CommonThreatEventClient`.
+    """
+
+    def __init__(self, fabric):
+        """
+        Constructor parameters:
+
+        :param fabric: The :class:`InMemoryFabric` to communicate through
+        """
+        self._fabric = fabric
+        self._connected = False
+        self._subscriptions = set()
+        self._callbacks = []
+        self._unique_id = UuidGenerator.generate_id_as_string()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.destroy()
+
+    @property
+    def fabric(self):
+        """
+        The :class:`InMemoryFabric` the client communicates through
+        """
+        return self._fabric
+
+    @property
+    def connected(self):
+        """
+        Whether the client is connected to the fabric
+        """
+        return self._connected
+
+    @property
+    def subscriptions(self):
+        """
+        The set of topics the client is subscribed to
+        """
+        return set(self._subscriptions)
+
+    def connect(self):
+        """
+        Connects the client to the fabric.
+        """
+        self._connected = True
+
+    def disconnect(self):
+        """
+        Disconnects the client from the fabric.
+        """
+        self._connected = False
+
+    def destroy(self):
+        """
+        Unregisters all callbacks and disconnects the client from the fabric.
+        """
+        for topic, event_callback in list(self._callbacks):
+            self.remove_event_callback(topic, event_callback)
+        self.disconnect()
+
+    def subscribe(self, topic):
+        """
+        Subscribes the client to the specified topic.
+
+        :param topic: The topic
+        """
+        self._subscriptions.add(topic)
+
+    def unsubscribe(self, topic):
+        """
+        Unsubscribes the client from the specified topic.
+
+        :param topic: The topic
+        """
+        self._subscriptions.discard(topic)
+
+    def add_event_callback(self, topic, event_callback, subscribe_to_topic=True):
+        """
+        Registers an event callback for the specified topic.
+
+        :param topic: The topic
+        :param event_callback: The event callback
+        :param subscribe_to_topic: Whether to subscribe to the topic
+        """
+        self._callbacks.append((topic, event_callback))
+        self._fabric.add_event_callback(topic, event_callback)
+        if subscribe_to_topic:
+            self.subscribe(topic)
+
+    def remove_event_callback(self, topic, event_callback, unsubscribe_from_topic=True):
+        """
+        Unregisters an event callback from the specified topic.
+
+        :param topic: The topic
+        :param event_callback: The event callback
+        :param unsubscribe_from_topic: Whether to unsubscribe from the topic
+        """
+        if (topic, event_callback) in self._callbacks:
+            self._callbacks.remove((topic, event_callback))
+        self._fabric.remove_event_callback(topic, event_callback)
+        if unsubscribe_from_topic:
+            self.unsubscribe(topic)
+
+    def send_event(self, event):
+        """
+        Sends a DXL :class:`dxlclient.message.Event` message to the fabric.
+
+        :param event: The :class:`dxlclient.message.Event` to send
+        """
+        if event is None or not isinstance(event, Event):
+            raise ValueError("Invalid or unspecified event object")
+        self._fabric.send_event(event)
+
+
+def constant_profile(rate):
+    """
+    Returns a load profile that injects events at a constant rate.
+
+    :param rate: The number of events per second
+    :return: The load profile (a callable mapping elapsed seconds to events per second)
+    """
+    return lambda elapsed: rate
+
+
+def square_wave_profile(base_rate, burst_rate, period, duty=0.5):
+    """
+    Returns a load profile that alternates between a base rate and periodic bursts.
+
+    :param base_rate: The number of events per second outside of bursts
+    :param burst_rate: The number of events per second during bursts
+    :param period: The length (in seconds) of each base/burst cycle
+    :param duty: The fraction of each cycle spent bursting
+    :return: The load profile (a callable mapping elapsed seconds to events per second)
+    """
+    return lambda elapsed: burst_rate if (elapsed % period) < period * duty else base_rate
+
+
+def ramp_profile(start_rate, end_rate, duration):
+    """
+    Returns a load profile that increases (or decreases) the rate linearly over time.
+
+    :param start_rate: The number of events per second at the start of the ramp
+    :param end_rate: The number of events per second at the end of the ramp
+    :param duration: The length (in seconds) of the ramp
+    :return: The load profile (a callable mapping elapsed seconds to events per second)
+    """
+    return lambda elapsed: start_rate + (end_rate - start_rate) * min(1.0, elapsed / float(duration))
+
+
+def create_sample_threat_event(index, host_count=100, threat_names=("ExP:Heap", "GenericRXAA-AA!", "Trojan")):
+    """
+    Creates a varied sample threat event ``dict`` (dictionary) for load testing.
+
+    :param index: The index of the event, used to vary its properties
+    :param host_count: The number of distinct hosts to spread events across
+    :param threat_names: The threat names to cycle through
+    :return: The threat event ``dict`` (dictionary)
+    """
+    host = index % host_count
+    return create_threat_event(
+        event={
+            EventProps.CATEGORY: "Host intrusion buffer overflow",
+            EventProps.EVENT_ID: index,
+            EventProps.THREAT_ACTION_TAKEN: "blocked",
+            EventProps.THREAT_HANDLED: index % 2,
+            EventProps.THREAT_NAME: threat_names[index % len(threat_names)],
+            EventProps.THREAT_SEVERITY: 1 + index % 7,
+            EventProps.THREAT_TYPE: "Exploit Prevention" if index % 3 else "Malware"
+        },
+        analyzer={
+            AnalyzerProps.HOST_NAME: "HOST-{0}".format(host),
+            AnalyzerProps.NAME: "McAfee Endpoint Security"
+        },
+        entity={
+            EntityProps.ID: "00000000-0000-0000-0000-{0:012d}".format(host),
+            EntityProps.TYPE: "device"
+        },
+        source={
+            SourceProps.IPV4: "10.0.{0}.{1}".format(host // 256 % 256, host % 256)
+        })
+
+
+class LoadGenerator(object):
+    """
+    Injects threat events into an :class:`InMemoryFabric` following a load profile.
+
+    A load profile is a callable that maps the number of seconds elapsed since the start of the run to
+    the desired injection rate (events per second). See :func:`constant_profile`,
+    :func:`square_wave_profile` and :func:`ramp_profile`.
+
+    Payloads are encoded once up-front (cycling through ``payload_count`` distinct events) so that the
+    generator itself does not limit the achievable rate.
+    """
+
+    # The granularity (in seconds) at which the generator paces injection
+    _TICK = 0.005
+
+    def __init__(self, fabric, topic, profile, payload_factory=create_sample_threat_event, payload_count=1000):
+        """
+        Constructor parameters:
+
+        :param fabric: The :class:`InMemoryFabric` to inject events into
+        :param topic: The topic to publish events to
+        :param profile: The load profile (a callable mapping elapsed seconds to events per second)
+        :param payload_factory: A callable mapping an index to a threat event ``dict`` (or payload)
+        :param payload_count: The number of distinct payloads to cycle through
+        """
+        self._fabric = fabric
+        self._topic = topic
+        self._profile = profile
+        encoder = json.JSONEncoder(separators=(",", ":"))
+        self._payloads = []
+        for i in range(payload_count):
+            payload = payload_factory(i)
+            if isinstance(payload, dict):
+                payload = encoder.encode(payload)
+            if not isinstance(payload, bytes):
+                payload = payload.encode("utf-8")
+            self._payloads.append(payload)
+
+    def run(self, duration=None, count=None):
+        """
+        Injects events until ``duration`` seconds have elapsed or ``count`` events have been injected.
+
+        :param duration: The maximum amount of time (in seconds) to inject events for
+        :param count: The maximum number of events to inject
+        :return: A ``dict`` (dictionary) containing the ``sent`` and ``dropped`` event counts, the
+            ``elapsed`` time (in seconds) and the achieved ``rate`` (events per second)
+        """
+        if duration is None and count is None:
+            raise ValueError("A duration or count must be specified")
+        payloads = itertools.cycle(self._payloads)
+        start = time.time()
+        sent = dropped = 0
+        owed = 0.0
+        last = start
+        while True:
+            now = time.time()
+            elapsed = now - start
+            if (duration is not None and elapsed >= duration) or (count is not None and sent + dropped >= count):
+                break
+            owed += self._profile(elapsed) * (now - last)
+            last = now
+            to_send = int(owed)
+            if count is not None:
+                to_send = min(to_send, count - sent - dropped)
+            owed -= to_send
+            for _ in range(to_send):
+                if self._fabric.publish(self._topic, next(payloads)):
+                    sent += 1
+                else:
+                    dropped += 1
+            if not to_send:
+                time.sleep(self._TICK)
+        elapsed = time.time() - start
+        return {
+            "sent": sent,
+            "dropped": dropped,
+            "elapsed": elapsed,
+            "rate": sent / elapsed if elapsed else 0.0
+        }
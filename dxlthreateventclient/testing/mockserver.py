@@ -0,0 +1,316 @@
+import json
+import logging
+import random
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, BaseRequestHandler, TCPServer, UDPServer
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, BaseRequestHandler, TCPServer, UDPServer
+
+# Configure local logger
+logger = logging.getLogger(__name__)
+
+
+class _MockServer(object):
+    """
+    Base class for the mock sink servers.
+    """
+
+    def __init__(self, latency=0.0):
+        self._latency = latency
+        self._lock = threading.Condition()
+        self._server = None
+        self._thread = None
+        self._received = []
+        self._connections = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _create_server(self):
+        raise NotImplementedError()
+
+    def start(self):
+        """
+        Starts the server on a background thread.
+        """
+        self._server = self._create_server()
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="{0}".format(self.__class__.__name__))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    @property
+    def address(self):
+        """
+        The ``(host, port)`` the server is listening on
+        """
+        return self._server.server_address[:2]
+
+    @property
+    def received(self):
+        """
+        The threat event ``dict`` objects received (a ``list``)
+        """
+        with self._lock:
+            return list(self._received)
+
+    @property
+    def connection_count(self):
+        """
+        The number of connections accepted
+        """
+        with self._lock:
+            return self._connections
+
+    def _delay(self):
+        latency = self._latency
+        if isinstance(latency, tuple):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _connected(self):
+        with self._lock:
+            self._connections += 1
+
+    def _record(self, threat_event_dicts):
+        with self._lock:
+            self._received.extend(threat_event_dicts)
+            self._lock.notify_all()
+
+    def wait_for(self, count, timeout=None):
+        """
+        Waits until at least the specified number of threat events have been received.
+
+        :param count: The number of threat events
+        :param timeout: The maximum amount of time (in seconds) to wait (``None`` to wait indefinitely)
+        :return: ``True`` if the events were received, ``False`` otherwise
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while len(self._received) < count:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+            return True
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MockHttpHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.mock._connected()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        mock._delay()  # pylint: disable=protected-access
+        status = mock._next_status()  # pylint: disable=protected-access
+        if 200 <= status < 300:
+            mock._record([json.loads(line.decode("utf-8"))  # pylint: disable=protected-access
+                          for line in body.splitlines() if line.strip()])
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class MockHttpServer(_MockServer):
+    """
+    A local HTTP server that accepts batches of newline-delimited JSON threat events, used to exercise
+    :class:`dxlthreateventclient.sinks.HttpSink` without a SIEM.
+
+    The server can simulate a slow or unreliable endpoint via ``latency`` (seconds, or a ``(min, max)``
+    range) and ``failure_rate`` (the fraction of requests answered with ``failure_status``).
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            with MockHttpServer(latency=(0.01, 0.05), failure_rate=0.1) as server:
+                sink = HttpSink(server.url, batch_size=100)
+                ...
+                server.wait_for(10000, timeout=30)
+                print(server.request_count, server.connection_count)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0, failure_status=503):
+        """
+        Constructor parameters:
+
+        :param host: The host to listen on
+        :param port: The port to listen on (``0`` for an ephemeral port)
+        :param latency: The time (in seconds, or a ``(min, max)`` range) taken to answer each request
+        :param failure_rate: The fraction of requests that fail
+        :param failure_status: The HTTP status of failed requests
+        """
+        super(MockHttpServer, self).__init__(latency)
+        self._host = host
+        self._port = port
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self._requests = 0
+        self._failures = 0
+
+    def _create_server(self):
+        return _ThreadingHTTPServer((self._host, self._port), _MockHttpHandler)
+
+    @property
+    def url(self):
+        """
+        The URL of the server
+        """
+        return "http://{0}:{1}/".format(*self.address)
+
+    @property
+    def request_count(self):
+        """
+        The number of requests received
+        """
+        with self._lock:
+            return self._requests
+
+    @property
+    def failure_count(self):
+        """
+        The number of requests answered with a failure status
+        """
+        with self._lock:
+            return self._failures
+
+    def _next_status(self):
+        with self._lock:
+            self._requests += 1
+            if self.failure_rate and random.random() < self.failure_rate:
+                self._failures += 1
+                return self.failure_status
+        return 200
+
+
+def _parse_syslog_message(message):
+    """
+    Extracts the JSON threat event from the body of an RFC 5424 message without structured data.
+    """
+    return json.loads(message.split(b" ", 7)[7].decode("utf-8"))
+
+
+class _MockSyslogTcpHandler(BaseRequestHandler):
+
+    def handle(self):
+        mock = self.server.mock
+        mock._connected()  # pylint: disable=protected-access
+        buf = b""
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            buf += data
+            events = []
+            while True:
+                # Octet-counted framing: "<length> <message>"
+                space = buf.find(b" ")
+                if space < 0:
+                    break
+                length = int(buf[:space])
+                if len(buf) < space + 1 + length:
+                    break
+                events.append(_parse_syslog_message(buf[space + 1:space + 1 + length]))
+                buf = buf[space + 1 + length:]
+            if events:
+                mock._delay()  # pylint: disable=protected-access
+                mock._record(events)  # pylint: disable=protected-access
+
+
+class _MockSyslogUdpHandler(BaseRequestHandler):
+
+    def handle(self):
+        self.server.mock._record([_parse_syslog_message(self.request[0])])  # pylint: disable=protected-access
+
+
+class _ThreadingTCPServer(ThreadingMixIn, TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ThreadingUDPServer(ThreadingMixIn, UDPServer):
+    daemon_threads = True
+
+    # The requested size (in bytes) of the socket receive buffer, so that bursts of datagrams are buffered
+    # rather than dropped while they are being handled (the operating system may cap the size)
+    receive_buffer_size = 4 * 1024 * 1024
+
+    def server_bind(self):
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer_size)
+        except (OSError, socket.error):
+            logger.debug("Unable to set the UDP receive buffer size", exc_info=True)
+        UDPServer.server_bind(self)
+
+
+class MockSyslogServer(_MockServer):
+    """
+    A local syslog server that accepts RFC 5424 messages with JSON threat event bodies over TCP
+    (octet-counted framing) or UDP, used to exercise :class:`dxlthreateventclient.sinks.SyslogSink`.
+
+    UDP datagrams are handled on separate threads and the socket requests a large receive buffer, so that
+    bursts of datagrams are not dropped by the server itself.
+
+    **Example Usage**
+
+        .. code-block:: python
+
+            with MockSyslogServer(protocol="tcp") as server:
+                sink = SyslogSink(*server.address, protocol="tcp")
+                ...
+                server.wait_for(10000, timeout=30)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, protocol="tcp", latency=0.0):
+        """
+        Constructor parameters:
+
+        :param host: The host to listen on
+        :param port: The port to listen on (``0`` for an ephemeral port)
+        :param protocol: The transport protocol (``tcp`` or ``udp``)
+        :param latency: The time (in seconds, or a ``(min, max)`` range) taken to process each read (TCP only)
+        """
+        super(MockSyslogServer, self).__init__(latency)
+        if protocol not in ("tcp", "udp"):
+            raise ValueError("Unsupported protocol: {0}".format(protocol))
+        self._host = host
+        self._port = port
+        self._protocol = protocol
+
+    def _create_server(self):
+        if self._protocol == "tcp":
+            return _ThreadingTCPServer((self._host, self._port), _MockSyslogTcpHandler)
+        return _ThreadingUDPServer((self._host, self._port), _MockSyslogUdpHandler)
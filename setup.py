@@ -26,6 +26,12 @@ dist = setup(
         "dxlclient"
     ],
 
+    # Optional requirements
+    extras_require={
+        # Accelerates dxlthreateventclient.codec (requires strict_map_key support)
+        "msgpack": ["msgpack>=0.6.1,<2"]
+    },
+
     # Package author details:
     author="",
 
@@ -39,7 +45,8 @@ dist = setup(
     packages=[
         "dxlthreateventclient",
         "dxlthreateventclient._config",
-        "dxlthreateventclient._config.sample"],
+        "dxlthreateventclient._config.sample",
+        "dxlthreateventclient.testing"],
 
     package_data={
         "dxlthreateventclient._config.sample" : ['*']},
@@ -0,0 +1,93 @@
+import json
+import threading
+import unittest
+
+from dxlthreateventclient.callbacks import CommonThreatEventCallback
+from dxlthreateventclient.client import CommonThreatEventClient, ClientClosedError, \
+    EPO_THREAT_EVENT_RESPONSE_TOPIC
+from dxlthreateventclient.dispatch import PriorityDispatchCallback
+from dxlthreateventclient.testing import InMemoryFabric, FakeDxlClient
+
+
+def create_payload(index):
+    return json.dumps({"event": {"id": index, "threatSeverity": 3}}).encode("utf-8")
+
+
+class BlockingCallback(CommonThreatEventCallback):
+    """
+    Records the threat events it receives, blocking each one until ``release`` is set.
+    """
+
+    def __init__(self):
+        super(BlockingCallback, self).__init__()
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.received = []
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        self.started.set()
+        self.release.wait(5)
+        self.received.append(threat_event_dict["event"]["id"])
+
+
+class CommonThreatEventClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fabric = InMemoryFabric()
+        self.dxl_client = FakeDxlClient(self.fabric)
+        self.client = CommonThreatEventClient(self.dxl_client)
+
+    def tearDown(self):
+        self.fabric.close(5)
+
+    def test_drain_flushes_queued_events(self):
+        recorder = BlockingCallback()
+        dispatcher = PriorityDispatchCallback(recorder)
+        self.client.add_epo_threat_event_response_callback(dispatcher)
+        for index in range(5):
+            self.fabric.publish(EPO_THREAT_EVENT_RESPONSE_TOPIC, create_payload(index))
+        self.assertTrue(recorder.started.wait(5))
+        self.assertTrue(self.fabric.wait_until_idle(5))
+        threading.Timer(0.05, recorder.release.set).start()
+        result = self.client.drain(5)
+        self.assertEqual({"flushed": 5, "lost": 0, "in_flight": 0}, result)
+        self.assertEqual(list(range(5)), recorder.received)
+        self.assertEqual(result, dispatcher.get_drain_result())
+        # Drained callbacks are unregistered
+        self.fabric.publish(EPO_THREAT_EVENT_RESPONSE_TOPIC, create_payload(5))
+        self.assertTrue(self.fabric.wait_until_idle(5))
+        self.assertEqual(5, len(recorder.received))
+
+    def test_drain_timeout(self):
+        recorder = BlockingCallback()
+        dispatcher = PriorityDispatchCallback(recorder)
+        self.client.add_epo_threat_event_response_callback(dispatcher)
+        for index in range(3):
+            self.fabric.publish(EPO_THREAT_EVENT_RESPONSE_TOPIC, create_payload(index))
+        self.assertTrue(recorder.started.wait(5))
+        self.assertTrue(self.fabric.wait_until_idle(5))
+        self.assertFalse(dispatcher.close(0.1))
+        result = dispatcher.get_drain_result()
+        self.assertEqual(2, result["lost"])
+        self.assertEqual(1, result["in_flight"])
+        recorder.release.set()
+
+    def test_remove_with_drain(self):
+        dispatcher = PriorityDispatchCallback(BlockingCallback())
+        dispatcher.threat_event_callback.release.set()
+        self.client.add_epo_threat_event_response_callback(dispatcher)
+        self.assertIsNone(dispatcher.get_drain_result())
+        self.assertEqual({"flushed": 0, "lost": 0, "in_flight": 0},
+                         self.client.remove_epo_threat_event_response_callback(dispatcher, drain=True, timeout=5))
+
+    def test_closed(self):
+        publisher = self.client.create_threat_event_publisher("/topic")
+        self.assertEqual({"flushed": 0, "lost": 0, "in_flight": 0}, self.client.close(5))
+        self.assertFalse(publisher.publish({"id": 1}))
+        self.assertRaises(ClientClosedError, self.client.add_epo_threat_event_response_callback,
+                          BlockingCallback())
+        self.assertRaises(ClientClosedError, self.client.create_threat_event_publisher, "/topic")
+
+
+if __name__ == "__main__":
+    unittest.main()
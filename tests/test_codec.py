@@ -0,0 +1,111 @@
+import io
+import unittest
+
+from dxlthreateventclient import codec as codec_module
+from dxlthreateventclient.codec import ThreatEventCodec, ThreatEventStreamDecoder, IncompleteRecordError, \
+    KEY_DICTIONARY
+from dxlthreateventclient.testing import create_sample_threat_event
+
+# The first entries of the key dictionary, which must never change
+KEY_DICTIONARY_PREFIX = [
+    "eventMessageType", "eventMessageVersion", "event", "_receivedUTC", "category", "eventDesc", "id",
+    "threatActionTaken", "threatHandled", "threatName", "threatSeverity", "threatType", "uri", "analyzer"
+]
+
+
+def create_codecs():
+    codecs = [ThreatEventCodec(use_msgpack=False)]
+    if codec_module.msgpack is not None:
+        codecs.append(ThreatEventCodec(use_msgpack=True))
+    return codecs
+
+
+class KeyDictionaryTest(unittest.TestCase):
+
+    def test_no_duplicates(self):
+        self.assertEqual(len(KEY_DICTIONARY), len(set(KEY_DICTIONARY)))
+
+    def test_append_only(self):
+        self.assertEqual(KEY_DICTIONARY_PREFIX, KEY_DICTIONARY[:len(KEY_DICTIONARY_PREFIX)])
+
+    def test_unknown_index(self):
+        # A fixext 1 map key holding an index beyond the end of the dictionary
+        record = b"\x81\xd4\x01\xff\xc0"
+        for codec in create_codecs():
+            self.assertRaises(ValueError, codec.decode, record)
+
+
+class ThreatEventCodecTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        threat_event_dicts = [create_sample_threat_event(index) for index in range(50)]
+        threat_event_dicts.append({
+            "event": {"threatName": u"café", "threatSeverity": -3, "threatHandled": False,
+                      "otherData": {"large": 2 ** 40, "float": 1.5, "none": None, "empty": "", "list": [1, "a"]}},
+            "unknownKey": "value"
+        })
+        for codec in create_codecs():
+            for threat_event_dict in threat_event_dicts:
+                self.assertEqual(threat_event_dict, codec.decode(codec.encode(threat_event_dict)))
+
+    def test_identical_output(self):
+        if codec_module.msgpack is None:
+            self.skipTest("msgpack is not installed")
+        threat_event_dict = create_sample_threat_event(1)
+        self.assertEqual(ThreatEventCodec(use_msgpack=False).encode(threat_event_dict),
+                         ThreatEventCodec(use_msgpack=True).encode(threat_event_dict))
+
+    def test_integer_keys(self):
+        # Integer keys must not be confused with key dictionary indexes (including indexes 0, 1 and 53+)
+        threat_event_dict = {"event": {"otherData": dict((index, index) for index in
+                                                         (0, 1, 2, 53, 54, 255, 256, 70000, -1))}}
+        for codec in create_codecs():
+            decoded = codec.decode(codec.encode(threat_event_dict))
+            self.assertEqual(threat_event_dict, decoded)
+            self.assertTrue(all(isinstance(key, int) for key in decoded["event"]["otherData"]))
+
+    def test_set_values(self):
+        for codec in create_codecs():
+            decoded = codec.decode(codec.encode({"event": {"files": {"a"}}}))
+            self.assertEqual({"event": {"files": ["a"]}}, decoded)
+
+    def test_decode_requires_one_record(self):
+        for codec in create_codecs():
+            record = codec.encode({"event": {}})
+            self.assertRaises(ValueError, codec.decode, record + record)
+            self.assertRaises(ValueError, codec.decode, record[:-1])
+
+
+class StreamDecodingTest(unittest.TestCase):
+
+    def test_decode_stream_chunks(self):
+        threat_event_dicts = [create_sample_threat_event(index) for index in range(20)]
+        for codec in create_codecs():
+            stream = codec.encode_many(threat_event_dicts)
+            chunks = [stream[i:i + 7] for i in range(0, len(stream), 7)]
+            self.assertEqual(threat_event_dicts, list(codec.decode_stream(chunks)))
+            self.assertEqual(threat_event_dicts, list(codec.decode_stream(io.BytesIO(stream))))
+
+    def test_decode_stream_incomplete(self):
+        for codec in create_codecs():
+            stream = codec.encode_many([{"event": {}}, {"event": {"threatName": "Threat"}}])
+            decoded = []
+            with self.assertRaises(IncompleteRecordError):
+                for threat_event_dict in codec.decode_stream([stream[:-2]]):
+                    decoded.append(threat_event_dict)
+            self.assertEqual([{"event": {}}], decoded)
+
+    def test_pending_bytes(self):
+        for codec in create_codecs():
+            record = codec.encode(create_sample_threat_event(1))
+            decoder = ThreatEventStreamDecoder(codec)
+            decoder.feed(record[:10])
+            self.assertEqual([], list(decoder))
+            self.assertEqual(10, decoder.pending_bytes)
+            decoder.feed(record[10:])
+            self.assertEqual(1, len(list(decoder)))
+            self.assertEqual(0, decoder.pending_bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+
+from dxlthreateventclient.constants import ThreatEventProps, EventProps, AnalyzerProps, EntityProps
+from dxlthreateventclient.correlation import CorrelationEngine, DistinctCountRule, SequenceRule
+
+THREAT_NAME = (ThreatEventProps.EVENT, EventProps.THREAT_NAME)
+THREAT_TYPE = (ThreatEventProps.EVENT, EventProps.THREAT_TYPE)
+HOST_NAME = (ThreatEventProps.EVENT, EventProps.ANALYZER, AnalyzerProps.HOST_NAME)
+ENTITY_ID = (ThreatEventProps.EVENT, EventProps.ENTITY, EntityProps.ID)
+
+
+def create_event(threat_name="Threat", threat_type="Malware", host_name="HOST", entity_id=None):
+    return {ThreatEventProps.EVENT: {
+        EventProps.THREAT_NAME: threat_name,
+        EventProps.THREAT_TYPE: threat_type,
+        EventProps.ANALYZER: {AnalyzerProps.HOST_NAME: host_name},
+        EventProps.ENTITY: {EntityProps.ID: entity_id}
+    }}
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CorrelationEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.matches = []
+        self.engine = CorrelationEngine(match_callback=self.matches.append, clock=self.clock)
+
+    def test_distinct_count(self):
+        self.engine.add_rule(DistinctCountRule("widespread", THREAT_NAME, ENTITY_ID, threshold=2, window=60))
+        for entity_id in ("a", "b", "a", "c", "d"):
+            self.engine.on_threat_event(create_event(entity_id=entity_id), None)
+        # Matches once when the third distinct entity is seen, not again while above the threshold
+        self.assertEqual(1, len(self.matches))
+        self.assertEqual("widespread", self.matches[0].rule_name)
+        self.assertEqual("Threat", self.matches[0].key)
+        self.assertEqual(["b", "a", "c"], self.matches[0].values)
+
+    def test_distinct_count_window(self):
+        self.engine.add_rule(DistinctCountRule("widespread", THREAT_NAME, ENTITY_ID, threshold=2, window=60))
+        for entity_id in ("a", "b"):
+            self.engine.on_threat_event(create_event(entity_id=entity_id), None)
+        self.clock.now += 61
+        self.engine.on_threat_event(create_event(entity_id="c"), None)
+        self.assertEqual([], self.matches)
+
+    def test_sequence(self):
+        self.engine.add_rule(SequenceRule("exploit-then-malware", HOST_NAME, [
+            {THREAT_TYPE: "Exploit Prevention"},
+            {THREAT_TYPE: ["Malware", "Trojan"]}
+        ], window=60))
+        # Out of order, then in order on another host
+        self.engine.on_threat_event(create_event(threat_type="Malware", host_name="A"), None)
+        self.engine.on_threat_event(create_event(threat_type="Exploit Prevention", host_name="A"), None)
+        self.engine.on_threat_event(create_event(threat_type="Malware", host_name="B"), None)
+        self.assertEqual([], self.matches)
+        self.clock.now += 10
+        self.engine.on_threat_event(create_event(threat_type="Trojan", host_name="A"), None)
+        self.assertEqual(1, len(self.matches))
+        self.assertEqual("A", self.matches[0].key)
+        self.assertEqual(["Exploit Prevention", "Trojan"],
+                         [threat_event_dict[ThreatEventProps.EVENT][EventProps.THREAT_TYPE]
+                          for threat_event_dict in self.matches[0].threat_event_dicts])
+        # The state is reset once the sequence completes
+        self.engine.on_threat_event(create_event(threat_type="Malware", host_name="A"), None)
+        self.assertEqual(1, len(self.matches))
+
+    def test_sequence_window(self):
+        self.engine.add_rule(SequenceRule("sequence", HOST_NAME, [
+            {THREAT_TYPE: "Exploit Prevention"},
+            {THREAT_TYPE: "Malware"}
+        ], window=60))
+        self.engine.on_threat_event(create_event(threat_type="Exploit Prevention"), None)
+        self.clock.now += 61
+        self.engine.on_threat_event(create_event(threat_type="Malware"), None)
+        self.assertEqual([], self.matches)
+
+    def test_sequence_requires_two_steps(self):
+        self.assertRaises(ValueError, SequenceRule, "sequence", HOST_NAME, [{THREAT_TYPE: "Malware"}], 60)
+
+    def test_remaining_conditions(self):
+        self.engine.add_rule(SequenceRule("sequence", HOST_NAME, [
+            {THREAT_TYPE: "Exploit Prevention", THREAT_NAME: "ExP:Heap"},
+            {THREAT_TYPE: "Malware"}
+        ], window=60))
+        self.engine.on_threat_event(create_event(threat_type="Exploit Prevention", threat_name="Other"), None)
+        self.engine.on_threat_event(create_event(threat_type="Malware"), None)
+        self.assertEqual([], self.matches)
+        self.engine.on_threat_event(create_event(threat_type="Exploit Prevention", threat_name="ExP:Heap"), None)
+        self.engine.on_threat_event(create_event(threat_type="Malware"), None)
+        self.assertEqual(1, len(self.matches))
+
+    def test_add_rule_replaces_index(self):
+        self.engine.add_rule(DistinctCountRule("first", THREAT_NAME, ENTITY_ID, threshold=0, window=60,
+                                               match={THREAT_TYPE: "Malware"}))
+        index = self.engine._index  # pylint: disable=protected-access
+        value_index = index[THREAT_TYPE]
+        self.engine.add_rule(DistinctCountRule("second", THREAT_NAME, ENTITY_ID, threshold=0, window=60,
+                                               match={THREAT_TYPE: "Malware"}))
+        # The previous index is left untouched for events being matched against it
+        self.assertEqual(1, len(value_index["Malware"]))
+        self.engine.on_threat_event(create_event(entity_id="a"), None)
+        self.assertEqual(["first", "second"], sorted(match.rule_name for match in self.matches))
+
+    def test_unhashable_value(self):
+        self.engine.add_rule(DistinctCountRule("widespread", THREAT_NAME, ENTITY_ID, threshold=0, window=60,
+                                               match={THREAT_TYPE: "Malware"}))
+        self.engine.on_threat_event(create_event(threat_type=["Malware"], entity_id="a"), None)
+        self.assertEqual([], self.matches)
+
+    def test_max_keys(self):
+        self.engine.add_rule(SequenceRule("sequence", HOST_NAME, [
+            {THREAT_TYPE: "Exploit Prevention"},
+            {THREAT_TYPE: "Malware"}
+        ], window=60, max_keys=2))
+        for host_name in ("A", "B", "C"):
+            self.engine.on_threat_event(create_event(threat_type="Exploit Prevention", host_name=host_name), None)
+        stats = self.engine.get_stats()
+        self.assertEqual({"keys": 2, "evicted": 1}, stats["rules"]["sequence"])
+        # The least recently updated key was evicted
+        self.engine.on_threat_event(create_event(threat_type="Malware", host_name="A"), None)
+        self.engine.on_threat_event(create_event(threat_type="Malware", host_name="C"), None)
+        self.assertEqual(["C"], [match.key for match in self.matches])
+        self.assertEqual(1, self.engine.get_stats()["matches"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+
+from dxlthreateventclient.callbacks import CommonThreatEventCallback
+from dxlthreateventclient.dispatch import TokenBucket, PriorityDispatchCallback
+
+
+def create_event(severity, name=None):
+    return {"event": {"threatSeverity": severity, "threatName": name}}
+
+
+class RecordingCallback(CommonThreatEventCallback):
+    """
+    Records the threat events it receives. The first event blocks until ``release`` is set, so events queue
+    up behind it.
+    """
+
+    def __init__(self, fail=False):
+        super(RecordingCallback, self).__init__()
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.received = []
+        self.fail = fail
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        self.started.set()
+        self.release.wait(5)
+        self.received.append(threat_event_dict)
+        if self.fail:
+            raise ValueError("Failed")
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        self.assertEqual(5, sum(1 for _ in range(10) if bucket.try_acquire()))
+        self.assertFalse(bucket.try_acquire())
+        self.assertAlmostEqual(0.01, bucket.time_until_available(), delta=0.005)
+        time.sleep(0.05)
+        self.assertTrue(bucket.try_acquire())
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+        bucket = TokenBucket(10)
+        with self.assertRaises(ValueError):
+            bucket.rate = -1
+
+
+class PriorityDispatchCallbackTest(unittest.TestCase):
+
+    def test_most_severe_first(self):
+        recorder = RecordingCallback()
+        dispatcher = PriorityDispatchCallback(recorder)
+        dispatcher.on_threat_event(create_event(4, "blocking"), None)
+        self.assertTrue(recorder.started.wait(5))
+        for severity in (7, 3, 5, 1):
+            dispatcher.on_threat_event(create_event(severity), None)
+        recorder.release.set()
+        self.assertTrue(dispatcher.close(5))
+        self.assertEqual([4, 1, 3, 5, 7], [e["event"]["threatSeverity"] for e in recorder.received])
+
+    def test_shed_least_severe_oldest_first(self):
+        recorder = RecordingCallback()
+        dispatcher = PriorityDispatchCallback(recorder, max_queue_size=3)
+        dispatcher.on_threat_event(create_event(1, "blocking"), None)
+        self.assertTrue(recorder.started.wait(5))
+        dispatcher.on_threat_event(create_event(6, "old"), None)
+        dispatcher.on_threat_event(create_event(6, "new"), None)
+        dispatcher.on_threat_event(create_event(2, "a"), None)
+        # The queue is full: the oldest severity 6 event makes room for a more severe event
+        dispatcher.on_threat_event(create_event(3, "b"), None)
+        # Nothing queued is less severe than a severity 7 event, so the incoming event is shed
+        dispatcher.on_threat_event(create_event(7, "c"), None)
+        stats = dispatcher.get_stats()
+        self.assertEqual(1, stats["shed"][6])
+        self.assertEqual(1, stats["shed"][7])
+        recorder.release.set()
+        self.assertTrue(dispatcher.close(5))
+        self.assertEqual(["blocking", "a", "b", "new"], [e["event"]["threatName"] for e in recorder.received])
+
+    def test_rate_limited(self):
+        recorder = RecordingCallback()
+        recorder.release.set()
+        dispatcher = PriorityDispatchCallback(recorder, rate=50, burst=1)
+        start = time.time()
+        for _ in range(6):
+            dispatcher.on_threat_event(create_event(3), None)
+        self.assertTrue(dispatcher.close(5))
+        self.assertEqual(6, len(recorder.received))
+        self.assertGreaterEqual(time.time() - start, 0.09)
+
+    def test_errors_not_counted_as_dispatched(self):
+        recorder = RecordingCallback(fail=True)
+        recorder.release.set()
+        dispatcher = PriorityDispatchCallback(recorder)
+        for _ in range(3):
+            dispatcher.on_threat_event(create_event(2), None)
+        self.assertTrue(dispatcher.close(5))
+        stats = dispatcher.get_stats()
+        self.assertEqual(0, stats["dispatched"])
+        self.assertEqual(3, stats["errors"])
+
+
+if __name__ == "__main__":
+    unittest.main()
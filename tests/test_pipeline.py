@@ -0,0 +1,138 @@
+import threading
+import unittest
+
+from dxlthreateventclient.callbacks import CommonThreatEventCallback
+from dxlthreateventclient.pipeline import ReloadableCallback, ThreatEventPipeline, compile_filter
+
+
+def create_event(index, severity=3, threat_type="Malware"):
+    return {"event": {"id": index, "threatSeverity": severity, "threatType": threat_type}}
+
+
+class RecordingSink(CommonThreatEventCallback):
+
+    def __init__(self, settings=None):
+        super(RecordingSink, self).__init__()
+        self.settings = settings
+        self.received = []
+        self.drained = 0
+        self.block = None
+        self.started = threading.Event()
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        self.started.set()
+        if self.block:
+            self.block.wait(5)
+        self.received.append(threat_event_dict["event"]["id"])
+
+    def drain(self, timeout=None):
+        self.drained += 1
+        return {"flushed": len(self.received)}
+
+
+class CompileFilterTest(unittest.TestCase):
+
+    def test_conditions(self):
+        self.assertTrue(compile_filter({"field": "event.threatType", "equals": "Malware"})(create_event(1)))
+        self.assertFalse(compile_filter({"field": "event.threatType", "in": ["Other"]})(create_event(1)))
+        self.assertTrue(compile_filter({"field": ["event", "threatType"], "not_in": ["Other"]})(create_event(1)))
+        in_range = compile_filter({"field": "event.threatSeverity", "min": 2, "max": 3})
+        self.assertEqual([False, True, True, False], [in_range(create_event(1, severity)) for severity in range(1, 5)])
+        self.assertRaises(ValueError, compile_filter, {"field": "event.threatSeverity"})
+
+    def test_incomparable_values(self):
+        in_range = compile_filter({"field": "event.threatSeverity", "max": 3})
+        self.assertFalse(in_range(create_event(1, "2")))
+        self.assertFalse(in_range(create_event(1, None)))
+        self.assertFalse(in_range({"event": {"threatSeverity": [1]}}))
+
+
+class ThreatEventPipelineTest(unittest.TestCase):
+
+    def test_routes(self):
+        malware, other = RecordingSink(), RecordingSink()
+        pipeline = ThreatEventPipeline.compile({
+            "filters": [{"field": "event.threatSeverity", "max": 4}],
+            "sinks": ["malware", "other"],
+            "routes": [{"field": "event.threatType", "value": "Malware", "sinks": ["malware"]},
+                       {"sinks": ["other"]}]
+        }, {"malware": malware, "other": other})
+        pipeline.process(create_event(1), None)
+        pipeline.process(create_event(2, threat_type="Trojan"), None)
+        pipeline.process(create_event(3, severity=5), None)
+        self.assertEqual([1], malware.received)
+        self.assertEqual([2], other.received)
+
+    def test_unknown_sink(self):
+        self.assertRaises(ValueError, ThreatEventPipeline.compile, {"sinks": ["missing"]}, {})
+
+
+class ReloadableCallbackTest(unittest.TestCase):
+
+    def test_reload(self):
+        first, second = RecordingSink(), RecordingSink()
+        callback = ReloadableCallback({"sinks": ["first"]}, {"first": first, "second": second})
+        callback.on_threat_event(create_event(1), None)
+        self.assertEqual({"flushed": 0, "lost": 0, "in_flight": 0}, callback.reload({"sinks": ["second"]}))
+        callback.on_threat_event(create_event(2), None)
+        self.assertEqual(([1], [2]), (first.received, second.received))
+        self.assertEqual(1, callback.generation)
+        # Sink instances from the registry are not drained on reload
+        self.assertEqual(0, first.drained)
+
+    def test_invalid_reload(self):
+        sink = RecordingSink()
+        callback = ReloadableCallback({"sinks": ["sink"]}, {"sink": sink})
+        pipeline = callback.pipeline
+        self.assertRaises(ValueError, callback.reload, {"sinks": ["missing"]})
+        self.assertIs(pipeline, callback.pipeline)
+
+    def test_factory_sinks(self):
+        created = []
+
+        def factory(settings):
+            sink = RecordingSink(settings)
+            created.append(sink)
+            return sink
+
+        callback = ReloadableCallback({"sinks": {"sink": {"url": "a"}}}, {"sink": factory})
+        # Unchanged settings reuse the sink, changed settings replace (and drain) it
+        callback.reload({"sinks": {"sink": {"url": "a"}}})
+        self.assertEqual(1, len(created))
+        callback.on_threat_event(create_event(1), None)
+        self.assertEqual({"flushed": 1, "lost": 0, "in_flight": 0}, callback.reload({"sinks": {"sink": {"url": "b"}}}))
+        self.assertEqual([1, 0], [sink.drained for sink in created])
+
+    def test_retire_does_not_block_reloads(self):
+        created = []
+
+        def factory(settings):
+            sink = RecordingSink(settings)
+            sink.block = settings.get("block")
+            created.append(sink)
+            return sink
+
+        block = threading.Event()
+        callback = ReloadableCallback({"sinks": {"sink": {"block": block}}}, {"sink": factory})
+        sender = threading.Thread(target=callback.on_threat_event, args=(create_event(1), None))
+        sender.start()
+        self.assertTrue(created[0].started.wait(5))
+        # The first reload waits for the event in flight on the previous pipeline
+        reloader = threading.Thread(target=callback.reload, args=({"sinks": {"sink": {}}},))
+        reloader.start()
+        while callback.generation < 1:
+            pass
+        finished = threading.Event()
+        threading.Thread(target=lambda: (callback.reload({"sinks": {"sink": {"id": 2}}}), finished.set())).start()
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(2, callback.generation)
+        self.assertTrue(reloader.is_alive())
+        block.set()
+        reloader.join(5)
+        sender.join(5)
+        self.assertEqual([1], created[0].received)
+        self.assertEqual(1, created[0].drained)
+
+
+if __name__ == "__main__":
+    unittest.main()
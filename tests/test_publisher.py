@@ -0,0 +1,88 @@
+import json
+import threading
+import unittest
+
+from dxlthreateventclient.constants import ThreatEventProps, EventProps, AnalyzerProps
+from dxlthreateventclient.publisher import ThreatEventPublisher, create_threat_event
+
+
+class RecordingDxlClient(object):
+    """
+    Records the DXL events sent through it, failing the sends of payloads that contain ``"fail"``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = []
+
+    def send_event(self, event):
+        if b"fail" in event.payload:
+            raise IOError("Send failed")
+        with self._lock:
+            self.events.append(event)
+
+
+class CreateThreatEventTest(unittest.TestCase):
+
+    def test_normalized(self):
+        threat_event_dict = create_threat_event(event={EventProps.THREAT_NAME: "ExP:Heap"},
+                                                analyzer={AnalyzerProps.HOST_NAME: "HOST"})
+        event = threat_event_dict[ThreatEventProps.EVENT]
+        self.assertEqual("ExP:Heap", event[EventProps.THREAT_NAME])
+        self.assertIsNone(event[EventProps.THREAT_SEVERITY])
+        self.assertEqual("HOST", event[EventProps.ANALYZER][AnalyzerProps.HOST_NAME])
+        self.assertIsNone(event[EventProps.ANALYZER][AnalyzerProps.IPV4])
+
+
+class ThreatEventPublisherTest(unittest.TestCase):
+
+    def test_synchronous(self):
+        client = RecordingDxlClient()
+        publisher = ThreatEventPublisher(client, "/topic")
+        self.assertTrue(publisher.publish({"id": 1}))
+        self.assertTrue(publisher.publish('{"id": 2}'))
+        self.assertEqual(["/topic", "/topic"], [event.destination_topic for event in client.events])
+        self.assertEqual([{"id": 1}, {"id": 2}], [json.loads(event.payload.decode("utf-8"))
+                                                  for event in client.events])
+        # Each send uses its own message
+        self.assertNotEqual(client.events[0].message_id, client.events[1].message_id)
+
+    def test_synchronous_failure(self):
+        publisher = ThreatEventPublisher(RecordingDxlClient(), "/topic")
+        self.assertFalse(publisher.publish({"id": "fail"}))
+        stats = publisher.get_stats()
+        self.assertEqual(0, stats["published"])
+        self.assertEqual(1, stats["errors"])
+
+    def test_throughput_mode(self):
+        client = RecordingDxlClient()
+        publisher = ThreatEventPublisher(client, "/topic", throughput_mode=True, flush_interval=0.01)
+        self.assertEqual(1000, publisher.publish_many({"id": i} for i in range(1000)))
+        result = publisher.close(5)
+        self.assertEqual(0, result["lost"])
+        self.assertEqual(set(range(1000)), set(json.loads(event.payload.decode("utf-8"))["id"]
+                                               for event in client.events))
+        self.assertEqual(1000, len(set(event.message_id for event in client.events)))
+
+    def test_closed(self):
+        for batch_size in (1, 10):
+            publisher = ThreatEventPublisher(RecordingDxlClient(), "/topic", batch_size=batch_size)
+            publisher.close(5)
+            self.assertFalse(publisher.publish({"id": 1}))
+            stats = publisher.get_stats()
+            self.assertEqual(0, stats["published"])
+            self.assertEqual(1, stats["dropped"])
+
+    def test_full_queue_not_published(self):
+        publisher = ThreatEventPublisher(RecordingDxlClient(), "/topic", batch_size=100, flush_interval=10,
+                                         max_queue_size=2, block_when_full=False)
+        results = [publisher.publish({"id": i}) for i in range(3)]
+        self.assertEqual([True, True, False], results)
+        stats = publisher.get_stats()
+        self.assertEqual(2, stats["published"])
+        self.assertEqual(1, stats["dropped"])
+        publisher.close(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+from dxlthreateventclient.rollup import CountMinSketch, TopK, HyperLogLog, TimeBucketRing, RollupCallback
+from dxlthreateventclient.testing import create_sample_threat_event
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 6000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def test_estimates(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for index in range(1000):
+            sketch.add("value{0}".format(index % 100))
+        sketch.add("frequent", 500)
+        self.assertEqual(1500, sketch.total)
+        # Estimates never undercount
+        self.assertTrue(all(sketch.estimate("value{0}".format(index)) >= 10 for index in range(100)))
+        self.assertGreaterEqual(sketch.estimate("frequent"), 500)
+        self.assertLessEqual(sketch.estimate("frequent"), 500 + 2 * 1500 // 64)
+        self.assertEqual(0, CountMinSketch().estimate("missing"))
+
+
+class TopKTest(unittest.TestCase):
+
+    def test_top(self):
+        for order in (["a"] * 5 + ["b"] * 11 + ["c"] * 2, ["c", "a", "b"] * 2 + ["a"] * 3 + ["b"] * 9):
+            top = TopK(k=2)
+            for value in order:
+                top.add(value)
+            self.assertEqual([("b", 11), ("a", 5)], top.get_top())
+            self.assertEqual([("b", 11)], top.get_top(1))
+
+    def test_counts(self):
+        top = TopK(k=2)
+        top.add("a", 5)
+        top.add("b", 11)
+        top.add("c", 2)
+        self.assertEqual([("b", 11), ("a", 5)], top.get_top())
+        top.add("c", 10)
+        self.assertEqual([("c", 12), ("b", 11)], top.get_top())
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_accuracy(self):
+        for distinct in (10, 1000, 50000):
+            hll = HyperLogLog()
+            for index in range(distinct):
+                hll.add("host-{0}".format(index))
+                hll.add("host-{0}".format(index))
+            self.assertAlmostEqual(distinct, hll.count(), delta=max(1, distinct * 0.05))
+
+    def test_merge(self):
+        first, second = HyperLogLog(10), HyperLogLog(10)
+        for index in range(3000):
+            (first if index % 2 else second).add(index)
+            first.add(index % 10)
+        first.merge(second)
+        self.assertAlmostEqual(3000, first.count(), delta=3000 * 0.1)
+        self.assertRaises(ValueError, first.merge, HyperLogLog(12))
+        self.assertRaises(ValueError, HyperLogLog, 3)
+
+
+class TimeBucketRingTest(unittest.TestCase):
+
+    def test_buckets(self):
+        ring = TimeBucketRing(bucket_seconds=60, bucket_count=3, max_keys=2)
+        ring.add("a", 0)
+        ring.add("a", 60)
+        ring.add("b", 61, 2)
+        ring.add("c", 62)
+        ring.add("a", 130)
+        self.assertEqual([(0, {"a": 1}), (60, {"a": 1, "b": 2, TimeBucketRing.OTHER: 1}), (120, {"a": 1})],
+                         ring.get_buckets(130))
+        # The oldest bucket is reused, and occurrences too old for the ring are ignored
+        ring.add("d", 180)
+        ring.add("e", 10)
+        self.assertEqual([(120, {"a": 1}), (180, {"d": 1})], ring.get_buckets(180, 2))
+        self.assertEqual({"a": 2, "b": 2, "d": 1, TimeBucketRing.OTHER: 1}, ring.get_totals(180))
+        self.assertEqual([(240, {}), (300, {}), (360, {})], ring.get_buckets(360))
+
+
+class RollupCallbackTest(unittest.TestCase):
+
+    def test_rollups(self):
+        clock = Clock()
+        rollups = RollupCallback(top_k=3, bucket_seconds=60, bucket_count=5, clock=clock)
+        for index in range(200):
+            rollups.on_threat_event(create_sample_threat_event(index, host_count=20), None)
+        snapshot = rollups.snapshot(buckets=1)
+        self.assertEqual(200, snapshot["events"])
+        self.assertEqual(200, sum(snapshot["counts"]["severity"][0][1].values()))
+        self.assertEqual(3, len(snapshot["top"]["host_name"]))
+        self.assertTrue(all(count >= 10 for _, count in snapshot["top"]["host_name"]))
+        self.assertEqual(20, rollups.get_distinct("host_name"))
+        clock.now += 60
+        self.assertEqual({}, rollups.get_counts("threat_type", buckets=1)[0][1])
+        rollups.reset()
+        self.assertEqual(0, rollups.snapshot()["events"])
+
+
+if __name__ == "__main__":
+    unittest.main()
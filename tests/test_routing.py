@@ -0,0 +1,87 @@
+import unittest
+
+from dxlthreateventclient.callbacks import CommonThreatEventCallback
+from dxlthreateventclient.routing import ANY, RoutingTable, RoutingCallback
+
+THREAT_TYPE = ("event", "threatType")
+ANALYZER_NAME = ("event", "analyzer", "name")
+
+
+def create_event(threat_type="Malware", analyzer_name="ENS"):
+    return {"event": {"threatType": threat_type, "analyzer": {"name": analyzer_name}}}
+
+
+class Handler(CommonThreatEventCallback):
+
+    def __init__(self, name, fail=False):
+        super(Handler, self).__init__()
+        self.name = name
+        self.fail = fail
+        self.received = []
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        self.received.append(threat_event_dict)
+        if self.fail:
+            raise ValueError("Failed")
+
+    def __repr__(self):
+        return self.name
+
+
+class RoutingTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.malware = Handler("malware")
+        self.other = Handler("other")
+        self.ens = Handler("ens")
+        self.default = Handler("default")
+        self.table = RoutingTable()
+        self.table.add_route(self.malware, THREAT_TYPE, "Malware")
+        self.table.add_route(self.other, THREAT_TYPE, ANY)
+        self.table.add_route(self.ens, ANALYZER_NAME, "ENS")
+        self.table.add_route(self.default)
+
+    def test_route(self):
+        self.assertEqual([self.malware, self.ens], self.table.route(create_event()))
+        self.assertEqual([self.other], self.table.route(create_event("Trojan", "Other")))
+        self.assertEqual([self.other], self.table.route({"event": {}}))
+        self.table.remove_handler(self.other)
+        self.assertEqual([self.default], self.table.route(create_event("Trojan", "Other")))
+
+    def test_unhashable_value(self):
+        self.assertEqual([self.other], self.table.route(create_event(["Malware"], "Other")))
+        self.assertRaises(TypeError, self.table.add_route, self.malware, THREAT_TYPE, ["Malware"])
+
+    def test_distinct_handlers(self):
+        self.table.add_route(self.malware, ANALYZER_NAME, "ENS")
+        self.table.add_routes(self.malware, THREAT_TYPE, ["Malware", "Trojan"])
+        self.assertEqual([self.malware, self.ens], self.table.route(create_event()))
+        self.assertEqual([self.malware, self.other, self.ens, self.default], self.table.handlers)
+
+    def test_order_follows_routes(self):
+        # The order of the handlers does not depend on how the field paths hash
+        table = RoutingTable()
+        handlers = [Handler(str(index)) for index in range(20)]
+        event = {"event": {}}
+        for index, handler in enumerate(handlers):
+            field = "field{0}".format((index * 7) % 20)
+            event["event"][field] = index
+            table.add_route(handler, ("event", field), index)
+        self.assertEqual(handlers, table.route(event))
+
+
+class RoutingCallbackTest(unittest.TestCase):
+
+    def test_dispatch(self):
+        malware = Handler("malware", fail=True)
+        callback = RoutingCallback()
+        callback.routing_table.add_route(malware, THREAT_TYPE, "Malware")
+        callback.on_threat_event(create_event(), None)
+        callback.on_threat_event(create_event("Trojan"), None)
+        self.assertEqual(1, len(malware.received))
+        self.assertEqual({"routed": 1, "unrouted": 1, "errors": 1}, callback.get_stats())
+        self.assertEqual({"flushed": 0, "lost": 0, "in_flight": 0}, callback.drain(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+import unittest
+
+from dxlclient.message import Event
+
+from dxlthreateventclient.callbacks import CommonThreatEventCallback
+from dxlthreateventclient.sampling import ThreatEventSampler, SamplingCallback, parse_sampling_header
+
+
+def create_event(index, severity=4, threat_type="Malware"):
+    event = Event("/topic")
+    event.payload = json.dumps({"event": {"id": index, "threatSeverity": severity,
+                                          "threatType": threat_type}}).encode("utf-8")
+    return event
+
+
+class RecordingCallback(CommonThreatEventCallback):
+
+    def __init__(self):
+        super(RecordingCallback, self).__init__()
+        self.received = []
+        self.delivered = threading.Event()
+
+    def on_threat_event(self, threat_event_dict, original_event):
+        self.received.append(threat_event_dict["event"]["id"])
+        self.delivered.set()
+
+
+class ParseSamplingHeaderTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual((2, "Exploit Prevention"), parse_sampling_header(
+            b'{"event": {"threatSeverityString": "9", "threatSeverity": "2", "threatType": "Exploit Prevention"}}'))
+        self.assertEqual((7, u"A \"quoted\" type"), parse_sampling_header(
+            b'{"event": {"threatType": "A \\"quoted\\" type"}}'))
+
+
+class ThreatEventSamplerTest(unittest.TestCase):
+
+    def test_rates(self):
+        sampler = ThreatEventSampler(rates={"Malware": 0.0}, default_rate=1.0, always_keep_severity=2)
+        self.assertFalse(sampler.should_keep(4, "Malware"))
+        self.assertTrue(sampler.should_keep(2, "Malware"))
+        self.assertTrue(sampler.should_keep(4, "Other"))
+        counters = sampler.get_counters()
+        self.assertEqual({"seen": 2, "kept": 1, "weight": 2.0}, counters["Malware"])
+        self.assertEqual({"seen": 1, "kept": 1, "weight": 1.0}, counters["Other"])
+
+
+class SamplingCallbackTest(unittest.TestCase):
+
+    def test_raw_events_dispatched_once(self):
+        recorder = RecordingCallback()
+        sampling_callback = SamplingCallback(recorder, ThreatEventSampler(rates={"Malware": 0.0}))
+        for index in range(3):
+            sampling_callback.on_event(create_event(index))
+        sampling_callback.on_event(create_event(3, severity=1))
+        sampling_callback.on_event(create_event(4, threat_type="Other"))
+        self.assertEqual([3, 4], recorder.received)
+
+    def test_reservoir(self):
+        recorder = RecordingCallback()
+        sampler = ThreatEventSampler()
+        sampling_callback = SamplingCallback(recorder, sampler, reservoir_size=5, window=60)
+        for index in range(20):
+            sampling_callback.on_event(create_event(index))
+        # Always kept events bypass the reservoirs
+        sampling_callback.on_threat_event({"event": {"id": 100, "threatSeverity": 1, "threatType": "Malware"}},
+                                          None)
+        self.assertEqual([100], recorder.received)
+        self.assertEqual(5, sampling_callback.flush())
+        self.assertEqual(6, len(recorder.received))
+        self.assertTrue(all(0 <= index < 20 for index in recorder.received[1:]))
+        self.assertEqual({"seen": 21, "kept": 6, "weight": 3.5}, sampler.get_counters()["Malware"])
+
+    def test_reservoir_flushed_when_idle(self):
+        recorder = RecordingCallback()
+        sampling_callback = SamplingCallback(recorder, reservoir_size=5, window=0.05)
+        start = time.time()
+        sampling_callback.on_event(create_event(1))
+        # No further events arrive, the reservoir is delivered as its window ends
+        self.assertTrue(recorder.delivered.wait(5))
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        self.assertEqual([1], recorder.received)
+        self.assertEqual({"flushed": 0, "lost": 0, "in_flight": 0}, sampling_callback.drain(5))
+
+    def test_drain(self):
+        recorder = RecordingCallback()
+        sampling_callback = SamplingCallback(recorder, reservoir_size=5, window=60)
+        for index in range(3):
+            sampling_callback.on_event(create_event(index))
+        self.assertEqual({"flushed": 3, "lost": 0, "in_flight": 0}, sampling_callback.drain(5))
+        self.assertEqual([0, 1, 2], sorted(recorder.received))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import time
+import unittest
+
+from dxlthreateventclient.dispatch import TokenBucket
+from dxlthreateventclient.sinks import AimdRateController, HttpSink, SyslogSink
+from dxlthreateventclient.testing import MockHttpServer, MockSyslogServer, create_sample_threat_event
+
+
+class AimdRateControllerTest(unittest.TestCase):
+
+    def test_increase_and_decrease(self):
+        bucket = TokenBucket(100)
+        controller = AimdRateController(bucket, target_latency=0.05, min_rate=10, max_rate=105, increase=2)
+        controller(0.01, True)
+        self.assertEqual(102, bucket.rate)
+        controller(0.01, True)
+        controller(0.01, True)
+        self.assertEqual(105, bucket.rate)
+        # A slow delivery halves the rate, further slow deliveries within the target latency do not
+        controller(0.1, True)
+        self.assertEqual(52.5, bucket.rate)
+        controller(0.01, False)
+        self.assertEqual(52.5, bucket.rate)
+        time.sleep(0.06)
+        for _ in range(5):
+            controller(0.01, False)
+            time.sleep(0.06)
+        self.assertEqual(10, bucket.rate)
+
+    def test_requires_bucket(self):
+        self.assertRaises(ValueError, AimdRateController, None, 0.5, 10)
+
+
+class HttpSinkTest(unittest.TestCase):
+
+    def test_retries(self):
+        with MockHttpServer(failure_rate=0.3) as server:
+            sink = HttpSink(server.url, batch_size=10, flush_interval=0.01, max_retries=20, initial_backoff=0.001,
+                            max_backoff=0.01)
+            for index in range(200):
+                sink.on_threat_event(create_sample_threat_event(index), None)
+            result = sink.close(10)
+            self.assertEqual((0, 0), (result["lost"], result["in_flight"]))
+            stats = sink.get_stats()
+            self.assertEqual(200, stats["sent"])
+            self.assertEqual(0, stats["errors"])
+            self.assertEqual(server.failure_count, stats["retries"])
+            self.assertTrue(server.wait_for(200, timeout=5))
+
+    def test_not_retryable(self):
+        with MockHttpServer(failure_rate=1.0, failure_status=400) as server:
+            latencies = []
+            sink = HttpSink(server.url, batch_size=5, flush_interval=0.01, initial_backoff=0.001)
+            sink.add_latency_listener(lambda latency, success: latencies.append(success))
+            for index in range(5):
+                sink.on_threat_event(create_sample_threat_event(index), None)
+            sink.close(10)
+            stats = sink.get_stats()
+            self.assertEqual((0, 5, 0), (stats["sent"], stats["errors"], stats["retries"]))
+            self.assertEqual([False], latencies)
+
+
+class SyslogSinkTest(unittest.TestCase):
+
+    def test_protocols(self):
+        for protocol in ("tcp", "udp"):
+            with MockSyslogServer(protocol=protocol) as server:
+                sink = SyslogSink(*server.address, protocol=protocol, batch_size=100, flush_interval=0.01)
+                for index in range(500):
+                    sink.on_threat_event(create_sample_threat_event(index), None)
+                sink.close(10)
+                self.assertTrue(server.wait_for(500, timeout=5), protocol)
+                self.assertEqual(set(range(500)), set(event["event"]["id"] for event in server.received))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from dxlthreateventclient.constants import ThreatEventProps, EventProps, AnalyzerProps, EntityProps
+from dxlthreateventclient.statetracker import HostStateTracker
+
+
+def create_event(entity_id=None, host_name=None, threat_name="Threat", severity=3, handled=None):
+    return {ThreatEventProps.EVENT: {
+        EventProps.THREAT_NAME: threat_name,
+        EventProps.THREAT_SEVERITY: severity,
+        EventProps.THREAT_HANDLED: handled,
+        EventProps.ANALYZER: {AnalyzerProps.HOST_NAME: host_name},
+        EventProps.ENTITY: {EntityProps.ID: entity_id}
+    }}
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class HostStateTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_lookup(self):
+        tracker = HostStateTracker(clock=self.clock)
+        tracker.on_threat_event(create_event(host_name="A", severity=4, handled=0), None)
+        # The entity identifier becomes known, the state keyed by host name is adopted
+        tracker.on_threat_event(create_event(entity_id=1, host_name="A", severity=2, handled=0), None)
+        self.assertEqual(1, tracker.get_host_count())
+        state = tracker.get_host_state(entity_id=1)
+        self.assertEqual(2, state.event_count)
+        self.assertEqual(2, state.latest_severity)
+        self.assertEqual({"severity": 2, "count": 2, "first_seen": 1000.0, "last_seen": 1000.0},
+                         state.open_threats["Threat"])
+        self.assertEqual(state.to_dict(), tracker.get_host_state(host_name="A").to_dict())
+        tracker.on_threat_event(create_event(entity_id=1, handled=1), None)
+        self.assertEqual({}, tracker.get_host_state(entity_id=1).open_threats)
+
+    def test_host_name_change(self):
+        tracker = HostStateTracker(clock=self.clock)
+        tracker.on_threat_event(create_event(entity_id=1, host_name="A"), None)
+        # Host 2 is now known as A, then host 1 is renamed
+        tracker.on_threat_event(create_event(entity_id=2, host_name="A"), None)
+        tracker.on_threat_event(create_event(entity_id=1, host_name="B"), None)
+        self.assertEqual("B", tracker.get_host_state(host_name="B").host_name)
+        self.assertEqual(2, tracker.get_host_state(host_name="A").entity_id)
+
+    def test_lru_eviction(self):
+        tracker = HostStateTracker(max_hosts=2, clock=self.clock)
+        for entity_id in (1, 2, 1, 3):
+            tracker.on_threat_event(create_event(entity_id=entity_id), None)
+        self.assertIsNone(tracker.get_host_state(entity_id=2))
+        self.assertIsNotNone(tracker.get_host_state(entity_id=1))
+        self.assertEqual({"hosts": 2, "evicted": 1, "expired": 0}, tracker.get_stats())
+
+    def test_ttl(self):
+        tracker = HostStateTracker(ttl=60, clock=self.clock)
+        tracker.on_threat_event(create_event(entity_id=1, host_name="A"), None)
+        self.clock.now += 30
+        tracker.on_threat_event(create_event(entity_id=2), None)
+        self.clock.now += 31
+        # Expired hosts are not returned, even before they are removed
+        self.assertIsNone(tracker.get_host_state(host_name="A"))
+        self.assertIsNotNone(tracker.get_host_state(entity_id=2))
+        tracker.expire()
+        self.assertEqual({"hosts": 1, "evicted": 0, "expired": 1}, tracker.get_stats())
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "hosts.snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_snapshot_restore(self):
+        tracker = HostStateTracker(clock=self.clock)
+        for entity_id in range(5):
+            self.clock.now += 1
+            tracker.on_threat_event(create_event(entity_id=entity_id, host_name="HOST-{0}".format(entity_id),
+                                                 handled=0), None)
+        self.assertEqual(5, tracker.snapshot(self.path))
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+        restored = HostStateTracker(clock=self.clock)
+        self.assertEqual(5, restored.restore(self.path))
+        for entity_id in range(5):
+            self.assertEqual(tracker.get_host_state(entity_id=entity_id).to_dict(),
+                             restored.get_host_state(host_name="HOST-{0}".format(entity_id)).to_dict())
+
+    def test_restore_limits(self):
+        tracker = HostStateTracker(clock=self.clock)
+        for entity_id in range(5):
+            self.clock.now += 10
+            tracker.on_threat_event(create_event(entity_id=entity_id), None)
+        tracker.snapshot(self.path)
+
+        # Hosts 0 and 1 have expired, host 2 is the least recently updated of the remaining hosts
+        restored = HostStateTracker(max_hosts=2, ttl=25, clock=self.clock)
+        self.assertEqual(2, restored.restore(self.path))
+        self.assertEqual([None, None, None], [restored.get_host_state(entity_id=i) for i in range(3)])
+        self.assertEqual({"hosts": 2, "evicted": 1, "expired": 0}, restored.get_stats())
+
+    def test_restore_unsupported(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\x80")
+        self.assertRaises(ValueError, HostStateTracker().restore, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
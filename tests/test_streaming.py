@@ -0,0 +1,88 @@
+import json
+import unittest
+
+from dxlthreateventclient.streaming import StreamingThreatEventDecoder, StreamingDecodeCallback, skip_value
+from dxlthreateventclient.testing import create_sample_threat_event
+
+
+def create_payload():
+    threat_event_dict = create_sample_threat_event(1)
+    threat_event_dict["event"]["otherData"]["listOfPaths"] = "C:\\Windows\\" * 20
+    threat_event_dict["event"]["otherData"]["emoji"] = u"\U0001F600\u00e9\"quoted\"" * 10
+    threat_event_dict["event"]["otherData"]["nested"] = {"a": [1, 2.5, -3e2, True, None, {"b": "]}"}]}
+    threat_event_dict["event"]["files"] = [{"name": "file{0}".format(i)} for i in range(30)]
+    return json.dumps(threat_event_dict)
+
+
+class StreamingThreatEventDecoderTest(unittest.TestCase):
+
+    def assert_equivalent(self, payload, **kwargs):
+        """
+        Checks that the streaming and json.loads paths decode the payload identically.
+        """
+        streaming = StreamingThreatEventDecoder(streaming_threshold=0, **kwargs)
+        fallback = StreamingThreatEventDecoder(streaming_threshold=len(payload) + 1, **kwargs)
+        self.assertEqual(fallback.decode(payload), streaming.decode(payload.encode("utf-8")))
+        streaming_stats, fallback_stats = streaming.get_stats(), fallback.get_stats()
+        self.assertEqual((1, 0), (streaming_stats["streamed"], fallback_stats["streamed"]))
+        for key in ("truncated_strings", "truncated_arrays", "skipped_fields"):
+            self.assertEqual(fallback_stats[key], streaming_stats[key], key)
+        return streaming.decode(payload)
+
+    def test_no_limits(self):
+        payload = create_payload()
+        self.assertEqual(json.loads(payload), self.assert_equivalent(payload))
+
+    def test_limits(self):
+        for max_string_length in (1, 5, 13, 40):
+            self.assert_equivalent(create_payload(), max_string_length=max_string_length, max_array_items=3,
+                                   skip_fields=[("event", "analyzer")])
+
+    def test_truncate_by_decoded_length(self):
+        payload = json.dumps({"path": "C:\\" * 30, "escaped": u"\u00e9" * 15})
+        threat_event_dict = self.assert_equivalent(payload, max_string_length=40)
+        self.assertEqual("C:\\" * 13 + "C", threat_event_dict["path"])
+        # The escaped string decodes to fewer characters than the limit, so it is not truncated
+        self.assertEqual(u"\u00e9" * 15, threat_event_dict["escaped"])
+
+    def test_required_fields(self):
+        payload = create_payload()
+        for threshold in (0, len(payload) + 1):
+            decoder = StreamingThreatEventDecoder(required_fields=[("event", "threatSeverity")],
+                                                  streaming_threshold=threshold)
+            partials = []
+            self.assertIsNone(decoder.decode(payload, lambda partial: partials.append(dict(partial)) or False))
+            self.assertEqual(1, len(partials))
+            self.assertEqual(1, decoder.get_stats()["stopped"])
+
+    def test_invalid(self):
+        decoder = StreamingThreatEventDecoder(streaming_threshold=0)
+        for payload in ('[1]', '{"a": }', '{"a": "unterminated}', '{"a": 1} extra', '{"a" 1}'):
+            self.assertRaises(ValueError, decoder.decode, payload)
+
+    def test_skip_value(self):
+        text = '{"a": ["]", {"b": "}"}], "c": 1}, 2'
+        self.assertEqual(text.index(", 2"), skip_value(text, 0))
+        self.assertEqual(len('"x\\"y"'), skip_value('"x\\"y", 1', 0))
+
+
+class StreamingDecodeCallbackTest(unittest.TestCase):
+
+    def test_on_event(self):
+        received = []
+
+        class Recorder(object):
+            def on_threat_event(self, threat_event_dict, original_event):
+                received.append(threat_event_dict)
+
+        class Event(object):
+            payload = create_payload().encode("utf-8")
+
+        callback = StreamingDecodeCallback(Recorder(), StreamingThreatEventDecoder(max_array_items=2))
+        callback.on_event(Event())
+        self.assertEqual(2, len(received[0]["event"]["files"]))
+        self.assertEqual({"flushed": 0, "lost": 0, "in_flight": 0}, callback.drain(5))
+
+
+if __name__ == "__main__":
+    unittest.main()